@@ -296,19 +296,22 @@ if st.session_state.page_progress > 3:
     with col4_3:
         with st.container():
             st.write("")
-            st.button(
+            generate_clicked = st.button(
                 "Generate style transfer",
                 key="generate_text",
-                on_click=generate_style_transfer,
-                kwargs={
-                    "text_sample": text_sample,
-                    "style_data": STYLE_ATTRIBUTE_DATA,
-                    "max_gen_length": max_gen_length,
-                    "num_beams": num_beams,
-                    "temperature": temperature,
-                },
             )
 
+    # stream the suggestion into a placeholder as it is generated
+    if generate_clicked:
+        generate_style_transfer(
+            text_sample=text_sample,
+            style_data=STYLE_ATTRIBUTE_DATA,
+            max_gen_length=max_gen_length,
+            num_beams=num_beams,
+            temperature=temperature,
+            placeholder=st.empty(),
+        )
+
     if st.session_state.st_result:
         st.warning(
             f"""**{STYLE_ATTRIBUTE_DATA.source_attribute.capitalize()} Input:** "{text_sample}" """
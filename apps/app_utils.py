@@ -44,6 +44,7 @@ import tokenizers
 import streamlit as st
 
 from src.style_transfer import StyleTransfer
+from src.generation_cache import GenerationCache
 from src.style_classification import StyleIntensityClassifier
 from src.content_preservation import ContentPreservationScorer
 from src.transformer_interpretability import InterpretTransformer
@@ -226,37 +227,85 @@ def get_cps_metric(
     )
 
 
+@st.cache(allow_output_mutation=True, show_spinner=False)
+def get_cached_generation_cache() -> GenerationCache:
+    """
+    Return a generation cache shared across sessions and reruns of the app.
+
+    Entries are keyed by model, input text and generation parameters, so repeated
+    clicks with unchanged inputs skip beam search entirely.
+
+    Returns:
+        GenerationCache
+    """
+    return GenerationCache(max_size=1024, ttl=24 * 60 * 60)
+
+
+@st.cache(
+    hash_funcs={tokenizers.Tokenizer: lambda _: None},
+    allow_output_mutation=True,
+    show_spinner=False,
+)
+def get_cached_style_transfer(style_data: StyleAttributeData) -> StyleTransfer:
+    """
+    Return a cached style transfer model.
+
+    Generation parameters are applied per request with `with_generation_config`,
+    so moving the app sliders does not reload the model.
+
+    Args:
+        style_data (StyleAttributeData)
+
+    Returns:
+        StyleTransfer
+    """
+    return StyleTransfer(
+        model_identifier=style_data.seq2seq_model_path,
+        cache=get_cached_generation_cache(),
+    )
+
+
 def generate_style_transfer(
     text_sample: str,
     style_data: StyleAttributeData,
     max_gen_length: int,
     num_beams: int,
     temperature: int,
+    placeholder=None,
 ):
     """
     Run inference on seq2seq model and persist result to
     `session_state` varaible.
 
+    If a `placeholder` container is provided, partial output is rendered into it
+    as it is generated and the placeholder is cleared once generation completes.
+
     Args:
         text_sample (str): _description_
         style_data (StyleAttributeData): _description_
         max_gen_length (int): _description_
         num_beams (int): _description_
         temperature (int): _description_
+        placeholder (st.empty, optional): container to stream partial output into
     """
     with st.spinner("Transferring style, hang tight!"):
 
-        generate_kwargs = {
-            "max_gen_length": max_gen_length,
-            "num_beams": num_beams,
-            "temperature": temperature,
-        }
-
-        st_class = StyleTransfer(
-            model_identifier=style_data.seq2seq_model_path,
-            **generate_kwargs,
+        st_class = get_cached_style_transfer(style_data).with_generation_config(
+            max_gen_length=max_gen_length,
+            num_beams=num_beams,
+            temperature=temperature,
         )
 
-        st_result = st_class.transfer(text_sample)
+        if placeholder is None:
+            st_result = st_class.transfer(text_sample)
+        else:
+            # the stream yields nothing if the model generates no text
+            partial_text = ""
+            for partial_text in st_class.transfer_stream(text_sample):
+                placeholder.info(
+                    f"""**{style_data.target_attribute.capitalize()} Suggestion:** "{partial_text}" """
+                )
+            placeholder.empty()
+            st_result = [partial_text]
 
     st.session_state.st_result = st_result
@@ -0,0 +1,185 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+from apps.data_utils import DATA_PACKET
+from src.batching import TokenBudgetBatcher
+from src.attribution import make_attribution_method
+from src.content_preservation import ContentPreservationScorer
+
+
+def load_texts(path: str, style_data) -> list:
+    """
+    Load the `source` column of a TSV file, or fall back to the app's example
+    inputs for the given style attribute.
+
+    """
+    if path is None:
+        return list(style_data.examples)
+    return pd.read_csv(path, sep="\t", usecols=["source"]).dropna()["source"].tolist()
+
+
+def time_attribution(method, texts: list, class_index: int, repeats: int):
+    """
+    Best-of-`repeats` wall time for attributing `texts`, along with the attributions.
+
+    """
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        attributions = method.attribute(texts, class_index=class_index)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), attributions
+
+
+def top_k_agreement(attributions: list, reference: list, k: int) -> float:
+    """
+    Average overlap between the `k` tokens with the largest absolute score in each
+    text and the `k` largest according to the reference attributions.
+
+    """
+    overlaps = []
+    for item, reference_item in zip(attributions, reference):
+        num_top = min(k, len(item))
+        top = np.argsort(-np.abs([score for _, score in item]))[:num_top]
+        reference_top = np.argsort(-np.abs([score for _, score in reference_item]))
+        overlaps.append(len(set(top) & set(reference_top[:num_top])) / num_top)
+    return float(np.mean(overlaps))
+
+
+def mask_agreement(attributions: list, reference: list, threshold: float) -> float:
+    """
+    Share of texts for which style masking at `threshold` selects exactly the same
+    tokens as with the reference attributions.
+
+    """
+
+    def masks(items):
+        lengths = [len(item) for item in items]
+        scores = np.zeros((len(items), max(lengths)))
+        for row, item in zip(scores, items):
+            row[: len(item)] = [score for _, score in item]
+        return ContentPreservationScorer.select_style_token_mask(
+            scores, lengths, threshold
+        )
+
+    return float((masks(attributions) == masks(reference)).all(axis=1).mean())
+
+
+def benchmark_attribution_methods(args):
+    """
+    Compare approximate word attribution methods against 50-step integrated gradients.
+
+    For each style attribute, every method attributes the same texts with the style
+    classifier. The report covers wall time, speedup over the reference, the overlap of
+    the top-k tokens per text and the share of texts whose style mask is unchanged.
+
+    """
+    methods = [("integrated_gradients", steps) for steps in args.ig_steps] + [
+        (name, None) for name in ["gradient_x_input", "attention_rollout", "occlusion"]
+    ]
+    batcher = TokenBudgetBatcher(
+        max_tokens_per_batch=args.max_tokens_per_batch, batch_size=args.batch_size
+    )
+
+    for style in args.style or list(DATA_PACKET):
+        style_data = DATA_PACKET[style]
+        texts = load_texts(args.data, style_data)[: args.max_examples]
+        tokenizer = AutoTokenizer.from_pretrained(style_data.cls_model_path)
+        model = AutoModelForSequenceClassification.from_pretrained(
+            style_data.cls_model_path
+        )
+
+        reference_method = make_attribution_method(
+            "integrated_gradients", model, tokenizer, batcher=batcher, ig_steps=50
+        )
+        reference_elapsed, reference = time_attribution(
+            reference_method, texts, args.class_index, args.repeats
+        )
+
+        records = []
+        for name, steps in methods:
+            method = make_attribution_method(
+                name, model, tokenizer, batcher=batcher, ig_steps=steps or 50
+            )
+            elapsed, attributions = time_attribution(
+                method, texts, args.class_index, args.repeats
+            )
+            records.append(
+                {
+                    "method": name if steps is None else f"{name} ({steps} steps)",
+                    "elapsed": elapsed,
+                    "speedup": reference_elapsed / elapsed,
+                    f"top_{args.top_k}_agreement": top_k_agreement(
+                        attributions, reference, args.top_k
+                    ),
+                    "mask_agreement": mask_agreement(
+                        attributions, reference, args.threshold
+                    ),
+                }
+            )
+
+        print(
+            f"{style}: {len(texts)} texts, 50-step integrated gradients took "
+            f"{reference_elapsed:.3f}s"
+        )
+        print(pd.DataFrame.from_records(records).to_string(index=False))
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=benchmark_attribution_methods.__doc__)
+    parser.add_argument("--style", nargs="+", choices=list(DATA_PACKET))
+    parser.add_argument("--data", help="TSV file with a `source` column")
+    parser.add_argument("--ig-steps", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--class-index", type=int, default=0)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--max-examples", type=int, default=500)
+    parser.add_argument("--max-tokens-per-batch", type=int, default=8192)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    benchmark_attribution_methods(parser.parse_args())
@@ -0,0 +1,161 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from pyemd import emd
+
+from src.emd import batched_emd, sti_fraction
+
+
+def pyemd_sti_fraction(input_dists, output_dists, target_class_idx=1):
+    """
+    The per-pair pyemd implementation that `src.emd.sti_fraction` replaces.
+
+    """
+
+    def sti(input_dist, output_dist):
+        N = len(input_dist)
+        dist = emd(input_dist, output_dist, np.ones((N, N)))
+        direction = (
+            1 if output_dist[target_class_idx] >= input_dist[target_class_idx] else -1
+        )
+        return round(dist * direction, 4)
+
+    ideal_dist = np.zeros(input_dists.shape[-1])
+    ideal_dist[target_class_idx] = 1.0
+
+    fractions = []
+    for input_dist, output_dist in zip(input_dists, output_dists):
+        pair_sti = sti(input_dist, output_dist)
+        potential = sti(
+            input_dist,
+            ideal_dist if pair_sti > 0 else np.ascontiguousarray(ideal_dist[::-1]),
+        )
+        fractions.append(pair_sti / potential if potential else np.nan)
+    return np.array(fractions)
+
+
+def benchmark_emd(args):
+    """
+    Time batched STI fraction and EMD against per-pair pyemd calls.
+
+    The pyemd baselines run on the first `--num-baseline-pairs` pairs and are
+    extrapolated to the full set; outputs are compared on those pairs.
+
+    """
+    rng = np.random.default_rng(args.seed)
+    input_dists = rng.dirichlet(np.ones(args.num_classes), size=args.num_pairs)
+    output_dists = rng.dirichlet(np.ones(args.num_classes), size=args.num_pairs)
+    num_baseline = min(args.num_baseline_pairs, args.num_pairs)
+    ordinal_matrix = np.abs(
+        np.subtract.outer(np.arange(args.num_classes), np.arange(args.num_classes))
+    ).astype(np.float64)
+
+    records = []
+
+    start_time = time.perf_counter()
+    batched = sti_fraction(input_dists, output_dists)
+    batched_elapsed = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    baseline = pyemd_sti_fraction(
+        input_dists[:num_baseline], output_dists[:num_baseline]
+    )
+    baseline_elapsed = (
+        (time.perf_counter() - start_time) * args.num_pairs / num_baseline
+    )
+    records.append(
+        {
+            "metric": "sti_fraction (uniform)",
+            "pyemd_seconds": baseline_elapsed,
+            "batched_seconds": batched_elapsed,
+            "speedup": baseline_elapsed / batched_elapsed,
+            "max_abs_diff": np.nanmax(np.abs(batched[:num_baseline] - baseline)),
+        }
+    )
+
+    for name, ground_distance in [
+        ("emd (uniform)", np.ones((args.num_classes, args.num_classes))),
+        ("emd (ordinal)", ordinal_matrix),
+    ]:
+        start_time = time.perf_counter()
+        batched = batched_emd(input_dists, output_dists, ground_distance)
+        batched_elapsed = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        baseline = np.array(
+            [
+                emd(input_dist, output_dist, ground_distance)
+                for input_dist, output_dist in zip(
+                    input_dists[:num_baseline], output_dists[:num_baseline]
+                )
+            ]
+        )
+        baseline_elapsed = (
+            (time.perf_counter() - start_time) * args.num_pairs / num_baseline
+        )
+        records.append(
+            {
+                "metric": name,
+                "pyemd_seconds": baseline_elapsed,
+                "batched_seconds": batched_elapsed,
+                "speedup": baseline_elapsed / batched_elapsed,
+                "max_abs_diff": np.abs(batched[:num_baseline] - baseline).max(),
+            }
+        )
+
+    print(
+        f"{args.num_pairs} pairs of {args.num_classes}-class distributions "
+        f"(pyemd timed on {num_baseline} pairs and extrapolated)"
+    )
+    print(pd.DataFrame.from_records(records).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=benchmark_emd.__doc__)
+    parser.add_argument("--num-pairs", type=int, default=1_000_000)
+    parser.add_argument("--num-baseline-pairs", type=int, default=50_000)
+    parser.add_argument("--num-classes", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    benchmark_emd(parser.parse_args())
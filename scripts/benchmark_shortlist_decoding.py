@@ -0,0 +1,174 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import time
+import argparse
+
+import torch
+import pandas as pd
+
+from apps.data_utils import DATA_PACKET
+from src.style_transfer import StyleTransfer
+from src.shortlist import VocabularyShortlist
+
+
+def load_parallel_data(path: str, style_data) -> pd.DataFrame:
+    """
+    Load aligned `source`/`target` columns from a TSV file, or fall back to the
+    app's example inputs (with no targets) for the given style attribute.
+
+    """
+    if path is None:
+        return pd.DataFrame({"source": style_data.examples, "target": None})
+    return pd.read_csv(path, sep="\t", usecols=["source", "target"]).dropna()
+
+
+def time_transfer(style_transfer: StyleTransfer, texts: list, repeats: int):
+    """
+    Best-of-`repeats` wall time for transferring `texts`, along with the outputs.
+
+    """
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        outputs = style_transfer.transfer(texts)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), outputs
+
+
+def benchmark_shortlist_decoding(args):
+    """
+    Compare greedy decoding over the full vocabulary against shortlist decoding.
+
+    A shortlist is learned from the first `--train-fraction` of the parallel data
+    (or loaded from `--shortlist`) and both paths decode the remaining inputs. The
+    report covers wall time, speedup, the share of outputs identical to the
+    full-vocabulary path and the fallback rate for each confidence threshold.
+
+    """
+    style_data = DATA_PACKET[args.style]
+    data = load_parallel_data(args.data, style_data)
+    model_identifier = args.model or style_data.seq2seq_model_path
+
+    full = StyleTransfer(
+        model_identifier,
+        max_gen_length=args.max_gen_length,
+        num_beams=1,
+        batch_size=args.batch_size,
+    )
+    tokenizer = full.pipeline.tokenizer
+
+    if args.shortlist is not None:
+        shortlist = VocabularyShortlist.load(args.shortlist)
+        eval_data = data
+    elif data["target"].notna().all():
+        num_train = int(len(data) * args.train_fraction)
+        train_data, eval_data = data.iloc[:num_train], data.iloc[num_train:]
+        shortlist = VocabularyShortlist.from_parallel_data(
+            tokenizer,
+            train_data["source"].tolist(),
+            train_data["target"].tolist(),
+            num_frequent_tokens=args.num_frequent_tokens,
+        )
+    else:
+        shortlist = VocabularyShortlist.from_tokenizer(tokenizer)
+        eval_data = data
+
+    if args.save_shortlist is not None:
+        shortlist.save(args.save_shortlist)
+
+    texts = eval_data["source"].tolist()[: args.max_examples]
+    full_elapsed, full_outputs = time_transfer(full, texts, args.repeats)
+
+    records = [
+        {
+            "min_confidence": None,
+            "elapsed": full_elapsed,
+            "speedup": 1.0,
+            "agreement": 1.0,
+            "fallback_rate": 1.0,
+        }
+    ]
+    for min_confidence in args.min_confidence:
+        fast = StyleTransfer(
+            model_identifier,
+            max_gen_length=args.max_gen_length,
+            num_beams=1,
+            batch_size=args.batch_size,
+            vocabulary_shortlist=shortlist,
+            shortlist_min_confidence=min_confidence,
+        )
+        elapsed, outputs = time_transfer(fast, texts, args.repeats)
+        records.append(
+            {
+                "min_confidence": min_confidence,
+                "elapsed": elapsed,
+                "speedup": full_elapsed / elapsed,
+                "agreement": sum(a == b for a, b in zip(outputs, full_outputs))
+                / len(texts),
+                "fallback_rate": fast.shortlist_stats["fallback_rate"],
+            }
+        )
+
+    print(
+        f"{len(texts)} inputs, average shortlist size "
+        f"{fast.shortlist_stats['shortlist_size'] / fast.shortlist_stats['batches']:.0f} "
+        f"of {len(tokenizer)} tokens, {torch.get_num_threads()} threads"
+    )
+    print(pd.DataFrame.from_records(records).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=benchmark_shortlist_decoding.__doc__)
+    parser.add_argument("--style", default="subjective-to-neutral")
+    parser.add_argument("--model", help="overrides the style's seq2seq model")
+    parser.add_argument("--data", help="TSV file with `source` and `target` columns")
+    parser.add_argument("--shortlist", help="JSON shortlist written by `save`")
+    parser.add_argument("--save-shortlist", help="write the learned shortlist here")
+    parser.add_argument("--train-fraction", type=float, default=0.8)
+    parser.add_argument("--num-frequent-tokens", type=int, default=1000)
+    parser.add_argument(
+        "--min-confidence", type=float, nargs="+", default=[0.5, 0.7, 0.9]
+    )
+    parser.add_argument("--max-examples", type=int, default=500)
+    parser.add_argument("--max-gen-length", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    benchmark_shortlist_decoding(parser.parse_args())
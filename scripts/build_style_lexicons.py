@@ -0,0 +1,139 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import os
+import argparse
+
+import pandas as pd
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+from apps.data_utils import DATA_PACKET
+from src.batching import TokenBudgetBatcher
+from src.attribution import make_attribution_method
+from src.style_lexicon import LexiconAttribution, StyleLexicon, masking_agreement
+
+
+def load_texts(path: str, style_data) -> list:
+    """
+    Load the `source` column of a TSV file, or fall back to the app's example
+    inputs for the given style attribute.
+
+    """
+    if path is None:
+        return list(style_data.examples)
+    return pd.read_csv(path, sep="\t", usecols=["source"]).dropna()["source"].tolist()
+
+
+def build_style_lexicons(args):
+    """
+    Build a style lexicon per style attribute from batched word attributions.
+
+    The first `--train-fraction` of the corpus is attributed with the style classifier
+    and aggregated into a lexicon, written to `<output-dir>/<source>-<target>.json`.
+    The remaining texts are used to report how closely lexicon masking agrees with
+    attribution-based masking. Load a lexicon with `StyleLexicon.load` and pass it to
+    `ContentPreservationScorer(style_lexicon=..., attribution_method="lexicon")`.
+
+    """
+    os.makedirs(args.output_dir, exist_ok=True)
+    batcher = TokenBudgetBatcher(
+        max_tokens_per_batch=args.max_tokens_per_batch, batch_size=args.batch_size
+    )
+
+    records = []
+    for style in args.style or list(DATA_PACKET):
+        style_data = DATA_PACKET[style]
+        texts = load_texts(args.data, style_data)
+        num_train = max(int(len(texts) * args.train_fraction), 1)
+        train_texts, eval_texts = texts[:num_train], texts[num_train:]
+
+        tokenizer = AutoTokenizer.from_pretrained(style_data.cls_model_path)
+        model = AutoModelForSequenceClassification.from_pretrained(
+            style_data.cls_model_path
+        )
+        method = make_attribution_method(
+            args.attribution_method,
+            model,
+            tokenizer,
+            batcher=batcher,
+            ig_steps=args.ig_steps,
+        )
+
+        lexicon = StyleLexicon.from_attributions(
+            method.attribute(train_texts, class_index=args.class_index),
+            min_count=args.min_count,
+            max_size=args.max_size,
+            model_identifier=style_data.cls_model_path,
+            class_index=args.class_index,
+        )
+        path = os.path.join(
+            args.output_dir, f"{style_data.attribute_selecting_string}.json"
+        )
+        lexicon.save(path)
+
+        record = {"style": style, "path": path, "tokens": len(lexicon)}
+        if eval_texts:
+            record.update(
+                masking_agreement(
+                    LexiconAttribution(lexicon, tokenizer).attribute(eval_texts),
+                    method.attribute(eval_texts, class_index=args.class_index),
+                    threshold=args.threshold,
+                )
+            )
+        records.append(record)
+
+    print(pd.DataFrame.from_records(records).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=build_style_lexicons.__doc__)
+    parser.add_argument("--style", nargs="+", choices=list(DATA_PACKET))
+    parser.add_argument("--data", help="TSV file with a `source` column")
+    parser.add_argument("--output-dir", default="data/lexicons")
+    parser.add_argument("--train-fraction", type=float, default=0.8)
+    parser.add_argument("--attribution-method", default="integrated_gradients")
+    parser.add_argument("--ig-steps", type=int, default=50)
+    parser.add_argument("--class-index", type=int, default=0)
+    parser.add_argument("--min-count", type=int, default=2)
+    parser.add_argument("--max-size", type=int, default=None)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--max-tokens-per-batch", type=int, default=8192)
+    parser.add_argument("--batch-size", type=int, default=256)
+    build_style_lexicons(parser.parse_args())
@@ -0,0 +1,429 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import re
+import abc
+import inspect
+from typing import Any, List, Tuple
+
+import torch
+import numpy as np
+
+from src.batching import TokenBudgetBatcher
+
+ATTRIBUTION_METHODS = (
+    "integrated_gradients",
+    "gradient_x_input",
+    "attention_rollout",
+    "occlusion",
+)
+
+
+class TokenAttribution(abc.ABC):
+    """
+    Base class for batched word attribution methods on a sequence classifier.
+
+    Texts are tokenized the way `transformers_interpret` does it, and every method
+    returns L2-normalized (token, score) pairs in the format of its
+    `SequenceClassificationExplainer`, so the methods are interchangeable wherever
+    attributions are only used for ranking tokens (e.g. style masking). Special tokens
+    always get a score of zero.
+
+    Attributes:
+        model (PreTrainedModel) - sequence classification model to attribute, or None
+            for model-free methods
+        tokenizer (PreTrainedTokenizer) - tokenizer of `model`
+        batcher (TokenBudgetBatcher) - limits the rows and padded tokens per pass
+
+    """
+
+    def __init__(self, model, tokenizer, batcher: TokenBudgetBatcher = None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batcher = batcher or TokenBudgetBatcher()
+
+        self._accepts_position_ids = (
+            model is not None
+            and "position_ids" in inspect.signature(self.model.forward).parameters
+        )
+
+    def attribute(
+        self, input_text: List[str], class_index: int = 0
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Calculate word attributions for a list of texts.
+
+        Args:
+            input_text (List[str]) - texts to get attributions for
+            class_index (int) - output index to provide attributions for, ignored
+                for models with a single output node
+
+        Returns:
+            attributions (List[List[Tuple[str, float]]]) - (token, score) pairs for
+                every token of each text, including special tokens
+
+        """
+        input_ids = [
+            self.tokenizer.encode(self._clean_text(text), truncation=True)
+            for text in input_text
+        ]
+        baseline_ids = [self._make_baseline_ids(ids) for ids in input_ids]
+        scores = self._attribute(input_ids, baseline_ids, class_index)
+
+        attributions = []
+        for ids, score in zip(input_ids, scores):
+            # all-zero rows (nothing attributed) stay zero instead of becoming nan
+            score = score / torch.norm(score).clamp_min(1e-12)
+            tokens = [
+                token.replace("Ġ", "")
+                for token in self.tokenizer.convert_ids_to_tokens(ids)
+            ]
+            attributions.append(list(zip(tokens, score.tolist())))
+
+        return attributions
+
+    @abc.abstractmethod
+    def _attribute(
+        self,
+        input_ids: List[List[int]],
+        baseline_ids: List[List[int]],
+        class_index: int,
+    ) -> List[torch.Tensor]:
+        """
+        Unnormalized score per token of each text.
+
+        """
+
+    def _pad(self, rows: List[List[int]]) -> Tuple[torch.Tensor, torch.Tensor]:
+        # right-pad token ids into a batch along with its attention mask
+        max_length = max(len(row) for row in rows)
+        pad_id = self.tokenizer.pad_token_id
+        device = self.model.device
+        input_ids = torch.tensor(
+            [row + [pad_id] * (max_length - len(row)) for row in rows], device=device
+        )
+        attention_mask = torch.tensor(
+            [[1] * len(row) + [0] * (max_length - len(row)) for row in rows],
+            device=device,
+        )
+        return input_ids, attention_mask
+
+    def _target_probs(
+        self, class_index: int, **model_kwargs
+    ) -> Tuple[torch.Tensor, Any]:
+        input_tensor = model_kwargs.get("input_ids", model_kwargs.get("inputs_embeds"))
+        if self._accepts_position_ids:
+            # matches transformers_interpret, which always passes positions from zero
+            num_rows, max_length = input_tensor.shape[:2]
+            model_kwargs["position_ids"] = torch.arange(
+                max_length, device=input_tensor.device
+            ).expand(num_rows, -1)
+
+        outputs = self.model(**model_kwargs)
+        logits = outputs[0]
+        if logits.shape[-1] == 1:
+            probs = torch.sigmoid(logits)[:, 0]
+        else:
+            probs = torch.softmax(logits, dim=-1)[:, class_index]
+        return probs, outputs
+
+    def _make_baseline_ids(self, input_ids: List[int]) -> List[int]:
+        # keep the leading and trailing special tokens (e.g. [CLS], [SEP]) and pad the rest
+        pad_id = self.tokenizer.pad_token_id
+        if self.tokenizer.num_special_tokens_to_add(pair=False) == 0:
+            return [pad_id] * len(input_ids)
+        return input_ids[:1] + [pad_id] * (len(input_ids) - 2) + input_ids[-1:]
+
+    @staticmethod
+    def _clean_text(text: str) -> str:
+        # same whitespace normalization that transformers_interpret applies before tokenizing
+        text = re.sub("([.,!?()])", r" \1 ", text)
+        return re.sub(r"\s{2,}", " ", text)
+
+
+class BatchedIntegratedGradients(TokenAttribution):
+    """
+    Integrated-gradients word attributions for many texts at once.
+
+    This reproduces the word-embedding attributions of `transformers_interpret`'s
+    `SequenceClassificationExplainer` (Gauss-Legendre approximation, a [CLS] + [PAD]* + [SEP]
+    baseline, L2-normalized token scores), but rather than evaluating the interpolation
+    steps of one text at a time, every (text, step) pair becomes a row that is packed into
+    length-bucketed batches by a `TokenBudgetBatcher`. Rows from different texts share a
+    forward and backward pass, so a batch of short sentences costs little more than one.
+
+    Attributes:
+        n_steps (int) - number of interpolation steps per text
+
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        n_steps: int = 50,
+        batcher: TokenBudgetBatcher = None,
+    ):
+        super().__init__(model, tokenizer, batcher=batcher)
+        self.n_steps = n_steps
+
+        # gauss-legendre nodes and weights rescaled from [-1, 1] to [0, 1]
+        nodes, weights = np.polynomial.legendre.leggauss(n_steps)
+        self._alphas = (0.5 * (nodes + 1)).tolist()
+        self._weights = (0.5 * weights).tolist()
+
+    def _attribute(self, input_ids, baseline_ids, class_index):
+        rows = [
+            (text_idx, alpha, weight)
+            for text_idx in range(len(input_ids))
+            for alpha, weight in zip(self._alphas, self._weights)
+        ]
+        row_scores = self.batcher.run(
+            rows,
+            [len(input_ids[text_idx]) for text_idx, _, _ in rows],
+            lambda batch: self._attribute_batch(
+                batch, input_ids, baseline_ids, class_index
+            ),
+        )
+
+        scores = [torch.zeros(len(ids)) for ids in input_ids]
+        for (text_idx, _, _), row_score in zip(rows, row_scores):
+            scores[text_idx] += row_score
+        return scores
+
+    def _attribute_batch(
+        self,
+        rows: List[tuple],
+        input_ids: List[List[int]],
+        baseline_ids: List[List[int]],
+        class_index: int,
+    ) -> List[torch.Tensor]:
+        padded_inputs, attention_mask = self._pad(
+            [input_ids[text_idx] for text_idx, _, _ in rows]
+        )
+        padded_baselines, _ = self._pad(
+            [baseline_ids[text_idx] for text_idx, _, _ in rows]
+        )
+        device = padded_inputs.device
+        alphas = torch.tensor([alpha for _, alpha, _ in rows], device=device)
+        weights = torch.tensor([weight for _, _, weight in rows], device=device)
+
+        embeddings = self.model.get_input_embeddings()
+        with torch.no_grad():
+            input_embeds = embeddings(padded_inputs)
+            baseline_embeds = embeddings(padded_baselines)
+            delta = input_embeds - baseline_embeds
+
+        scaled_embeds = baseline_embeds + alphas[:, None, None] * delta
+        scaled_embeds.requires_grad_(True)
+
+        probs, _ = self._target_probs(
+            class_index, inputs_embeds=scaled_embeds, attention_mask=attention_mask
+        )
+
+        # rows are independent, so the gradient of the sum is each row's own gradient
+        (gradients,) = torch.autograd.grad(probs.sum(), scaled_embeds)
+        scores = (gradients * delta).sum(dim=-1) * weights[:, None]
+
+        return [
+            row_scores[: len(input_ids[text_idx])].detach().cpu()
+            for row_scores, (text_idx, _, _) in zip(scores, rows)
+        ]
+
+
+class GradientXInput(BatchedIntegratedGradients):
+    """
+    Gradient x input word attributions, i.e. a single gradient taken at the input
+    embeddings and multiplied by their difference from the baseline embeddings.
+
+    This costs one forward and backward pass per text, and equals integrated gradients
+    wherever the model is locally linear between the baseline and the input.
+
+    """
+
+    def __init__(self, model, tokenizer, batcher: TokenBudgetBatcher = None):
+        super().__init__(model, tokenizer, n_steps=1, batcher=batcher)
+        self._alphas, self._weights = [1.0], [1.0]
+
+
+class AttentionRollout(TokenAttribution):
+    """
+    Attention rollout word attributions (Abnar & Zuidema, 2020).
+
+    Head-averaged attention maps, mixed with the identity to account for residual
+    connections, are multiplied through the layers, and each token is scored by how much
+    the first ([CLS]) position attends to it. It needs a single forward pass per text and
+    no gradients, but the scores are non-negative and do not depend on `class_index`.
+
+    """
+
+    def _attribute(self, input_ids, baseline_ids, class_index):
+        return self.batcher.run(
+            list(range(len(input_ids))),
+            [len(ids) for ids in input_ids],
+            lambda batch: self._attribute_batch(batch, input_ids, baseline_ids),
+        )
+
+    def _attribute_batch(
+        self,
+        text_idxs: List[int],
+        input_ids: List[List[int]],
+        baseline_ids: List[List[int]],
+    ) -> List[torch.Tensor]:
+        padded_inputs, attention_mask = self._pad([input_ids[i] for i in text_idxs])
+        padded_baselines, _ = self._pad([baseline_ids[i] for i in text_idxs])
+
+        with torch.no_grad():
+            _, outputs = self._target_probs(
+                0,
+                input_ids=padded_inputs,
+                attention_mask=attention_mask,
+                output_attentions=True,
+            )
+
+            identity = torch.eye(padded_inputs.shape[1], device=padded_inputs.device)
+            rollout = identity.expand(len(text_idxs), -1, -1)
+            for attentions in outputs.attentions:
+                layer = 0.5 * attentions.mean(dim=1) + 0.5 * identity
+                layer = layer / layer.sum(dim=-1, keepdim=True)
+                rollout = layer @ rollout
+
+            # special tokens are not attributed, as with the other methods
+            scores = rollout[:, 0] * (padded_inputs != padded_baselines)
+
+        return [
+            row_scores[: len(input_ids[text_idx])].cpu()
+            for row_scores, text_idx in zip(scores, text_idxs)
+        ]
+
+
+class Occlusion(TokenAttribution):
+    """
+    Leave-one-out occlusion word attributions.
+
+    Each token is scored by how much the target class probability drops when that
+    token alone is replaced with the baseline (padding) token. All occluded copies of
+    all texts are packed into shared forward-only batches, one row per token.
+
+    """
+
+    def _attribute(self, input_ids, baseline_ids, class_index):
+        # position None is the unoccluded text
+        rows = [
+            (text_idx, position)
+            for text_idx, (ids, baseline) in enumerate(zip(input_ids, baseline_ids))
+            for position in [None]
+            + [idx for idx, (a, b) in enumerate(zip(ids, baseline)) if a != b]
+        ]
+        probs = self.batcher.run(
+            rows,
+            [len(input_ids[text_idx]) for text_idx, _ in rows],
+            lambda batch: self._occlude_batch(
+                batch, input_ids, baseline_ids, class_index
+            ),
+        )
+
+        full_probs = {
+            text_idx: prob
+            for (text_idx, position), prob in zip(rows, probs)
+            if position is None
+        }
+        scores = [torch.zeros(len(ids)) for ids in input_ids]
+        for (text_idx, position), prob in zip(rows, probs):
+            if position is not None:
+                scores[text_idx][position] = full_probs[text_idx] - prob
+        return scores
+
+    def _occlude_batch(
+        self,
+        rows: List[tuple],
+        input_ids: List[List[int]],
+        baseline_ids: List[List[int]],
+        class_index: int,
+    ) -> List[float]:
+        occluded = []
+        for text_idx, position in rows:
+            ids = list(input_ids[text_idx])
+            if position is not None:
+                ids[position] = baseline_ids[text_idx][position]
+            occluded.append(ids)
+        padded_inputs, attention_mask = self._pad(occluded)
+
+        with torch.no_grad():
+            probs, _ = self._target_probs(
+                class_index, input_ids=padded_inputs, attention_mask=attention_mask
+            )
+        return probs.tolist()
+
+
+def make_attribution_method(
+    name: str,
+    model,
+    tokenizer,
+    batcher: TokenBudgetBatcher = None,
+    ig_steps: int = 50,
+) -> TokenAttribution:
+    """
+    Build a word attribution method by name.
+
+    Args:
+        name (str) - one of `ATTRIBUTION_METHODS`
+        model (PreTrainedModel) - sequence classification model to attribute
+        tokenizer (PreTrainedTokenizer) - tokenizer of `model`
+        batcher (TokenBudgetBatcher) - limits the rows and padded tokens per pass
+        ig_steps (int) - number of interpolation steps for "integrated_gradients"
+
+    Returns:
+        TokenAttribution
+
+    """
+    if name == "integrated_gradients":
+        return BatchedIntegratedGradients(
+            model, tokenizer, n_steps=ig_steps, batcher=batcher
+        )
+    if name == "gradient_x_input":
+        return GradientXInput(model, tokenizer, batcher=batcher)
+    if name == "attention_rollout":
+        return AttentionRollout(model, tokenizer, batcher=batcher)
+    if name == "occlusion":
+        return Occlusion(model, tokenizer, batcher=batcher)
+    raise ValueError(
+        f"unknown attribution method {name!r}, expected one of {ATTRIBUTION_METHODS}"
+    )
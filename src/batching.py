@@ -0,0 +1,196 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+from typing import Any, Callable, List, Optional, Sequence
+
+
+class TokenBudgetBatcher:
+    """
+    Utility for running a model over variable-length inputs in padded, length-bucketed batches.
+
+    Inputs are sorted by their tokenized length so that each batch holds sequences of
+    similar length, which keeps padding overhead low. A batch is closed as soon as adding
+    another item would exceed either `batch_size` rows or `max_tokens_per_batch` padded
+    tokens (i.e. number of rows times the longest row in the batch). Results are always
+    returned in the original input order.
+
+    If running a batch raises an out-of-memory error, the batch is split in half and each
+    half is retried, down to a single item.
+
+    Attributes:
+        max_tokens_per_batch (int) - Upper limit on padded tokens per batch, None for no limit
+        batch_size (int) - Upper limit on number of items per batch, None for no limit
+
+    """
+
+    def __init__(
+        self,
+        max_tokens_per_batch: Optional[int] = None,
+        batch_size: Optional[int] = None,
+    ):
+        if max_tokens_per_batch is not None and max_tokens_per_batch < 1:
+            raise ValueError("max_tokens_per_batch must be a positive integer or None")
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be a positive integer or None")
+
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.batch_size = batch_size
+
+    def make_batches(self, lengths: Sequence[int]) -> List[List[int]]:
+        """
+        Group item indices into length-sorted batches that respect the configured limits.
+
+        An item that on its own exceeds `max_tokens_per_batch` is placed in a batch by itself.
+
+        Args:
+            lengths (Sequence[int]) - tokenized length of each item
+
+        Returns:
+            batches (List[List[int]]) - lists of indices into `lengths`, one list per batch
+
+        """
+        order = sorted(range(len(lengths)), key=lambda idx: lengths[idx])
+
+        batches = []
+        current, longest = [], 0
+        for idx in order:
+            length = max(int(lengths[idx]), 1)
+            if current and not self._fits(len(current) + 1, max(longest, length)):
+                batches.append(current)
+                current, longest = [], 0
+            current.append(idx)
+            longest = max(longest, length)
+
+        if current:
+            batches.append(current)
+
+        return batches
+
+    def max_items_for_length(self, length: int) -> Optional[int]:
+        """
+        Number of rows of a given padded length that fit in a single batch.
+
+        Args:
+            length (int) - padded length of each row
+
+        Returns:
+            max_items (int) - None if neither limit is set, at least 1 otherwise
+
+        """
+        limits = []
+        if self.batch_size is not None:
+            limits.append(self.batch_size)
+        if self.max_tokens_per_batch is not None:
+            limits.append(max(self.max_tokens_per_batch // max(int(length), 1), 1))
+
+        return min(limits) if limits else None
+
+    def run(
+        self,
+        items: Sequence[Any],
+        lengths: Sequence[int],
+        batch_fn: Callable[[List[Any]], Sequence[Any]],
+    ) -> List[Any]:
+        """
+        Apply `batch_fn` to length-bucketed batches of `items` and collect per-item results.
+
+        Args:
+            items (Sequence) - inputs to process
+            lengths (Sequence[int]) - tokenized length of each item
+            batch_fn (Callable) - maps a list of items to a sequence of results
+                of the same length and order
+
+        Returns:
+            results (list) - one result per item, in the original order of `items`
+
+        """
+        if len(items) != len(lengths):
+            raise ValueError("items and lengths must be of same length")
+
+        results = [None] * len(items)
+        for batch in self.make_batches(lengths):
+            batch_results = self._run_batch([items[idx] for idx in batch], batch_fn)
+            for idx, result in zip(batch, batch_results):
+                results[idx] = result
+
+        return results
+
+    def _fits(self, num_items: int, longest: int) -> bool:
+        if self.batch_size is not None and num_items > self.batch_size:
+            return False
+        if (
+            self.max_tokens_per_batch is not None
+            and num_items * longest > self.max_tokens_per_batch
+        ):
+            return False
+        return True
+
+    def _run_batch(
+        self, batch_items: List[Any], batch_fn: Callable[[List[Any]], Sequence[Any]]
+    ) -> List[Any]:
+        try:
+            batch_results = list(batch_fn(batch_items))
+        except (MemoryError, RuntimeError) as e:
+            if not is_out_of_memory_error(e) or len(batch_items) == 1:
+                raise
+            mid = len(batch_items) // 2
+            return self._run_batch(batch_items[:mid], batch_fn) + self._run_batch(
+                batch_items[mid:], batch_fn
+            )
+
+        if len(batch_results) != len(batch_items):
+            raise ValueError(
+                f"batch_fn returned {len(batch_results)} results for {len(batch_items)} items"
+            )
+
+        return batch_results
+
+
+def is_out_of_memory_error(error: BaseException) -> bool:
+    """
+    Check whether an exception signals that a batch did not fit in host or device memory.
+
+    PyTorch reports CUDA and some CPU allocator failures as a `RuntimeError`
+    whose message contains "out of memory".
+
+    """
+    if isinstance(error, MemoryError):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
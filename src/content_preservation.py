@@ -38,15 +38,21 @@
 #
 # ###########################################################################
 
-from typing import List
+import re
+from typing import List, Sequence, Tuple, Union
 
 import torch
+import numpy as np
 import pandas as pd
 from transformers import (
     AutoTokenizer,
     AutoModel,
     AutoModelForSequenceClassification,
 )
+from src.batching import TokenBudgetBatcher
+from src.attribution import TokenAttribution, make_attribution_method
+from src.embedding_store import EmbeddingStore
+from src.style_lexicon import LexiconAttribution, StyleLexicon
 
 
 class ContentPreservationScorer:
@@ -73,16 +79,43 @@ class ContentPreservationScorer:
     Attributes:
         cls_model_identifier (str)
         sbert_model_identifier (str)
+        batch_size (int) - Upper limit on number of sentences embedded in a single batch
+        max_tokens_per_batch (int) - Upper limit on padded tokens in a single batch, also
+            used to pack the interpolation steps of integrated gradients
+        embedding_store (EmbeddingStore) - Optional persistent store of SBERT embeddings
+            shared across calls, runs and processes
+        attribution_method (str) - default word attribution method used to find style
+            tokens, one of `src.attribution.ATTRIBUTION_METHODS` or "lexicon"
+        ig_steps (int) - number of interpolation steps for "integrated_gradients"
+        style_lexicon (StyleLexicon) - Optional precomputed style token weights, which
+            the "lexicon" attribution method looks up instead of running the classifier
 
     """
 
-    def __init__(self, cls_model_identifier: str, sbert_model_identifier: str):
+    def __init__(
+        self,
+        cls_model_identifier: str,
+        sbert_model_identifier: str,
+        batch_size: int = 32,
+        max_tokens_per_batch: int = None,
+        embedding_store: EmbeddingStore = None,
+        attribution_method: str = "integrated_gradients",
+        ig_steps: int = 50,
+        style_lexicon: StyleLexicon = None,
+    ):
 
         self.cls_model_identifier = cls_model_identifier
         self.sbert_model_identifier = sbert_model_identifier
         self.device = (
             torch.cuda.current_device() if torch.cuda.is_available() else "cpu"
         )
+        self.batcher = TokenBudgetBatcher(
+            max_tokens_per_batch=max_tokens_per_batch, batch_size=batch_size
+        )
+        self.embedding_store = embedding_store
+        self.attribution_method = attribution_method
+        self.ig_steps = ig_steps
+        self.style_lexicon = style_lexicon
 
         self._initialize_hf_artifacts()
 
@@ -90,7 +123,7 @@ class ContentPreservationScorer:
         """
         Initialize a HuggingFace artifacts (tokenizer and model) according
         to the provided identifiers for both SBert and the classification model.
-        Then initialize the word attribution explainer with the HF model+tokenizer.
+        Then initialize the batched word attribution explainer with the HF model+tokenizer.
 
         """
 
@@ -107,10 +140,59 @@ class ContentPreservationScorer:
         )
         self.cls_model.to(self.device)
 
+        # word attributions, other methods are built on first use
+        self._attribution_methods = {}
+        self.explainer = self.get_attribution_method()
+
+        # special tokens stripped from masked text, all in a single pass
+        self._special_tokens_pattern = re.compile(
+            "|".join(
+                re.escape(token)
+                for token in self.cls_tokenizer.all_special_tokens
+                if token != "[PAD]"
+            )
+        )
+
+    def get_attribution_method(
+        self, attribution_method: str = None
+    ) -> TokenAttribution:
+        """
+        Return the (cached) word attribution method with the given name.
+
+        Args:
+            attribution_method (str) - defaults to `self.attribution_method`
+
+        Returns:
+            TokenAttribution
+
+        """
+        attribution_method = attribution_method or self.attribution_method
+        if attribution_method == "lexicon":
+            if self.style_lexicon is None:
+                raise ValueError(
+                    'the "lexicon" attribution method needs a style_lexicon'
+                )
+            return LexiconAttribution(self.style_lexicon, self.cls_tokenizer)
+
+        if attribution_method not in self._attribution_methods:
+            self._attribution_methods[attribution_method] = make_attribution_method(
+                attribution_method,
+                self.cls_model,
+                self.cls_tokenizer,
+                batcher=self.batcher,
+                ig_steps=self.ig_steps,
+            )
+        return self._attribution_methods[attribution_method]
+
     def compute_sentence_embeddings(self, input_text: List[str]) -> torch.Tensor:
         """
         Compute sentence embeddings for each sentence provided a list of text strings.
 
+        Each unique sentence is embedded once. If an `embedding_store` is set, stored
+        embeddings are reused and only the missing sentences are encoded (and then
+        stored). Sentences are encoded in length-bucketed batches (see `TokenBudgetBatcher`)
+        so that a single long sentence does not force padding across the whole input.
+
         Args:
             input_text (List[str]) - list of input sentences to encode
 
@@ -118,6 +200,44 @@ class ContentPreservationScorer:
             sentence_embeddings (torch.Tensor)
 
         """
+        unique_text = list(dict.fromkeys(input_text))
+        embeddings = {}
+
+        if self.embedding_store is not None:
+            vectors, found = self.embedding_store.get(
+                unique_text, self.sbert_model_identifier
+            )
+            found_text = [text for text, hit in zip(unique_text, found) if hit]
+            embeddings.update(zip(found_text, vectors))
+
+        missing_text = [text for text in unique_text if text not in embeddings]
+        if missing_text:
+            lengths = [
+                len(ids)
+                for ids in self.sbert_tokenizer(
+                    missing_text, truncation=True, max_length=256
+                )["input_ids"]
+            ]
+            missing_embeddings = self.batcher.run(
+                missing_text, lengths, self._compute_sentence_embeddings_batch
+            )
+            if self.embedding_store is not None:
+                self.embedding_store.put(
+                    missing_text,
+                    torch.stack(missing_embeddings).numpy(),
+                    self.sbert_model_identifier,
+                )
+            embeddings.update(
+                zip(missing_text, torch.stack(missing_embeddings).numpy())
+            )
+
+        # stored vectors may be views into the store's read-only memory map, so they
+        # are copied exactly once, into the output
+        return torch.from_numpy(np.stack([embeddings[text] for text in input_text]))
+
+    def _compute_sentence_embeddings_batch(
+        self, input_text: List[str]
+    ) -> List[torch.Tensor]:
         # tokenize sentences
         encoded_input = self.sbert_tokenizer(
             input_text,
@@ -136,7 +256,7 @@ class ContentPreservationScorer:
         with torch.no_grad():
             model_output = self.sbert_model(**encoded_input)
 
-        return (
+        return list(
             self.mean_pooling(model_output, encoded_input["attention_mask"])
             .detach()
             .cpu()
@@ -149,6 +269,7 @@ class ContentPreservationScorer:
         threshold: float = 0.3,
         mask_type: str = "pad",
         return_all: bool = False,
+        attribution_method: str = None,
     ) -> List[float]:
         """
         Calcualates the content preservation score (CPS) between two pieces of text.
@@ -161,6 +282,8 @@ class ContentPreservationScorer:
             return_all (bool) - If true, return dict containing intermediate
                 text with style masking applied, along with scores
             mask_type (str) - "pad", "remove", or "none"
+            attribution_method (str) - Optional word attribution method overriding
+                `self.attribution_method` for this call
 
         Returns:
             A list of floats with corresponding content preservation scores.
@@ -176,15 +299,15 @@ class ContentPreservationScorer:
             )
 
         if mask_type != "none":
-            # Mask out style tokens
-            masked_input_text = [
-                self.mask_style_tokens(text, mask_type=mask_type, threshold=threshold)
-                for text in input_text
-            ]
-            masked_output_text = [
-                self.mask_style_tokens(text, mask_type=mask_type, threshold=threshold)
-                for text in output_text
-            ]
+            # Mask out style tokens, attributing inputs and outputs in the same batches
+            masked_text = self.mask_style_tokens(
+                list(input_text) + list(output_text),
+                mask_type=mask_type,
+                threshold=threshold,
+                attribution_method=attribution_method,
+            )
+            masked_input_text = masked_text[: len(input_text)]
+            masked_output_text = masked_text[len(input_text) :]
 
             # Compute SBert embeddings
             input_embeddings = self.compute_sentence_embeddings(masked_input_text)
@@ -211,32 +334,203 @@ class ContentPreservationScorer:
         else:
             return scores
 
+    def calculate_one_to_many_content_preservation_score(
+        self,
+        source_text: str,
+        candidate_text: List[str],
+        threshold: float = 0.3,
+        mask_type: str = "pad",
+        attribution_method: str = None,
+    ) -> np.ndarray:
+        """
+        Calculate the content preservation score between one source text and each of
+        many candidates (e.g. alternative rewrites of the source).
+
+        The source is masked and embedded once, and all scores come from a single
+        matrix-vector product of L2-normalized embeddings.
+
+        Args:
+            source_text (str)
+            candidate_text (List[str]) - texts to compare against `source_text`
+            threshold (float) - percentage of style attribution as cutoff for masking
+            mask_type (str) - "pad", "remove", or "none"
+            attribution_method (str) - Optional word attribution method overriding
+                `self.attribution_method` for this call
+
+        Returns:
+            scores (np.ndarray) - float32 cosine similarity per candidate
+
+        """
+        embeddings = self.compute_normalized_embeddings(
+            [source_text] + list(candidate_text),
+            threshold,
+            mask_type,
+            attribution_method,
+        )
+        return (embeddings[1:] @ embeddings[0]).numpy()
+
+    def calculate_pairwise_content_preservation_scores(
+        self,
+        input_text: List[str],
+        output_text: List[str] = None,
+        threshold: float = 0.3,
+        mask_type: str = "pad",
+        top_k: int = None,
+        block_size: int = 1024,
+        attribution_method: str = None,
+    ) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Calculate content preservation scores between every input and every output text.
+
+        Each unique text is masked and embedded once. Similarities are computed as
+        products of L2-normalized embeddings, `block_size` input rows at a time, so with
+        `top_k` set only the best matches per row are kept and the full N x M matrix is
+        never materialized.
+
+        Args:
+            input_text (List[str])
+            output_text (List[str]) - texts to compare against, defaults to `input_text`
+                itself (in which case every text is its own best match)
+            threshold (float) - percentage of style attribution as cutoff for masking
+            mask_type (str) - "pad", "remove", or "none"
+            top_k (int) - Optional number of best matches to keep per input text
+            block_size (int) - number of input rows scored per matrix product
+            attribution_method (str) - Optional word attribution method overriding
+                `self.attribution_method` for this call
+
+        Returns:
+            scores (np.ndarray) - (N, M) float32 similarities if `top_k` is None, otherwise
+                a tuple of (N, k) int64 `indices` into `output_text` and their (N, k)
+                `scores`, sorted from most to least similar
+
+        """
+        if output_text is None:
+            input_embeddings = output_embeddings = self.compute_normalized_embeddings(
+                input_text, threshold, mask_type, attribution_method
+            )
+        else:
+            embeddings = self.compute_normalized_embeddings(
+                list(input_text) + list(output_text),
+                threshold,
+                mask_type,
+                attribution_method,
+            )
+            input_embeddings = embeddings[: len(input_text)]
+            output_embeddings = embeddings[len(input_text) :]
+
+        num_columns = len(output_embeddings)
+        if top_k is not None:
+            num_columns = min(top_k, num_columns)
+
+        scores = [torch.empty(0, num_columns)]
+        indices = [torch.empty(0, num_columns, dtype=torch.long)]
+        for start in range(0, len(input_embeddings), block_size):
+            block_scores = (
+                input_embeddings[start : start + block_size] @ output_embeddings.T
+            )
+            if top_k is not None:
+                block_scores, block_indices = torch.topk(
+                    block_scores, k=num_columns, dim=1
+                )
+                indices.append(block_indices)
+            scores.append(block_scores)
+
+        scores = torch.cat(scores).numpy()
+        if top_k is None:
+            return scores
+        return torch.cat(indices).numpy(), scores
+
+    def compute_normalized_embeddings(
+        self,
+        input_text: List[str],
+        threshold: float = 0.3,
+        mask_type: str = "pad",
+        attribution_method: str = None,
+    ) -> torch.Tensor:
+        """
+        Mask (optionally) and embed each unique text once, returning L2-normalized
+        sentence embeddings so that dot products are cosine similarities.
+
+        Args:
+            input_text (List[str])
+            threshold (float) - percentage of style attribution as cutoff for masking
+            mask_type (str) - "pad", "remove", or "none"
+            attribution_method (str) - Optional word attribution method overriding
+                `self.attribution_method` for this call
+
+        Returns:
+            sentence_embeddings (torch.Tensor) - one unit-length row per item of `input_text`
+
+        """
+        unique_text = list(dict.fromkeys(input_text))
+        if not unique_text:
+            return torch.empty(0, self.sbert_model.config.hidden_size)
+
+        masked_text = unique_text
+        if mask_type != "none":
+            masked_text = self.mask_style_tokens(
+                unique_text,
+                threshold=threshold,
+                mask_type=mask_type,
+                attribution_method=attribution_method,
+            )
+
+        embeddings = torch.nn.functional.normalize(
+            self.compute_sentence_embeddings(masked_text), dim=1, eps=1e-6
+        )
+        positions = {text: idx for idx, text in enumerate(unique_text)}
+        return embeddings[[positions[text] for text in input_text]]
+
     def calculate_feature_attribution_scores(
-        self, text: str, class_index: int = 0, as_norm: bool = False
-    ) -> List[tuple]:
+        self,
+        text: Union[str, List[str]],
+        class_index: int = 0,
+        as_norm: bool = False,
+        attribution_method: str = None,
+    ) -> Union[List[tuple], List[List[tuple]]]:
         """
-        Calcualte feature attributions using integrated gradients by passing
-        a string of text as input.
+        Calcualte feature attributions (integrated gradients by default) by passing
+        a string of text (or a list of them) as input.
+
+        The model passes of all texts are packed together into batches that fit
+        `batch_size` and `max_tokens_per_batch` (see `src.attribution`).
 
         Args:
-            text (str) - text to get attributions for
+            text (`str` or `List[str]`) - text to get attributions for
             class_index (int) - Optional output index to provide attributions for
+            attribution_method (str) - Optional word attribution method overriding
+                `self.attribution_method` for this call
+
+        Returns:
+            attributions - list of (token, score) tuples, or one such list per text
+                when a list is passed
 
         """
-        attributions = self.explainer(text, index=class_index)
+        if isinstance(text, str):
+            return self.calculate_feature_attribution_scores(
+                [text],
+                class_index=class_index,
+                as_norm=as_norm,
+                attribution_method=attribution_method,
+            )[0]
+
+        attributions = self.get_attribution_method(attribution_method).attribute(
+            text, class_index=class_index
+        )
 
         if as_norm:
-            return self.format_feature_attribution_scores(attributions)
+            return [self.format_feature_attribution_scores(a) for a in attributions]
 
         return attributions
 
     def mask_style_tokens(
         self,
-        text: str,
+        text: Union[str, List[str]],
         threshold: float = 0.3,
         mask_type: str = "pad",
         class_index: int = 0,
-    ) -> str:
+        attribution_method: str = None,
+    ) -> Union[str, List[str]]:
         """
         Utility function to mask out style tokens from a given string of text.
 
@@ -253,59 +547,190 @@ class ContentPreservationScorer:
         We can optionally return a string with these style tokens padded out or completely removed
         by toggling _mask_type_ between "pad" and "remove".
 
+        Passing a list of texts attributes them all in shared batches.
+
         Args:
-            text (str)
+            text (`str` or `List[str]`)
             threshold (float) - percentage of style attribution as cutoff for masking selection.
             mask_type (str) - "pad" or "remove", indicates how to handle style tokens
             class_index (str)
+            attribution_method (str) - Optional word attribution method overriding
+                `self.attribution_method` for this call
 
         Returns:
-            text (str)
+            text (`str` or `List[str]`)
 
         """
+        if isinstance(text, str):
+            return self.mask_style_tokens(
+                [text],
+                threshold=threshold,
+                mask_type=mask_type,
+                class_index=class_index,
+                attribution_method=attribution_method,
+            )[0]
 
-        # get attributions and format as sorted dataframe
         attributions = self.calculate_feature_attribution_scores(
-            text, class_index=class_index, as_norm=False
+            text,
+            class_index=class_index,
+            as_norm=False,
+            attribution_method=attribution_method,
         )
-        attributions_df = self.format_feature_attribution_scores(attributions)
 
-        # select tokens to mask
-        token_idxs_to_mask = []
+        # select tokens to mask across the whole batch at once
+        lengths = [len(item) for item in attributions]
+        scores = np.zeros((len(attributions), max(lengths, default=0)))
+        for row, item in zip(scores, attributions):
+            row[: len(item)] = [score for _, score in item]
+        mask = self.select_style_token_mask(scores, lengths, threshold)
+
+        # Build token sequences with style tokens masked out
+        mask_id = self.cls_tokenizer.convert_tokens_to_ids("[PAD]")
+        token_ids = []
+        for item, row_mask in zip(attributions, mask):
+            ids = self.cls_tokenizer.convert_tokens_to_ids([token for token, _ in item])
+            if mask_type == "pad":
+                ids = [mask_id if masked else i for i, masked in zip(ids, row_mask)]
+            else:
+                ids = [i for i, masked in zip(ids, row_mask) if not masked]
+            token_ids.append(ids)
+
+        # Decode those sequences and remove special characters other than [PAD]
+        return [
+            self._special_tokens_pattern.sub("", masked_text).strip()
+            for masked_text in self.cls_tokenizer.batch_decode(
+                token_ids, skip_special_tokens=False
+            )
+        ]
 
-        # If the first token accounts for more than the set
-        # threshold, take just that token to mask. Otherwise,
-        # take all tokens up to the threshold
+    def find_style_spans(
+        self,
+        text: str,
+        threshold: float = 0.3,
+        class_index: int = 0,
+        attribution_method: str = None,
+    ) -> List[Tuple[int, int]]:
+        """
+        Locate the style-carrying parts of a piece of text as character spans.
+
+        Style tokens are selected exactly as in `mask_style_tokens`. Each selected
+        token is widened to its whole word, and words separated only by whitespace
+        are merged, so "a strikingly elegant design" yields a single span covering
+        "strikingly elegant".
+
+        Args:
+            text (str)
+            threshold (float) - percentage of style attribution as cutoff for selection
+            class_index (int)
+            attribution_method (str) - Optional word attribution method overriding
+                `self.attribution_method` for this call
+
+        Returns:
+            spans (List[Tuple[int, int]]) - sorted (start, end) character offsets into `text`
+
+        """
+        attributions = self.calculate_feature_attribution_scores(
+            text,
+            class_index=class_index,
+            as_norm=False,
+            attribution_method=attribution_method,
+        )
+        token_idxs = np.flatnonzero(
+            self.select_style_token_mask(
+                np.array([[score for _, score in attributions]]),
+                [len(attributions)],
+                threshold,
+            )[0]
+        ).tolist()
+
+        encoding = self.cls_tokenizer(text, return_offsets_mapping=True)
+        word_ids = encoding.word_ids()
+        style_word_ids = {
+            word_ids[idx] for idx in token_idxs if word_ids[idx] is not None
+        }
+
+        spans = []
+        for word_id, (start, end) in zip(word_ids, encoding["offset_mapping"]):
+            if word_id is None or word_id not in style_word_ids:
+                continue
+            if spans and not text[spans[-1][1] : start].strip():
+                spans[-1] = (spans[-1][0], end)
+            else:
+                spans.append((start, end))
+
+        return spans
+
+    @staticmethod
+    def select_style_token_idxs(
+        attributions_df: pd.DataFrame, threshold: float
+    ) -> List[int]:
+        """
+        Select the indices of style tokens from sorted attribution scores.
+
+        If the first token accounts for more than the set threshold, take just that
+        token. Otherwise, take all tokens up to the threshold.
+
+        Args:
+            attributions_df (pd.DataFrame) - output of `format_feature_attribution_scores`
+            threshold (float) - percentage of style attribution as cutoff for selection
+
+        Returns:
+            token_idxs (List[int]) - positions in the tokenized text (including special tokens)
+
+        """
         if attributions_df.iloc[0]["cumulative"] > threshold:
-            token_idxs_to_mask.append(attributions_df.index[0])
-        else:
-            token_idxs_to_mask.extend(
-                attributions_df[
-                    attributions_df["cumulative"] <= threshold
-                ].index.to_list()
-            )
+            return [attributions_df.index[0]]
+        return attributions_df[
+            attributions_df["cumulative"] <= threshold
+        ].index.to_list()
 
-        # Build text sequence with tokens masked out
-        mask_map = {"pad": "[PAD]", "remove": ""}
-        toks = [token for token, score in attributions]
-        for idx in token_idxs_to_mask:
-            toks[idx] = mask_map[mask_type]
+    @staticmethod
+    def select_style_token_mask(
+        scores: np.ndarray, lengths: Sequence[int], threshold: float
+    ) -> np.ndarray:
+        """
+        Vectorized `select_style_token_idxs` over a padded batch of attribution rows.
+
+        Each row is normalized by its total absolute attribution, ranked in descending
+        order and cut off at the cumulative `threshold`, exactly as the DataFrame-based
+        selection does for a single sentence.
 
-        if mask_type == "remove":
-            toks = [token for token in toks if token != ""]
+        Args:
+            scores (np.ndarray) - (num_texts, max_length) attribution scores, where
+                values past each row's length are ignored
+            lengths (Sequence[int]) - number of tokens in each row
+            threshold (float) - percentage of style attribution as cutoff for selection
 
-        # Decode that sequence
-        masked_text = self.explainer.tokenizer.decode(
-            self.explainer.tokenizer.convert_tokens_to_ids(toks),
-            skip_special_tokens=False,
+        Returns:
+            mask (np.ndarray) - (num_texts, max_length) boolean array, True for style tokens
+
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        valid = np.arange(scores.shape[1]) < lengths[:, None]
+
+        # row totals over the unpadded scores so rounding matches a per-sentence sum
+        abs_scores = np.abs(scores)
+        totals = np.array([row[:n].sum() for row, n in zip(abs_scores, lengths)])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            abs_norm = np.where(valid, abs_scores / totals[:, None], -np.inf)
+
+        # padding sorts last, ties keep their token order
+        order = np.argsort(-abs_norm, axis=1, kind="stable")
+        sorted_valid = np.take_along_axis(valid, order, axis=1)
+        cumulative = np.cumsum(
+            np.where(sorted_valid, np.take_along_axis(abs_norm, order, axis=1), 0.0),
+            axis=1,
         )
 
-        # Remove special characters other than [PAD]
-        for special_token in self.explainer.tokenizer.all_special_tokens:
-            if special_token != "[PAD]":
-                masked_text = masked_text.replace(special_token, "")
+        # take all tokens up to the threshold, or just the first if it alone exceeds it
+        selected = sorted_valid & (cumulative <= threshold)
+        if selected.shape[1]:
+            selected[:, 0] |= sorted_valid[:, 0] & (cumulative[:, 0] > threshold)
 
-        return masked_text.strip()
+        mask = np.zeros_like(valid)
+        np.put_along_axis(mask, order, selected, axis=1)
+        return mask
 
     @staticmethod
     def format_feature_attribution_scores(attributions: List[tuple]) -> pd.DataFrame:
@@ -340,8 +765,10 @@ class ContentPreservationScorer:
             tensor1 = tensor1.unsqueeze(0)
             tensor2 = tensor2.unsqueeze(0)
 
-        cos_sim = torch.nn.CosineSimilarity(dim=1, eps=1e-6)
-        return [round(val, 4) for val in cos_sim(tensor1, tensor2).tolist()]
+        cos_sim = torch.nn.functional.cosine_similarity(
+            tensor1, tensor2, dim=1, eps=1e-6
+        )
+        return [round(val, 4) for val in cos_sim.tolist()]
 
     @staticmethod
     def mean_pooling(model_output, attention_mask):
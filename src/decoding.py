@@ -0,0 +1,701 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import math
+import queue
+import time
+from typing import List, Optional, Tuple
+
+import torch
+from transformers import (
+    StoppingCriteria,
+    LogitsProcessor,
+    LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor,
+    NoRepeatNGramLogitsProcessor,
+    NoBadWordsLogitsProcessor,
+    MinLengthLogitsProcessor,
+    ForcedBOSTokenLogitsProcessor,
+    ForcedEOSTokenLogitsProcessor,
+    InfNanRemoveLogitsProcessor,
+)
+
+
+class CommittedPrefixStreamer(StoppingCriteria):
+    """
+    Stopping criterion that never stops generation, but publishes the committed output prefix.
+
+    `generate()` calls stopping criteria once per decoding step with the current
+    sequences of every live beam. The committed prefix is the longest prefix shared
+    by all live beams of the (single) input: with greedy decoding this is simply the
+    sequence so far, with beam search it is the part of the best hypothesis that no
+    remaining beam disagrees with. Each time the decoded prefix grows, it is put on
+    `text_queue`.
+
+    Attributes:
+        tokenizer (PreTrainedTokenizer) - tokenizer used to decode the committed prefix
+        text_queue (queue.Queue) - receives the decoded prefix whenever it changes
+
+    """
+
+    def __init__(self, tokenizer, text_queue: queue.Queue):
+        self.tokenizer = tokenizer
+        self.text_queue = text_queue
+        self.num_committed = 0
+        self.committed_text = ""
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> bool:
+        agreement = (input_ids == input_ids[:1]).all(dim=0).long()
+        num_committed = int(agreement.cumprod(dim=0).sum())
+
+        if num_committed > self.num_committed:
+            self.num_committed = num_committed
+            text = self.tokenizer.decode(
+                input_ids[0, :num_committed],
+                skip_special_tokens=True,
+                clean_up_tokenization_spaces=False,
+            )
+            if text != self.committed_text:
+                self.committed_text = text
+                self.text_queue.put(text)
+
+        return False
+
+
+def build_logits_processor(config, max_length: int) -> LogitsProcessorList:
+    """
+    Build the logits processors that `generate()` derives from a model config for greedy search.
+
+    Custom decoding loops use this so that their token choices match `generate()`
+    exactly (e.g. BART checkpoints ship `no_repeat_ngram_size` and forced BOS/EOS tokens).
+
+    Args:
+        config (PretrainedConfig) - config of the seq2seq model
+        max_length (int) - maximum output length, used to force the EOS token
+
+    Returns:
+        LogitsProcessorList
+
+    """
+    processors = LogitsProcessorList()
+
+    if getattr(config, "repetition_penalty", 1.0) != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(config.repetition_penalty))
+    if getattr(config, "no_repeat_ngram_size", 0):
+        processors.append(NoRepeatNGramLogitsProcessor(config.no_repeat_ngram_size))
+    if getattr(config, "encoder_no_repeat_ngram_size", 0):
+        raise ValueError("encoder_no_repeat_ngram_size is not supported")
+    if getattr(config, "bad_words_ids", None) is not None:
+        processors.append(
+            NoBadWordsLogitsProcessor(config.bad_words_ids, config.eos_token_id)
+        )
+    if getattr(config, "min_length", 0) and config.eos_token_id is not None:
+        processors.append(
+            MinLengthLogitsProcessor(config.min_length, config.eos_token_id)
+        )
+    if getattr(config, "forced_bos_token_id", None) is not None:
+        processors.append(ForcedBOSTokenLogitsProcessor(config.forced_bos_token_id))
+    if getattr(config, "forced_eos_token_id", None) is not None:
+        processors.append(
+            ForcedEOSTokenLogitsProcessor(max_length, config.forced_eos_token_id)
+        )
+    if getattr(config, "remove_invalid_values", False):
+        processors.append(InfNanRemoveLogitsProcessor())
+
+    return processors
+
+
+def trim_past_key_values(past_key_values: tuple, length: int) -> tuple:
+    """
+    Truncate the decoder self-attention cache of an encoder-decoder model to `length` positions.
+
+    Each layer holds (self key, self value, cross key, cross value); only the
+    self-attention entries grow with the output, so the cross-attention entries are kept.
+
+    """
+    return tuple(
+        (layer[0][:, :, :length], layer[1][:, :, :length]) + tuple(layer[2:])
+        for layer in past_key_values
+    )
+
+
+class PromptLookupDecoder:
+    """
+    Greedy decoding for encoder-decoder models with copy-aware speculation (prompt lookup decoding).
+
+    Style transfer outputs are mostly copies of their inputs. At each step, the last
+    few generated tokens are looked up in the source sequence and the tokens that
+    follow the match are proposed as a continuation. All proposed tokens are verified
+    with a single decoder forward pass, the longest prefix that agrees with the
+    model's own greedy choice is accepted, and the model's choice at the first
+    disagreement comes for free. The output is therefore the same as greedy `generate()`
+    (up to floating point differences between a single and a multi-token forward pass).
+
+    Attributes:
+        model (PreTrainedModel) - encoder-decoder model
+        max_length (int) - Upper limit on output length, including the decoder start token
+        num_speculative_tokens (int) - Upper limit on tokens proposed per step
+        max_ngram_size (int) - Longest suffix of the output to look up in the source
+        stats (dict) - running counts of decoder `steps`, `proposed` and `accepted`
+            speculative tokens and `generated` tokens
+
+    """
+
+    def __init__(
+        self,
+        model,
+        max_length: int,
+        num_speculative_tokens: int = 10,
+        max_ngram_size: int = 3,
+    ):
+        self.model = model
+        self.max_length = max_length
+        self.num_speculative_tokens = num_speculative_tokens
+        self.max_ngram_size = max_ngram_size
+        self.stats = {"steps": 0, "proposed": 0, "accepted": 0, "generated": 0}
+
+    @property
+    def acceptance_rate(self) -> float:
+        """
+        Fraction of proposed tokens that were accepted.
+
+        """
+        if not self.stats["proposed"]:
+            return 0.0
+        return self.stats["accepted"] / self.stats["proposed"]
+
+    @torch.no_grad()
+    def generate(
+        self,
+        input_ids: torch.LongTensor,
+        attention_mask: torch.LongTensor = None,
+        max_length: int = None,
+        min_length: int = 0,
+        logits_processor: LogitsProcessorList = None,
+    ) -> torch.LongTensor:
+        """
+        Generate output ids for a single (unpadded) input sequence.
+
+        Args:
+            input_ids (torch.LongTensor) - source ids of shape (1, seq_len)
+            attention_mask (torch.LongTensor) - optional mask of the same shape
+            max_length (int) - overrides the instance `max_length` for this call
+            min_length (int) - blocks EOS until the output (including the decoder
+                start token) reaches this length
+            logits_processor (LogitsProcessorList) - extra processors applied after the
+                ones derived from the model config, as with `generate()`
+
+        Returns:
+            output_ids (torch.LongTensor) - shape (1, out_len), starting with the
+                decoder start token like `generate()`
+
+        """
+        if input_ids.shape[0] != 1:
+            raise ValueError("PromptLookupDecoder.generate expects a single sequence")
+
+        config = self.model.config
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        source = input_ids[0][attention_mask[0].bool()].tolist()
+
+        max_length = max_length or self.max_length
+        processors = build_logits_processor(config, max_length)
+        if min_length:
+            processors.append(MinLengthLogitsProcessor(min_length, config.eos_token_id))
+        if logits_processor is not None:
+            processors.extend(logits_processor)
+        encoder_outputs = self.model.get_encoder()(
+            input_ids=input_ids, attention_mask=attention_mask
+        )
+
+        sequence = [config.decoder_start_token_id]
+        past_key_values = None
+        while len(sequence) < max_length:
+            candidates = self.propose(source, sequence)
+            candidates = candidates[: max(max_length - len(sequence) - 1, 0)]
+
+            outputs = self.model(
+                encoder_outputs=encoder_outputs,
+                attention_mask=attention_mask,
+                decoder_input_ids=torch.tensor(
+                    [sequence[-1:] + candidates], device=input_ids.device
+                ),
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+
+            new_tokens = self._verify(
+                sequence, candidates, outputs.logits[0], processors, max_length
+            )
+            num_accepted = len(new_tokens) - 1
+            self.stats["steps"] += 1
+            self.stats["proposed"] += len(candidates)
+            self.stats["accepted"] += num_accepted
+            self.stats["generated"] += len(new_tokens)
+
+            sequence += new_tokens
+            past_key_values = trim_past_key_values(
+                outputs.past_key_values, len(sequence) - 1
+            )
+            if sequence[-1] == config.eos_token_id:
+                break
+
+        return torch.tensor([sequence], device=input_ids.device)
+
+    def propose(self, source: List[int], sequence: List[int]) -> List[int]:
+        """
+        Propose a continuation of `sequence` by matching its suffix against `source`.
+
+        The longest suffix (up to `max_ngram_size` tokens) that occurs in the source
+        wins, and its first occurrence is used.
+
+        Args:
+            source (List[int]) - source token ids
+            sequence (List[int]) - output token ids so far
+
+        Returns:
+            candidates (List[int]) - up to `num_speculative_tokens` proposed ids
+
+        """
+        for ngram_size in range(min(self.max_ngram_size, len(sequence)), 0, -1):
+            ngram = sequence[-ngram_size:]
+            for start in range(len(source) - ngram_size):
+                if source[start : start + ngram_size] == ngram:
+                    end = start + ngram_size
+                    return source[end : end + self.num_speculative_tokens]
+        return []
+
+    def _verify(
+        self,
+        sequence: List[int],
+        candidates: List[int],
+        logits: torch.Tensor,
+        logits_processor: LogitsProcessorList,
+        max_length: int,
+    ) -> List[int]:
+        # logits[i] scores the token following sequence + candidates[:i]
+        eos_token_id = self.model.config.eos_token_id
+        device = logits.device
+
+        new_tokens = []
+        for i in range(len(candidates) + 1):
+            prefix = torch.tensor([sequence + new_tokens], device=device)
+            scores = logits_processor(prefix, logits[i : i + 1])
+            token = int(scores.argmax(dim=-1))
+            new_tokens.append(token)
+
+            if token == eos_token_id or len(sequence) + len(new_tokens) >= max_length:
+                break
+            if i == len(candidates) or token != candidates[i]:
+                break
+
+        return new_tokens
+
+
+class LengthPolicy:
+    """
+    Input-length-adaptive limits on the number of tokens generated per item.
+
+    The upper limit for an input of `n` tokens is `ceil(max_ratio * n) + max_slack`
+    and the lower limit is `floor(min_ratio * n) - min_slack` (never below 0).
+    Counts include the EOS token but not the decoder start token, so that a degenerate
+    beam on a short sentence can no longer run all the way to `max_gen_length`.
+
+    Attributes:
+        max_ratio (float) - output-to-input length ratio for the upper limit
+        max_slack (int) - tokens added to the scaled upper limit
+        min_ratio (float) - output-to-input length ratio for the lower limit, 0 to disable
+        min_slack (int) - tokens subtracted from the scaled lower limit
+        stats (dict) - running counts of `items` generated and `cap_hits` (items that
+            stopped because they reached their upper limit)
+
+    """
+
+    def __init__(
+        self,
+        max_ratio: float = 1.5,
+        max_slack: int = 10,
+        min_ratio: float = 0.0,
+        min_slack: int = 0,
+    ):
+        self.max_ratio = max_ratio
+        self.max_slack = max_slack
+        self.min_ratio = min_ratio
+        self.min_slack = min_slack
+        self.stats = {"items": 0, "cap_hits": 0}
+
+    @property
+    def cap_hit_rate(self) -> float:
+        """
+        Fraction of items that reached their upper limit.
+
+        """
+        if not self.stats["items"]:
+            return 0.0
+        return self.stats["cap_hits"] / self.stats["items"]
+
+    def max_new_tokens(self, input_lengths: List[int], upper_limit: int) -> List[int]:
+        """
+        Upper limit on generated tokens for each input length, clipped to [2, upper_limit].
+
+        """
+        return [
+            min(max(math.ceil(self.max_ratio * n) + self.max_slack, 2), upper_limit)
+            for n in input_lengths
+        ]
+
+    def min_new_tokens(self, input_lengths: List[int]) -> List[int]:
+        """
+        Lower limit on generated tokens for each input length.
+
+        """
+        return [
+            max(math.floor(self.min_ratio * n) - self.min_slack, 0)
+            for n in input_lengths
+        ]
+
+    def record(self, num_generated: List[int], max_new_tokens: List[int]):
+        """
+        Update `stats` given the number of tokens generated for each item.
+
+        """
+        self.stats["items"] += len(num_generated)
+        self.stats["cap_hits"] += sum(
+            generated >= cap for generated, cap in zip(num_generated, max_new_tokens)
+        )
+
+
+class PerItemLengthLogitsProcessor(LogitsProcessor):
+    """
+    Logits processor enforcing a separate minimum and maximum output length for each batch item.
+
+    `generate()` only accepts a single `max_length`/`min_length` per call. This processor
+    forces EOS once a row reaches its item's maximum and blocks EOS until it reaches its
+    item's minimum. Rows are laid out as `batch_size * num_beams`, as in `generate()`.
+    Lengths count generated tokens including EOS but excluding the decoder start token.
+
+    Attributes:
+        min_new_tokens (List[int]) - lower limit per item
+        max_new_tokens (List[int]) - upper limit per item
+        eos_token_id (int)
+        num_beams (int)
+
+    """
+
+    def __init__(
+        self,
+        min_new_tokens: List[int],
+        max_new_tokens: List[int],
+        eos_token_id: int,
+        num_beams: int = 1,
+    ):
+        self.min_new_tokens = torch.tensor(min_new_tokens).repeat_interleave(num_beams)
+        self.max_new_tokens = torch.tensor(max_new_tokens).repeat_interleave(num_beams)
+        self.eos_token_id = eos_token_id
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor
+    ) -> torch.FloatTensor:
+        # input_ids holds the decoder start token plus the tokens generated so far,
+        # so the next token is generated token number `cur_len`
+        cur_len = input_ids.shape[-1]
+
+        at_max = (self.max_new_tokens <= cur_len).to(scores.device)
+        scores[at_max] = -float("inf")
+        scores[at_max, self.eos_token_id] = 0
+
+        below_min = (self.min_new_tokens > cur_len).to(scores.device)
+        scores[below_min, self.eos_token_id] = -float("inf")
+
+        return scores
+
+
+class DeadlineLogitsProcessor(LogitsProcessor):
+    """
+    Logits processor that ends generation for each batch item once its time budget is spent.
+
+    When an item's deadline passes, EOS is forced on all of its beams, so beam search
+    returns the best hypothesis available at that point (a finished one if it scores
+    better, otherwise the current partial one). The time of every decoding step is
+    recorded, so callers can tell when each item produced its final token.
+
+    Attributes:
+        deadlines (List[float]) - `time.monotonic()` deadline per item, None for no budget
+        eos_token_id (int)
+        num_beams (int)
+        expired_at (List[int]) - per item, the output length (including the decoder
+            start token) at which its deadline was first found to have passed
+        step_times (dict) - `time.monotonic()` at which the token following an output
+            of a given length was chosen
+
+    """
+
+    def __init__(
+        self,
+        deadlines: List[Optional[float]],
+        eos_token_id: int,
+        num_beams: int = 1,
+    ):
+        self.deadlines = deadlines
+        self.eos_token_id = eos_token_id
+        self.num_beams = num_beams
+        self.expired_at = [None] * len(deadlines)
+        self.step_times = {}
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor
+    ) -> torch.FloatTensor:
+        now = time.monotonic()
+        cur_len = input_ids.shape[-1]
+        self.step_times.setdefault(cur_len, now)
+
+        expired_rows = []
+        for i, deadline in enumerate(self.deadlines):
+            if deadline is None or now < deadline:
+                continue
+            if self.expired_at[i] is None:
+                self.expired_at[i] = cur_len
+            expired_rows.extend(range(i * self.num_beams, (i + 1) * self.num_beams))
+
+        if expired_rows:
+            scores[expired_rows] = -float("inf")
+            scores[expired_rows, self.eos_token_id] = 0
+
+        return scores
+
+    def is_truncated(self, item_idx: int, output_length: int) -> bool:
+        """
+        Whether an item's output (of `output_length` tokens including the decoder start
+        token) was cut short by its deadline rather than finishing on its own.
+
+        """
+        expired_at = self.expired_at[item_idx]
+        return expired_at is not None and output_length > expired_at
+
+    def finished_at(self, output_length: int) -> Optional[float]:
+        """
+        `time.monotonic()` at which the last token of an output of `output_length` tokens
+        was chosen, None if unknown.
+
+        """
+        return self.step_times.get(output_length - 1)
+
+
+def output_projection(
+    model, token_ids: torch.Tensor = None
+) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """
+    Weight and bias of the model's LM head, including any `final_logits_bias`.
+
+    With `token_ids`, only the rows for those vocabulary entries are kept (in that
+    order), so that a decoding loop can gather them once and project onto a shortlist
+    at every step.
+
+    """
+    output_embeddings = model.get_output_embeddings()
+    weight = output_embeddings.weight
+    bias = getattr(output_embeddings, "bias", None)
+    final_logits_bias = getattr(model, "final_logits_bias", None)
+    if final_logits_bias is not None:
+        bias = final_logits_bias[0] if bias is None else bias + final_logits_bias[0]
+
+    if token_ids is not None:
+        weight = weight[token_ids]
+        bias = bias[token_ids] if bias is not None else None
+    return weight, bias
+
+
+def project_to_vocabulary(
+    model,
+    hidden_states: torch.Tensor,
+    projection: Tuple[torch.Tensor, Optional[torch.Tensor]] = None,
+) -> torch.Tensor:
+    """
+    Compute next-token logits from decoder hidden states, as the model's LM head would.
+
+    Decoding loops that only need logits for some positions use this to skip the
+    vocabulary projection for the rest. `projection` is an optional (weight, bias)
+    pair from `output_projection`, e.g. restricted to a shortlist of tokens.
+
+    """
+    config = model.config
+    # T5 rescales decoder outputs before a projection tied to the input embeddings
+    if config.model_type in ("t5", "mt5") and config.tie_word_embeddings:
+        hidden_states = hidden_states * config.d_model**-0.5
+
+    weight, bias = projection if projection is not None else output_projection(model)
+    return torch.nn.functional.linear(hidden_states, weight, bias)
+
+
+class SpanEditDecoder:
+    """
+    Decoding for encoder-decoder models that copies the source and only regenerates marked spans.
+
+    The source is split into segments of copied tokens and edit tokens. Copied segments
+    are appended to the output verbatim and fed to the decoder in a single forward pass
+    (teacher forcing). For each edit segment, the model decodes greedily until it emits
+    the first token of the following copied segment (or EOS after the last segment), at
+    which point copying resumes. A segment that the model drops entirely costs a single
+    step. The number of decoding steps therefore scales with the size of the edits
+    rather than the length of the input.
+
+    Attributes:
+        model (PreTrainedModel) - encoder-decoder model
+        max_length (int) - Upper limit on output length, including the decoder start token
+        max_span_ratio (float) - together with `max_span_slack`, caps the tokens generated
+            for an edit segment at `max_span_ratio * len(segment) + max_span_slack`
+        max_span_slack (int)
+
+    """
+
+    def __init__(
+        self,
+        model,
+        max_length: int,
+        max_span_ratio: float = 2.0,
+        max_span_slack: int = 5,
+    ):
+        self.model = model
+        self.max_length = max_length
+        self.max_span_ratio = max_span_ratio
+        self.max_span_slack = max_span_slack
+
+    @torch.no_grad()
+    def generate(
+        self,
+        input_ids: torch.LongTensor,
+        edit_mask: List[bool],
+        max_length: int = None,
+    ) -> Tuple[torch.LongTensor, dict]:
+        """
+        Generate output ids for a single (unpadded) input sequence.
+
+        Args:
+            input_ids (torch.LongTensor) - source ids of shape (1, seq_len)
+            edit_mask (List[bool]) - per source token, whether it is regenerated
+            max_length (int) - overrides the instance `max_length` for this call
+
+        Returns:
+            output_ids (torch.LongTensor) - shape (1, out_len), starting with the
+                decoder start token
+            stats (dict) - counts of `generated` and `copied` tokens and of
+                `decoder_passes`
+
+        """
+        if input_ids.shape[0] != 1:
+            raise ValueError("SpanEditDecoder.generate expects a single sequence")
+        if len(edit_mask) != input_ids.shape[-1]:
+            raise ValueError("edit_mask must have one entry per source token")
+
+        config = self.model.config
+        max_length = max_length or self.max_length
+        processors = build_logits_processor(config, max_length)
+        encoder_hidden_states = self.model.get_encoder()(
+            input_ids=input_ids
+        ).last_hidden_state
+
+        source = input_ids[0].tolist()
+        if source[-1] == config.eos_token_id:
+            source, edit_mask = source[:-1], edit_mask[:-1]
+        segments = self._segments(source, edit_mask)
+
+        sequence = [config.decoder_start_token_id]
+        stats = {"generated": 0, "copied": 0, "decoder_passes": 0}
+        state = {"past_key_values": None, "num_cached": 0}
+
+        def next_token_scores() -> torch.FloatTensor:
+            outputs = self.model.get_decoder()(
+                input_ids=torch.tensor(
+                    [sequence[state["num_cached"] :]], device=input_ids.device
+                ),
+                encoder_hidden_states=encoder_hidden_states,
+                past_key_values=state["past_key_values"],
+                use_cache=True,
+            )
+            state["past_key_values"] = outputs.past_key_values
+            state["num_cached"] = len(sequence)
+            stats["decoder_passes"] += 1
+
+            logits = project_to_vocabulary(self.model, outputs.last_hidden_state[:, -1])
+            return processors(torch.tensor([sequence], device=input_ids.device), logits)
+
+        for i, (is_edit, tokens) in enumerate(segments):
+            if not is_edit:
+                tokens = tokens[: max(max_length - 1 - len(sequence), 0)]
+                sequence += tokens
+                stats["copied"] += len(tokens)
+                continue
+
+            # generation for this span ends where the next copied segment begins
+            anchor = segments[i + 1][1][0] if i + 1 < len(segments) else None
+            max_span_tokens = (
+                int(self.max_span_ratio * len(tokens)) + self.max_span_slack
+            )
+            for _ in range(max_span_tokens):
+                if len(sequence) >= max_length - 1:
+                    break
+                scores = next_token_scores()
+                if anchor is not None:
+                    scores[:, config.eos_token_id] = -float("inf")
+                token = int(scores.argmax(dim=-1))
+                if token == anchor:
+                    break
+                sequence.append(token)
+                stats["generated"] += 1
+                if token == config.eos_token_id:
+                    break
+
+        if sequence[-1] != config.eos_token_id:
+            sequence.append(config.eos_token_id)
+
+        return torch.tensor([sequence], device=input_ids.device), stats
+
+    @staticmethod
+    def _segments(source: List[int], edit_mask: List[bool]) -> List[tuple]:
+        # runs of consecutive tokens with the same edit flag, as (is_edit, tokens)
+        segments = []
+        for token, is_edit in zip(source, edit_mask):
+            if segments and segments[-1][0] == bool(is_edit):
+                segments[-1][1].append(token)
+            else:
+                segments.append((bool(is_edit), [token]))
+        return segments
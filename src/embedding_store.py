@@ -0,0 +1,340 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import os
+import glob
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import List, Tuple
+
+import numpy as np
+
+from src.generation_cache import GenerationCache
+
+# file header: magic, vector dimension, committed record count, superseded flag
+_HEADER = np.dtype(
+    [("magic", "<u8"), ("dim", "<u8"), ("count", "<u8"), ("superseded", "<u8")]
+)
+_MAGIC = int.from_bytes(b"EMBSTORE", "little")
+
+
+class EmbeddingStore:
+    """
+    Persistent, memory-mapped store of sentence embeddings shared across processes.
+
+    Every vector is keyed by a 64-bit hash of the embedding model identifier and the
+    normalized text (see `make_keys`). Records (key + float32 vector) are appended to a
+    single file that readers memory-map, so lookups read vectors directly from the page
+    cache instead of deserializing them. The key index is kept in memory as a sorted
+    array, which makes a batch of lookups a single `np.searchsorted`.
+
+    Writers serialize on an exclusive file lock and append records before bumping the
+    committed count in the file header, so readers in other processes never see partial
+    records. Once the store holds more than `max_size` vectors, the most recently inserted
+    half is copied into a new generation file and the old one is marked superseded;
+    readers switch over on their next lookup. Eviction is FIFO: lookups are read-only and
+    do not keep a vector from being evicted.
+
+    Attributes:
+        path (str) - directory holding the store files
+        dim (int) - dimension of the stored vectors
+        max_size (int) - Upper limit on number of stored vectors
+
+    """
+
+    def __init__(self, path: str, dim: int, max_size: int = 1000000):
+        if max_size < 1:
+            raise ValueError("max_size must be a positive integer")
+
+        self.path = path
+        self.dim = dim
+        self.max_size = max_size
+
+        self._record = np.dtype([("key", "<u8"), ("vector", "<f4", (dim,))])
+        self._thread_lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "compactions": 0}
+
+        self._file_path = None
+        self._fd = None
+        self._records = np.empty(0, dtype=self._record)
+        self._count = 0
+        self._keys = np.empty(0, dtype=np.uint64)
+        self._rows = np.empty(0, dtype=np.int64)
+
+        os.makedirs(path, exist_ok=True)
+        with self._locked():
+            if not self._generation_paths():
+                self._write_generation(0, np.empty(0, dtype=self._record))
+            self._refresh()
+
+    def __len__(self) -> int:
+        with self._thread_lock:
+            self._refresh()
+            return self._count
+
+    @property
+    def stats(self) -> dict:
+        """
+        Counters for lookup `hits` and `misses`, vectors `writes` and `compactions`
+        made by this instance.
+
+        """
+        with self._thread_lock:
+            return dict(self._stats)
+
+    @staticmethod
+    def make_keys(texts: List[str], model_identifier: str) -> np.ndarray:
+        """
+        Hash each text, normalized as in `GenerationCache.normalize_text`, together
+        with the model identifier.
+
+        Args:
+            texts (List[str])
+            model_identifier (str) - identifier of the model that produced the vectors
+
+        Returns:
+            keys (np.ndarray) - uint64 key per text
+
+        """
+        prefix = model_identifier.encode("utf-8") + b"\0"
+        return np.array(
+            [
+                int.from_bytes(
+                    hashlib.blake2b(
+                        prefix + GenerationCache.normalize_text(text).encode("utf-8"),
+                        digest_size=8,
+                    ).digest(),
+                    "little",
+                )
+                for text in texts
+            ],
+            dtype=np.uint64,
+        )
+
+    def get(
+        self, texts: List[str], model_identifier: str
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Look up stored vectors for a batch of texts.
+
+        Args:
+            texts (List[str])
+            model_identifier (str) - identifier of the model that produced the vectors
+
+        Returns:
+            vectors (np.ndarray) - (num_found, dim) float32 vectors of the texts found,
+                in input order. When the hits are stored contiguously (e.g. texts looked
+                up in the order they were put) this is a read-only view into the memory
+                map; otherwise the hits are copied once per batch.
+            found (np.ndarray) - boolean mask over `texts` of the ones found
+
+        """
+        keys = self.make_keys(texts, model_identifier)
+
+        with self._thread_lock:
+            self._refresh()
+            rows, found = self._find(keys)
+            vectors = self._records["vector"]
+            if len(rows) and (np.diff(rows) == 1).all():
+                vectors = np.asarray(vectors[rows[0] : rows[-1] + 1])
+            else:
+                vectors = np.asarray(vectors[rows])
+
+            self._stats["hits"] += int(found.sum())
+            self._stats["misses"] += int(len(keys) - found.sum())
+
+        return vectors, found
+
+    def put(self, texts: List[str], vectors: np.ndarray, model_identifier: str):
+        """
+        Store vectors for a batch of texts, skipping any that are already stored.
+
+        Args:
+            texts (List[str])
+            vectors (np.ndarray) - (len(texts), dim) vectors
+            model_identifier (str) - identifier of the model that produced the vectors
+
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape != (len(texts), self.dim):
+            raise ValueError(
+                f"expected vectors of shape {(len(texts), self.dim)}, got {vectors.shape}"
+            )
+
+        keys, first_idxs = np.unique(
+            self.make_keys(texts, model_identifier), return_index=True
+        )
+        # back to input order, so that the latest texts are the last to be evicted
+        order = np.argsort(first_idxs)
+        keys, first_idxs = keys[order], first_idxs[order]
+
+        with self._locked():
+            self._refresh()
+            new = ~self._find(keys)[1]
+            if not new.any():
+                return
+
+            records = np.empty(int(new.sum()), dtype=self._record)
+            records["key"] = keys[new]
+            records["vector"] = vectors[first_idxs[new]]
+            records = records[-self.max_size :]
+
+            if self._count + len(records) > self.max_size:
+                self._compact(keep=max(self.max_size // 2 - len(records), 0))
+            self._append(records)
+            self._refresh()
+
+    def _find(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        positions = np.searchsorted(self._keys, keys)
+        positions = np.minimum(positions, max(len(self._keys) - 1, 0))
+        found = (
+            self._keys[positions] == keys
+            if len(self._keys)
+            else np.zeros(len(keys), dtype=bool)
+        )
+        return self._rows[positions[found]], found
+
+    def _refresh(self):
+        """
+        Pick up records committed by other processes and follow compactions.
+
+        """
+        header = self._read_header()
+        while header is None or header["superseded"]:
+            try:
+                self._open(self._generation_paths()[-1])
+            except FileNotFoundError:
+                # a concurrent compaction removed the generation just listed, look again
+                continue
+            header = self._read_header()
+
+        count = int(header["count"])
+        if count == self._count:
+            return
+
+        # map the open descriptor rather than the path, which a compaction may unlink
+        with open(self._fd, "rb", closefd=False) as f:
+            self._records = np.memmap(
+                f, dtype=self._record, mode="r", offset=_HEADER.itemsize, shape=(count,)
+            )
+        new_keys = np.asarray(self._records["key"][self._count : count])
+        order = np.argsort(new_keys, kind="stable")
+        positions = np.searchsorted(self._keys, new_keys[order])
+        self._keys = np.insert(self._keys, positions, new_keys[order])
+        self._rows = np.insert(
+            self._rows, positions, np.arange(self._count, count)[order]
+        )
+        self._count = count
+
+    def _open(self, file_path: str):
+        fd = os.open(file_path, os.O_RDONLY)
+        if self._fd is not None:
+            os.close(self._fd)
+        self._file_path = file_path
+        self._fd = fd
+        self._records = np.empty(0, dtype=self._record)
+        self._count = 0
+        self._keys = np.empty(0, dtype=np.uint64)
+        self._rows = np.empty(0, dtype=np.int64)
+
+        if int(self._read_header()["dim"]) != self.dim:
+            raise ValueError(f"store at {self.path} does not hold {self.dim}-d vectors")
+
+    def _read_header(self):
+        if self._fd is None:
+            return None
+        return np.frombuffer(os.pread(self._fd, _HEADER.itemsize, 0), dtype=_HEADER)[0]
+
+    def _append(self, records: np.ndarray):
+        with open(self._file_path, "r+b") as f:
+            f.seek(_HEADER.itemsize + self._count * self._record.itemsize)
+            f.write(records.tobytes())
+            f.flush()
+            # commit only once the records themselves are written
+            os.pwrite(
+                f.fileno(),
+                np.uint64(self._count + len(records)).tobytes(),
+                _HEADER.fields["count"][1],
+            )
+        self._stats["writes"] += len(records)
+
+    def _compact(self, keep: int):
+        old_path = self._file_path
+        kept = np.array(self._records[self._count - keep :]) if keep else None
+        generation = self._generation(old_path) + 1
+        self._write_generation(
+            generation, kept if kept is not None else np.empty(0, dtype=self._record)
+        )
+
+        with open(old_path, "r+b") as f:
+            os.pwrite(
+                f.fileno(), np.uint64(1).tobytes(), _HEADER.fields["superseded"][1]
+            )
+        # readers that still map the old file keep a valid view until they refresh
+        os.unlink(old_path)
+        self._stats["compactions"] += 1
+        self._refresh()
+
+    def _write_generation(self, generation: int, records: np.ndarray):
+        header = np.array([(_MAGIC, self.dim, len(records), 0)], dtype=_HEADER)
+        file_path = os.path.join(self.path, f"embeddings-{generation:08d}.bin")
+        with open(file_path + ".tmp", "wb") as f:
+            f.write(header.tobytes())
+            f.write(records.tobytes())
+        os.replace(file_path + ".tmp", file_path)
+
+    def _generation_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.path, "embeddings-*.bin")))
+
+    @staticmethod
+    def _generation(file_path: str) -> int:
+        return int(os.path.basename(file_path)[len("embeddings-") : -len(".bin")])
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            with open(os.path.join(self.path, "lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,245 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+from typing import Union
+
+import numpy as np
+from pyemd import emd
+
+# ground distances with a closed-form EMD
+UNIFORM = "uniform"
+ORDINAL = "ordinal"
+
+
+def uniform_emd(input_dists: np.ndarray, output_dists: np.ndarray) -> np.ndarray:
+    """
+    Earth Mover's Distance under a ground distance of 1 between every pair of classes.
+
+    Mass shared by both distributions stays in place at no cost, so only the surplus
+    has to move, one unit of distance at a time. For normalized distributions this is
+    the total variation distance; like pyemd, unequal totals cost the larger surplus.
+
+    Args:
+        input_dists (np.ndarray) - shape (..., num_classes)
+        output_dists (np.ndarray) - same shape as `input_dists`
+
+    Returns:
+        emd (np.ndarray) - shape (...)
+
+    """
+    diff = np.asarray(output_dists, dtype=np.float64) - np.asarray(
+        input_dists, dtype=np.float64
+    )
+    return np.maximum(
+        np.clip(diff, 0, None).sum(axis=-1), np.clip(-diff, 0, None).sum(axis=-1)
+    )
+
+
+def ordinal_emd(input_dists: np.ndarray, output_dists: np.ndarray) -> np.ndarray:
+    """
+    Earth Mover's Distance between normalized distributions over ordered classes.
+
+    With a ground distance of |i - j| between classes i and j (e.g. ordinal style
+    scales such as formality levels), the EMD is the L1 distance between the CDFs.
+
+    Args:
+        input_dists (np.ndarray) - shape (..., num_classes)
+        output_dists (np.ndarray) - same shape as `input_dists`
+
+    Returns:
+        emd (np.ndarray) - shape (...)
+
+    """
+    diff = np.asarray(output_dists, dtype=np.float64) - np.asarray(
+        input_dists, dtype=np.float64
+    )
+    return np.abs(np.cumsum(diff, axis=-1)[..., :-1]).sum(axis=-1)
+
+
+def batched_emd(
+    input_dists: np.ndarray,
+    output_dists: np.ndarray,
+    ground_distance: Union[str, np.ndarray] = UNIFORM,
+) -> np.ndarray:
+    """
+    Earth Mover's Distance for whole arrays of distribution pairs.
+
+    Uniform and ordinal ground distances (given by name, or as a matrix that is a
+    multiple of either) use the closed forms above; any other ground distance matrix
+    falls back to pyemd one pair at a time.
+
+    Args:
+        input_dists (np.ndarray) - shape (num_pairs, num_classes)
+        output_dists (np.ndarray) - shape (num_pairs, num_classes)
+        ground_distance (`str` or `np.ndarray`) - "uniform", "ordinal" or a
+            (num_classes, num_classes) distance matrix
+
+    Returns:
+        emd (np.ndarray) - shape (num_pairs,)
+
+    """
+    input_dists = np.atleast_2d(np.asarray(input_dists, dtype=np.float64))
+    output_dists = np.atleast_2d(np.asarray(output_dists, dtype=np.float64))
+    if input_dists.shape != output_dists.shape:
+        raise ValueError("input_dists and output_dists must have the same shape")
+
+    if isinstance(ground_distance, str):
+        if ground_distance == UNIFORM:
+            return uniform_emd(input_dists, output_dists)
+        if ground_distance == ORDINAL:
+            return ordinal_emd(input_dists, output_dists)
+        raise ValueError(f"Unknown ground distance: {ground_distance}")
+
+    distance_matrix = np.asarray(ground_distance, dtype=np.float64)
+    num_classes = input_dists.shape[-1]
+    if distance_matrix.shape != (num_classes, num_classes):
+        raise ValueError("distance matrix must be (num_classes, num_classes)")
+
+    scale = distance_matrix[0, -1] if num_classes > 1 else 0.0
+    uniform = np.full((num_classes, num_classes), scale)
+    if np.allclose(distance_matrix, uniform) or np.allclose(
+        distance_matrix, uniform - np.diag(np.diag(uniform))
+    ):
+        return scale * uniform_emd(input_dists, output_dists)
+
+    scale = distance_matrix[0, 1] if num_classes > 1 else 0.0
+    idxs = np.arange(num_classes)
+    if np.allclose(distance_matrix, scale * np.abs(idxs[:, None] - idxs[None, :])):
+        return scale * ordinal_emd(input_dists, output_dists)
+
+    return np.array(
+        [
+            emd(
+                np.ascontiguousarray(input_dist),
+                np.ascontiguousarray(output_dist),
+                distance_matrix,
+            )
+            for input_dist, output_dist in zip(input_dists, output_dists)
+        ]
+    )
+
+
+def direction_corrected_emd(
+    input_dists: np.ndarray,
+    output_dists: np.ndarray,
+    target_class_idx: int = 1,
+    ground_distance: Union[str, np.ndarray] = UNIFORM,
+    decimals: int = 4,
+) -> np.ndarray:
+    """
+    Style Transfer Intensity for arrays of distribution pairs: the EMD, negated where
+    the output moved away from the target class, rounded to `decimals` places.
+
+    Args:
+        input_dists (np.ndarray) - shape (num_pairs, num_classes)
+        output_dists (np.ndarray) - shape (num_pairs, num_classes)
+        target_class_idx (int) - index of the target style class
+        ground_distance (`str` or `np.ndarray`) - see `batched_emd`
+        decimals (int)
+
+    Returns:
+        sti (np.ndarray) - shape (num_pairs,)
+
+    """
+    input_dists = np.atleast_2d(np.asarray(input_dists, dtype=np.float64))
+    output_dists = np.atleast_2d(np.asarray(output_dists, dtype=np.float64))
+    if not input_dists.size:
+        return np.empty(0)
+
+    dist = batched_emd(input_dists, output_dists, ground_distance)
+    direction = np.where(
+        output_dists[:, target_class_idx] >= input_dists[:, target_class_idx], 1, -1
+    )
+    return np.round(dist * direction, decimals)
+
+
+def sti_fraction(
+    input_dists: np.ndarray,
+    output_dists: np.ndarray,
+    ideal_dist=(0.0, 1.0),
+    target_class_idx: int = 1,
+    ground_distance: Union[str, np.ndarray] = UNIFORM,
+    decimals: int = 4,
+) -> np.ndarray:
+    """
+    Direction-corrected Style Transfer Intensity fraction for arrays of distribution pairs.
+
+    Each pair's STI is divided by its potential: the STI from the input to
+    `ideal_dist` where the output moved towards the target class, or to the reversed
+    `ideal_dist` otherwise. Pairs with no potential give nan (or inf).
+
+    Args:
+        input_dists (np.ndarray) - shape (num_pairs, num_classes)
+        output_dists (np.ndarray) - shape (num_pairs, num_classes)
+        ideal_dist (sequence) - the maximum possible distribution
+        target_class_idx (int) - index of the target style class
+        ground_distance (`str` or `np.ndarray`) - see `batched_emd`
+        decimals (int) - rounding applied to STI and potential before dividing
+
+    Returns:
+        sti_fraction (np.ndarray) - shape (num_pairs,)
+
+    """
+    input_dists = np.atleast_2d(np.asarray(input_dists, dtype=np.float64))
+    if not input_dists.size:
+        return np.empty(0)
+    ideal_dist = np.asarray(ideal_dist, dtype=np.float64)
+
+    sti = direction_corrected_emd(
+        input_dists, output_dists, target_class_idx, ground_distance, decimals
+    )
+    towards = direction_corrected_emd(
+        input_dists,
+        np.broadcast_to(ideal_dist, input_dists.shape),
+        target_class_idx,
+        ground_distance,
+        decimals,
+    )
+    away = direction_corrected_emd(
+        input_dists,
+        np.broadcast_to(ideal_dist[::-1], input_dists.shape),
+        target_class_idx,
+        ground_distance,
+        decimals,
+    )
+    potential = np.where(sti > 0, towards, away)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return sti / potential
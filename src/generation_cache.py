@@ -0,0 +1,314 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class GenerationCache:
+    """
+    Content-addressed cache for generated text with in-flight request coalescing.
+
+    Entries are keyed by a hash of the model identifier, the normalized input text and
+    the generation config (see `make_key`). The in-memory store is an LRU bounded by
+    `max_size`, entries older than `ttl` seconds are treated as missing, and an optional
+    SQLite file at `path` persists entries across processes and restarts. On disk, the
+    least recently accessed entries are evicted first and expired entries are deleted;
+    reads record their access time in memory and it is written with the next write, so
+    that lookups never take the database write lock.
+
+    When several threads ask for the same key at the same time, only the first one
+    computes it; the others wait on that computation instead of starting their own.
+
+    Attributes:
+        max_size (int) - Upper limit on number of entries kept in memory and on disk
+        ttl (float) - Seconds after which an entry expires, None to never expire
+        path (str) - Optional path to a SQLite file used as on-disk backing store
+
+    """
+
+    def __init__(
+        self, max_size: int = 10000, ttl: Optional[float] = None, path: str = None
+    ):
+        if max_size < 1:
+            raise ValueError("max_size must be a positive integer")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._in_flight = {}
+        self._accessed = {}
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS generations "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, "
+                "accessed REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS generations_accessed "
+                "ON generations (accessed)"
+            )
+            self._db.commit()
+
+    @property
+    def stats(self) -> dict:
+        """
+        Counters for cache `hits`, `misses`, `coalesced` requests (served by waiting on
+        an identical in-flight computation) and `evictions`.
+
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """
+        Apply unicode NFC normalization and collapse runs of whitespace.
+
+        """
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    @classmethod
+    def make_key(cls, model_identifier: str, text: str, generation_config: dict) -> str:
+        """
+        Build a cache key from the model, normalized input text and generation config.
+
+        Args:
+            model_identifier (str)
+            text (str) - raw input text
+            generation_config (dict) - generation parameters that affect the output
+
+        Returns:
+            key (str) - hex digest
+
+        """
+        payload = json.dumps(
+            [model_identifier, cls.normalize_text(text), generation_config],
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_or_compute(
+        self, keys: List[str], compute_fn: Callable[[List[int]], List[Any]]
+    ) -> List[Any]:
+        """
+        Look up every key and compute the missing ones in a single call.
+
+        Args:
+            keys (List[str]) - one cache key per item
+            compute_fn (Callable) - given the indices (into `keys`) of the items to compute,
+                returns their values in the same order
+
+        Returns:
+            values (list) - one value per key
+
+        """
+        results = [None] * len(keys)
+        to_compute = OrderedDict()
+        to_await = OrderedDict()
+
+        with self._lock:
+            for idx, key in enumerate(keys):
+                if key in to_compute:
+                    to_compute[key].append(idx)
+                    self._stats["coalesced"] += 1
+                    continue
+                if key in to_await:
+                    to_await[key][1].append(idx)
+                    self._stats["coalesced"] += 1
+                    continue
+
+                found, value = self._lookup(key)
+                if found:
+                    results[idx] = value
+                    self._stats["hits"] += 1
+                elif key in self._in_flight:
+                    to_await[key] = (self._in_flight[key], [idx])
+                    self._stats["coalesced"] += 1
+                else:
+                    self._in_flight[key] = Future()
+                    to_compute[key] = [idx]
+                    self._stats["misses"] += 1
+
+        if to_compute:
+            try:
+                values = compute_fn([idxs[0] for idxs in to_compute.values()])
+                if len(values) != len(to_compute):
+                    raise ValueError(
+                        f"compute_fn returned {len(values)} values for {len(to_compute)} items"
+                    )
+            except BaseException as e:
+                with self._lock:
+                    for key in to_compute:
+                        self._in_flight.pop(key).set_exception(e)
+                raise
+
+            with self._lock:
+                self._store(list(zip(to_compute.keys(), values)))
+                for (key, idxs), value in zip(to_compute.items(), values):
+                    self._in_flight.pop(key).set_result(value)
+                    for idx in idxs:
+                        results[idx] = value
+
+        for future, idxs in to_await.values():
+            value = future.result()
+            for idx in idxs:
+                results[idx] = value
+
+        return results
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Look up a single key without computing it.
+
+        Returns:
+            (found, value) (tuple) - value is None when the key is missing or expired
+
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            self._stats["hits" if found else "misses"] += 1
+            return found, value
+
+    def set(self, key: str, value: Any):
+        """
+        Store a value computed outside of `get_or_compute`.
+
+        """
+        with self._lock:
+            self._store([(key, value)])
+
+    def set_many(self, items: List[Tuple[str, Any]]):
+        """
+        Store several (key, value) pairs with a single disk write.
+
+        """
+        with self._lock:
+            self._store(items)
+
+    def clear(self):
+        """
+        Remove all entries from memory and disk. Counters are kept.
+
+        """
+        with self._lock:
+            self._memory.clear()
+            self._accessed.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM generations")
+                self._db.commit()
+
+    def _is_expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _lookup(self, key: str) -> Tuple[bool, Any]:
+        if key in self._memory:
+            value, created = self._memory[key]
+            if not self._is_expired(created):
+                self._memory.move_to_end(key)
+                self._touch(key)
+                return True, value
+            del self._memory[key]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, created FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and not self._is_expired(row[1]):
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                self._touch(key)
+                return True, value
+
+        return False, None
+
+    def _store(self, items: List[Tuple[str, Any]]):
+        # one disk transaction (insert, prune, commit) per batch of items
+        created = time.time()
+        for key, value in items:
+            self._remember(key, value, created)
+
+        if self._db is not None and items:
+            self._db.executemany(
+                "UPDATE generations SET accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._accessed.items()],
+            )
+            self._accessed.clear()
+            self._db.executemany(
+                "INSERT OR REPLACE INTO generations (key, value, created, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                [(key, json.dumps(value), created, created) for key, value in items],
+            )
+            if self.ttl is not None:
+                self._db.execute(
+                    "DELETE FROM generations WHERE created < ?", (created - self.ttl,)
+                )
+            self._db.execute(
+                "DELETE FROM generations WHERE key IN "
+                "(SELECT key FROM generations ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            )
+            self._db.commit()
+
+    def _touch(self, key: str):
+        # access times are written to disk with the next write
+        if self._db is not None:
+            self._accessed[key] = time.time()
+
+    def _remember(self, key: str, value: Any, created: float):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
@@ -0,0 +1,160 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import time
+import threading
+from typing import Dict
+
+from src.generation_cache import GenerationCache
+from src.segmentation import split_sentences, replace_spans
+
+
+class IncrementalTransferSession:
+    """
+    Stateful document transfer for an editing loop, regenerating only edited sentences.
+
+    Each revision of the document is split into sentences and every sentence is
+    fingerprinted (model, normalized text and generation config, see
+    `GenerationCache.make_key`). Sentences whose fingerprint appeared in the previous
+    revision reuse that revision's output; only changed or new sentences are sent to
+    the model, in a single `transfer` call, and the outputs are spliced back into the
+    new revision. Latency therefore follows the size of the edit rather than the size
+    of the document. Only the latest revision's outputs are kept, so memory stays
+    proportional to the document.
+
+    Attributes:
+        style_transfer (StyleTransfer)
+        stats (dict) - running counts of `revisions`, `sentences` seen and sentences
+            actually `transferred`
+
+    """
+
+    def __init__(self, style_transfer):
+        self.style_transfer = style_transfer
+        self.stats = {"revisions": 0, "sentences": 0, "transferred": 0}
+
+        self._lock = threading.Lock()
+        self._outputs: Dict[str, str] = {}
+
+    @property
+    def reuse_rate(self) -> float:
+        """
+        Fraction of sentences served from the previous revision.
+
+        """
+        if not self.stats["sentences"]:
+            return 0.0
+        return 1 - self.stats["transferred"] / self.stats["sentences"]
+
+    def update(self, document: str) -> dict:
+        """
+        Transfer the style attribute on a new revision of the document.
+
+        Args:
+            document (str) - full text of the current revision
+
+        Returns:
+            output (dict) - a dictionary containing the restyled document as
+                `generated_text`, per-sentence `sentences` entries with the source
+                `text`, its `generated_text`, character offsets (`start`, `end`) and
+                whether it was `reused`, the number of sentences `transferred` and the
+                total `elapsed` seconds
+
+        """
+        start_time = time.perf_counter()
+
+        spans = split_sentences(document)
+        generation_config = self.style_transfer.generation_config
+        keys = [
+            GenerationCache.make_key(
+                self.style_transfer.model_identifier, span.text, generation_config
+            )
+            for span in spans
+        ]
+
+        with self._lock:
+            previous_outputs = self._outputs
+
+            # identical edited sentences are transferred once
+            missing = {}
+            for span, key in zip(spans, keys):
+                if key not in previous_outputs and key not in missing:
+                    # hard-wrapped line breaks are plain whitespace to the model
+                    missing[key] = GenerationCache.normalize_text(span.text)
+
+            outputs = {}
+            if missing:
+                generated_text = self.style_transfer.transfer(list(missing.values()))
+                outputs.update(zip(missing.keys(), generated_text))
+
+            outputs.update(
+                (key, previous_outputs[key]) for key in keys if key in previous_outputs
+            )
+            self._outputs = outputs
+
+            self.stats["revisions"] += 1
+            self.stats["sentences"] += len(spans)
+            self.stats["transferred"] += len(missing)
+
+        return {
+            "generated_text": replace_spans(
+                document, spans, [outputs[key] for key in keys]
+            ),
+            "sentences": [
+                {
+                    "text": span.text,
+                    "generated_text": outputs[key],
+                    "start": span.start,
+                    "end": span.end,
+                    "reused": key in previous_outputs,
+                }
+                for span, key in zip(spans, keys)
+            ],
+            "transferred": len(missing),
+            "elapsed": time.perf_counter() - start_time,
+        }
+
+    def reset(self):
+        """
+        Forget the previous revision, so the next update transfers every sentence.
+
+        """
+        with self._lock:
+            self._outputs = {}
@@ -0,0 +1,162 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import re
+from typing import List
+from dataclasses import dataclass
+
+# terminal punctuation (plus any closing quotes/brackets) followed by whitespace, or a
+# paragraph break; single line breaks (hard-wrapped text) are ordinary whitespace
+SENTENCE_BOUNDARY = re.compile(r"[.!?]+[\"'”’)\]]*(?=\s|$)|\n\s*\n")
+
+ABBREVIATIONS = {
+    "mr",
+    "mrs",
+    "ms",
+    "dr",
+    "prof",
+    "sr",
+    "jr",
+    "st",
+    "vs",
+    "etc",
+    "e.g",
+    "i.e",
+    "inc",
+    "ltd",
+    "co",
+    "no",
+    "fig",
+}
+
+# characters looked back from a period for the preceding word, well beyond the longest
+# abbreviation, so that checking a boundary does not scan the whole document so far
+MAX_WORD_LOOKBACK = 32
+
+
+@dataclass
+class SentenceSpan:
+    text: str
+    start: int
+    end: int
+
+
+def split_sentences(text: str) -> List[SentenceSpan]:
+    """
+    Split a document into sentences while keeping track of character offsets.
+
+    Sentences end at terminal punctuation followed by whitespace or at a paragraph break
+    (a blank line). A single line break, as in hard-wrapped text, does not end a sentence.
+    Periods that close a common abbreviation or a single-letter initial are not treated
+    as boundaries. Surrounding whitespace is excluded from each span so it can be
+    restored verbatim with `replace_spans`.
+
+    Args:
+        text (str) - document to split
+
+    Returns:
+        sentences (List[SentenceSpan]) - sentences in document order
+
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        if not match.group().isspace() and _ends_with_abbreviation(text, match.start()):
+            continue
+        _append_sentence(text, start, match.end(), sentences)
+        start = match.end()
+
+    _append_sentence(text, start, len(text), sentences)
+
+    return sentences
+
+
+def replace_spans(text: str, spans: List[SentenceSpan], replacements: List[str]) -> str:
+    """
+    Rebuild a document with each span swapped for its replacement.
+
+    All text between spans (whitespace, paragraph breaks) is kept as is.
+
+    Args:
+        text (str) - original document
+        spans (List[SentenceSpan]) - non-overlapping spans in document order
+        replacements (List[str]) - replacement text for each span
+
+    Returns:
+        text (str)
+
+    """
+    if len(spans) != len(replacements):
+        raise ValueError("spans and replacements must be of same length")
+
+    pieces = []
+    prev_end = 0
+    for span, replacement in zip(spans, replacements):
+        pieces.append(text[prev_end : span.start])
+        pieces.append(replacement)
+        prev_end = span.end
+    pieces.append(text[prev_end:])
+
+    return "".join(pieces)
+
+
+def _ends_with_abbreviation(text: str, punct_idx: int) -> bool:
+    if text[punct_idx] != ".":
+        return False
+
+    preceding = text[max(0, punct_idx - MAX_WORD_LOOKBACK) : punct_idx].rsplit(
+        maxsplit=1
+    )
+    if not preceding:
+        return False
+
+    word = preceding[-1].lower().lstrip("\"'(“‘[")
+    return word in ABBREVIATIONS or (len(word) == 1 and word.isalpha())
+
+
+def _append_sentence(text: str, start: int, end: int, sentences: List[SentenceSpan]):
+    segment = text[start:end]
+    stripped = segment.strip()
+    if not stripped:
+        return
+
+    span_start = start + (len(segment) - len(segment.lstrip()))
+    span_end = span_start + len(stripped)
+    sentences.append(SentenceSpan(text=stripped, start=span_start, end=span_end))
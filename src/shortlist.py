@@ -0,0 +1,363 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import json
+import hashlib
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List
+
+import torch
+from transformers import LogitsProcessorList, StoppingCriteriaList
+
+from src.decoding import (
+    build_logits_processor,
+    output_projection,
+    project_to_vocabulary,
+)
+
+
+class VocabularyShortlist:
+    """
+    Candidate output tokens for an input: its own tokens plus frequent and replacement tokens.
+
+    Style transfer outputs are mostly copies of their inputs, with a few function words
+    and attribute-specific replacements (e.g. "stunning" -> "notable") mixed in. The
+    shortlist for an input is the union of the input's tokens, `frequent_token_ids`,
+    the `lexicon` entries of each input token, and `special_token_ids`.
+
+    Attributes:
+        frequent_token_ids (List[int]) - token ids always included in the shortlist
+        lexicon (Dict[int, List[int]]) - replacement token ids for a given source token id
+        special_token_ids (List[int]) - e.g. EOS and BOS, always included
+
+    """
+
+    def __init__(
+        self,
+        frequent_token_ids: Iterable[int] = (),
+        lexicon: Dict[int, List[int]] = None,
+        special_token_ids: Iterable[int] = (),
+    ):
+        self.frequent_token_ids = sorted(set(frequent_token_ids))
+        self.lexicon = {
+            int(source_id): list(target_ids)
+            for source_id, target_ids in (lexicon or {}).items()
+        }
+        self.special_token_ids = sorted(set(special_token_ids))
+
+    def token_ids(self, source_ids: Iterable[int]) -> List[int]:
+        """
+        Shortlisted output token ids for an input with the given token ids.
+
+        """
+        token_ids = set(self.frequent_token_ids) | set(self.special_token_ids)
+        for source_id in source_ids:
+            token_ids.add(source_id)
+            token_ids.update(self.lexicon.get(source_id, ()))
+        return sorted(token_ids)
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Short hash of the shortlist contents, used to tell shortlists apart in cache keys.
+
+        """
+        payload = json.dumps(self.to_dict(), sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def to_dict(self) -> dict:
+        return {
+            "frequent_token_ids": self.frequent_token_ids,
+            "lexicon": {str(k): v for k, v in self.lexicon.items()},
+            "special_token_ids": self.special_token_ids,
+        }
+
+    def save(self, path: str):
+        """
+        Write the shortlist to a JSON file, e.g. one file per style attribute.
+
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str) -> "VocabularyShortlist":
+        """
+        Read a shortlist written by `save`.
+
+        """
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def from_tokenizer(
+        cls, tokenizer, frequent_tokens: Iterable[str] = (), **kwargs
+    ) -> "VocabularyShortlist":
+        """
+        Build a shortlist from a tokenizer's special tokens and a list of frequent words.
+
+        Each word is tokenized both with and without a leading space, since BPE
+        vocabularies hold separate entries for word-initial and sentence-initial forms.
+
+        """
+        frequent_token_ids = set(kwargs.pop("frequent_token_ids", ()))
+        for token in frequent_tokens:
+            for variant in (token, " " + token):
+                frequent_token_ids.update(
+                    tokenizer(variant, add_special_tokens=False)["input_ids"]
+                )
+        return cls(
+            frequent_token_ids=frequent_token_ids,
+            special_token_ids=tokenizer.all_special_ids,
+            **kwargs,
+        )
+
+    @classmethod
+    def from_parallel_data(
+        cls,
+        tokenizer,
+        source_texts: List[str],
+        target_texts: List[str],
+        num_frequent_tokens: int = 1000,
+        max_replacements: int = 10,
+        min_count: int = 2,
+    ) -> "VocabularyShortlist":
+        """
+        Learn a shortlist from aligned source/target examples of a style attribute.
+
+        The `num_frequent_tokens` most common target tokens become the frequent list.
+        For the lexicon, every token added in a target (absent from its source) is
+        counted against every token removed from that source, and each removed token
+        keeps its `max_replacements` most common additions seen at least `min_count` times.
+
+        Args:
+            tokenizer (PreTrainedTokenizer) - tokenizer of the seq2seq model
+            source_texts (List[str])
+            target_texts (List[str])
+            num_frequent_tokens (int)
+            max_replacements (int)
+            min_count (int)
+
+        Returns:
+            VocabularyShortlist
+
+        """
+        if len(source_texts) != len(target_texts):
+            raise ValueError("source_texts and target_texts must be the same length")
+
+        source_ids = tokenizer(source_texts, add_special_tokens=False)["input_ids"]
+        target_ids = tokenizer(target_texts, add_special_tokens=False)["input_ids"]
+
+        target_counts = Counter()
+        replacement_counts = defaultdict(Counter)
+        for source, target in zip(source_ids, target_ids):
+            target_counts.update(target)
+            source, target = set(source), set(target)
+            added = target - source
+            for removed_id in source - target:
+                replacement_counts[removed_id].update(added)
+
+        lexicon = {}
+        for source_id, counts in replacement_counts.items():
+            replacements = [
+                target_id
+                for target_id, count in counts.most_common(max_replacements)
+                if count >= min_count
+            ]
+            if replacements:
+                lexicon[source_id] = replacements
+
+        return cls(
+            frequent_token_ids=[
+                token_id
+                for token_id, _ in target_counts.most_common(num_frequent_tokens)
+            ],
+            lexicon=lexicon,
+            special_token_ids=tokenizer.all_special_ids,
+        )
+
+
+class ShortlistDecoder:
+    """
+    Greedy decoding for encoder-decoder models that projects onto a vocabulary shortlist.
+
+    On CPU, the output projection onto the full vocabulary (~50k rows for BART) is a
+    large share of every decoder step. Here each step only computes logits for the
+    union of the batch's shortlists (see `VocabularyShortlist`). When the top token
+    holds less than `min_confidence` of the probability mass within the shortlist, the
+    full projection is computed for that row instead, so low-confidence steps decode
+    exactly as `generate()` would. With `min_confidence=1.0` every step falls back and
+    the output matches greedy `generate()`.
+
+    Attributes:
+        model (PreTrainedModel) - encoder-decoder model
+        shortlist (VocabularyShortlist)
+        max_length (int) - Upper limit on output length, including the decoder start token
+        min_confidence (float) - shortlist probability of the top token below which
+            the full vocabulary is used for that step
+        stats (dict) - running counts of `batches`, decoded `rows` (one per item and
+            step), `fallbacks` to the full vocabulary and `shortlist_size` summed over batches
+
+    """
+
+    def __init__(
+        self,
+        model,
+        shortlist: VocabularyShortlist,
+        max_length: int,
+        min_confidence: float = 0.9,
+    ):
+        self.model = model
+        self.shortlist = shortlist
+        self.max_length = max_length
+        self.min_confidence = min_confidence
+        self.stats = {"batches": 0, "rows": 0, "fallbacks": 0, "shortlist_size": 0}
+
+    @property
+    def fallback_rate(self) -> float:
+        """
+        Fraction of decoded rows that needed the full vocabulary.
+
+        """
+        if not self.stats["rows"]:
+            return 0.0
+        return self.stats["fallbacks"] / self.stats["rows"]
+
+    @torch.no_grad()
+    def generate(
+        self,
+        input_ids: torch.LongTensor,
+        attention_mask: torch.LongTensor = None,
+        max_length: int = None,
+        logits_processor: LogitsProcessorList = None,
+        stopping_criteria: StoppingCriteriaList = None,
+    ) -> torch.LongTensor:
+        """
+        Generate output ids for a (padded) batch of input sequences.
+
+        Args:
+            input_ids (torch.LongTensor) - source ids of shape (batch_size, seq_len)
+            attention_mask (torch.LongTensor) - optional mask of the same shape
+            max_length (int) - overrides the instance `max_length` for this call
+            logits_processor (LogitsProcessorList) - extra processors applied after the
+                ones derived from the model config, as with `generate()`
+            stopping_criteria (StoppingCriteriaList) - optional criteria called after
+                every step with the sequences so far; generation stops once one returns
+                True (e.g. `CommittedPrefixStreamer`)
+
+        Returns:
+            output_ids (torch.LongTensor) - shape (batch_size, out_len), starting with
+                the decoder start token and padded after EOS, like `generate()`
+
+        """
+        config = self.model.config
+        device = input_ids.device
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+
+        max_length = max_length or self.max_length
+        processors = build_logits_processor(config, max_length)
+        if logits_processor is not None:
+            processors.extend(logits_processor)
+
+        token_ids = set()
+        for ids, mask in zip(input_ids.tolist(), attention_mask.tolist()):
+            token_ids.update(
+                self.shortlist.token_ids(i for i, m in zip(ids, mask) if m)
+            )
+        token_ids = torch.tensor(sorted(token_ids), device=device)
+
+        vocab_size = self.model.get_output_embeddings().weight.shape[0]
+        shortlist_projection = output_projection(self.model, token_ids)
+
+        encoder_hidden_states = self.model.get_encoder()(
+            input_ids=input_ids, attention_mask=attention_mask
+        ).last_hidden_state
+
+        batch_size = input_ids.shape[0]
+        sequences = torch.full(
+            (batch_size, 1), config.decoder_start_token_id, device=device
+        )
+        unfinished = torch.ones(batch_size, dtype=torch.bool, device=device)
+        past_key_values = None
+        while sequences.shape[-1] < max_length:
+            outputs = self.model.get_decoder()(
+                input_ids=sequences[:, -1:],
+                encoder_hidden_states=encoder_hidden_states,
+                encoder_attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            past_key_values = outputs.past_key_values
+            hidden_states = outputs.last_hidden_state[:, -1]
+
+            shortlist_logits = project_to_vocabulary(
+                self.model, hidden_states, shortlist_projection
+            )
+            scores = torch.full(
+                (batch_size, vocab_size),
+                -float("inf"),
+                dtype=shortlist_logits.dtype,
+                device=device,
+            )
+            scores[:, token_ids] = shortlist_logits
+
+            confidence = shortlist_logits.softmax(dim=-1).max(dim=-1).values
+            fallback = unfinished & (confidence < self.min_confidence)
+            if fallback.any():
+                scores[fallback] = project_to_vocabulary(
+                    self.model, hidden_states[fallback]
+                )
+
+            next_tokens = processors(sequences, scores).argmax(dim=-1)
+            next_tokens[~unfinished] = config.pad_token_id
+            sequences = torch.cat([sequences, next_tokens[:, None]], dim=-1)
+
+            self.stats["rows"] += int(unfinished.sum())
+            self.stats["fallbacks"] += int(fallback.sum())
+            unfinished &= next_tokens != config.eos_token_id
+            if stopping_criteria is not None and stopping_criteria(sequences, scores):
+                break
+            if not unfinished.any():
+                break
+
+        self.stats["batches"] += 1
+        self.stats["shortlist_size"] += len(token_ids)
+        return sequences
@@ -0,0 +1,423 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import re
+import zlib
+from typing import List, Tuple, Union
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+class HashedNgramClassifier:
+    """
+    Lightweight linear text classifier over hashed word n-grams.
+
+    Texts are lowercased, split into words and punctuation, and every n-gram in
+    `ngram_range` is hashed (CRC32, so features are stable across processes) into one
+    of `num_features` buckets. A multinomial logistic regression over the bucket
+    counts is trained with Adagrad on soft targets, which makes it suitable for
+    distilling a transformer classifier from its own output distributions.
+
+    Attributes:
+        num_classes (int)
+        num_features (int) - number of hash buckets
+        ngram_range (Tuple[int, int]) - smallest and largest n-gram size
+        weights (np.ndarray) - (num_features, num_classes) float32
+        bias (np.ndarray) - (num_classes,) float32
+
+    """
+
+    def __init__(
+        self,
+        num_classes: int,
+        num_features: int = 2**18,
+        ngram_range: Tuple[int, int] = (1, 2),
+    ):
+        self.num_classes = num_classes
+        self.num_features = num_features
+        self.ngram_range = tuple(ngram_range)
+        self.weights = np.zeros((num_features, num_classes), dtype=np.float32)
+        self.bias = np.zeros(num_classes, dtype=np.float32)
+
+    def featurize(self, input_text: List[str]) -> Tuple[np.ndarray, ...]:
+        """
+        Hash texts into a compressed sparse row matrix of n-gram counts.
+
+        Returns:
+            indptr, indices, values (np.ndarray) - row i holds `values[indptr[i]:indptr[i + 1]]`
+                at columns `indices[indptr[i]:indptr[i + 1]]`
+
+        """
+        indptr = [0]
+        indices, values = [], []
+        min_n, max_n = self.ngram_range
+        for text in input_text:
+            tokens = TOKEN_PATTERN.findall(text.lower())
+            counts = {}
+            for n in range(min_n, max_n + 1):
+                for start in range(len(tokens) - n + 1):
+                    ngram = " ".join(tokens[start : start + n]).encode("utf-8")
+                    bucket = zlib.crc32(ngram) % self.num_features
+                    counts[bucket] = counts.get(bucket, 0) + 1
+            indices.extend(counts.keys())
+            values.extend(counts.values())
+            indptr.append(len(indices))
+
+        values = np.asarray(values, dtype=np.float32)
+        # log-scaled counts keep long texts from dominating
+        return (
+            np.asarray(indptr, dtype=np.int64),
+            np.asarray(indices, dtype=np.int64),
+            np.log1p(values),
+        )
+
+    def predict_proba(self, input_text: List[str]) -> np.ndarray:
+        """
+        Class distributions of shape (num_inputs, num_classes).
+
+        """
+        return self._softmax(self._logits(*self.featurize(input_text)))
+
+    def fit(
+        self,
+        input_text: List[str],
+        distributions: np.ndarray,
+        epochs: int = 5,
+        batch_size: int = 256,
+        learning_rate: float = 0.5,
+        l2: float = 1e-6,
+        seed: int = 0,
+    ) -> "HashedNgramClassifier":
+        """
+        Train on texts and target class distributions, e.g. a teacher's `score_array`.
+
+        Args:
+            input_text (List[str])
+            distributions (np.ndarray) - (num_inputs, num_classes) soft or one-hot targets
+            epochs (int)
+            batch_size (int)
+            learning_rate (float) - Adagrad step size
+            l2 (float) - weight decay on the n-gram weights
+            seed (int) - seed for shuffling
+
+        Returns:
+            self
+
+        """
+        distributions = np.asarray(distributions, dtype=np.float32)
+        if distributions.shape != (len(input_text), self.num_classes):
+            raise ValueError("distributions must be of shape (num_inputs, num_classes)")
+
+        indptr, indices, values = self.featurize(input_text)
+        weight_accumulator = np.zeros_like(self.weights)
+        bias_accumulator = np.zeros_like(self.bias)
+        rng = np.random.default_rng(seed)
+
+        for _ in range(epochs):
+            order = rng.permutation(len(input_text))
+            for start in range(0, len(order), batch_size):
+                rows = order[start : start + batch_size]
+                batch = self._take_rows(indptr, indices, values, rows)
+                grad_logits = (
+                    self._softmax(self._logits(*batch)) - distributions[rows]
+                ) / len(rows)
+
+                batch_indptr, batch_indices, batch_values = batch
+                row_ids = np.repeat(np.arange(len(rows)), np.diff(batch_indptr))
+                grad_weights = batch_values[:, None] * grad_logits[row_ids]
+                features, inverse = np.unique(batch_indices, return_inverse=True)
+                feature_grads = np.zeros(
+                    (len(features), self.num_classes), dtype=np.float32
+                )
+                np.add.at(feature_grads, inverse, grad_weights)
+                feature_grads += l2 * self.weights[features]
+
+                weight_accumulator[features] += feature_grads**2
+                self.weights[features] -= (
+                    learning_rate
+                    * feature_grads
+                    / np.sqrt(weight_accumulator[features] + 1e-8)
+                )
+                grad_bias = grad_logits.sum(axis=0)
+                bias_accumulator += grad_bias**2
+                self.bias -= (
+                    learning_rate * grad_bias / np.sqrt(bias_accumulator + 1e-8)
+                )
+
+        return self
+
+    def save(self, path: str):
+        """
+        Write the model to a `.npz` file.
+
+        """
+        np.savez_compressed(
+            path,
+            weights=self.weights,
+            bias=self.bias,
+            ngram_range=np.array(self.ngram_range),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "HashedNgramClassifier":
+        """
+        Read a model written by `save`.
+
+        """
+        data = np.load(path)
+        num_features, num_classes = data["weights"].shape
+        model = cls(
+            num_classes,
+            num_features=num_features,
+            ngram_range=tuple(data["ngram_range"].tolist()),
+        )
+        model.weights = data["weights"]
+        model.bias = data["bias"]
+        return model
+
+    def _logits(
+        self, indptr: np.ndarray, indices: np.ndarray, values: np.ndarray
+    ) -> np.ndarray:
+        logits = np.tile(self.bias, (len(indptr) - 1, 1))
+        # a trailing zero row keeps reduceat offsets valid for empty rows at the end
+        contributions = np.concatenate(
+            [
+                values[:, None] * self.weights[indices],
+                np.zeros((1, self.num_classes), dtype=np.float32),
+            ]
+        )
+        row_sums = np.add.reduceat(contributions, indptr[:-1], axis=0)
+        non_empty = np.diff(indptr) > 0
+        logits[non_empty] += row_sums[non_empty]
+        return logits
+
+    @staticmethod
+    def _take_rows(
+        indptr: np.ndarray, indices: np.ndarray, values: np.ndarray, rows: np.ndarray
+    ) -> Tuple[np.ndarray, ...]:
+        lengths = indptr[rows + 1] - indptr[rows]
+        positions = np.concatenate(
+            [np.arange(indptr[row], indptr[row + 1]) for row in rows]
+        ).astype(np.int64)
+        return (
+            np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            indices[positions],
+            values[positions],
+        )
+
+    @staticmethod
+    def _softmax(logits: np.ndarray) -> np.ndarray:
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        np.exp(logits, out=logits)
+        logits /= logits.sum(axis=-1, keepdims=True)
+        return logits
+
+
+class StyleCascade:
+    """
+    Cheap-first style classification that only escalates uncertain texts to the transformer.
+
+    Every text is scored by a `HashedNgramClassifier` distilled from the transformer
+    classifier. Texts whose cheap probability for `target_class_idx` falls inside the
+    uncertainty band `[lower, upper]` are re-scored by the transformer; all others keep
+    the cheap distribution. Most text in a scan is clearly in one style, so most of it
+    never reaches the transformer.
+
+    Attributes:
+        classifier (StyleIntensityClassifier) - the full model
+        student (HashedNgramClassifier) - the cheap model
+        lower (float) - lower edge of the uncertainty band
+        upper (float) - upper edge of the uncertainty band
+        target_class_idx (int) - class whose probability is compared with the band
+        stats (dict) - running counts of scored `items` and `escalated` items
+
+    """
+
+    def __init__(
+        self,
+        classifier,
+        student: HashedNgramClassifier,
+        lower: float = 0.1,
+        upper: float = 0.9,
+        target_class_idx: int = 1,
+    ):
+        if not 0 <= lower <= upper <= 1:
+            raise ValueError("expected 0 <= lower <= upper <= 1")
+
+        self.classifier = classifier
+        self.student = student
+        self.lower = lower
+        self.upper = upper
+        self.target_class_idx = target_class_idx
+        self.stats = {"items": 0, "escalated": 0}
+
+    @classmethod
+    def distill(
+        cls, classifier, corpus: List[str], student_kwargs: dict = None, **kwargs
+    ) -> "StyleCascade":
+        """
+        Build a cascade by training the cheap model on the classifier's own predictions.
+
+        Args:
+            classifier (StyleIntensityClassifier)
+            corpus (List[str]) - unlabeled in-domain text
+            student_kwargs (dict) - passed to `HashedNgramClassifier`
+            **kwargs - passed to `StyleCascade`
+
+        Returns:
+            StyleCascade
+
+        """
+        distributions = classifier.score_array(corpus)
+        student = HashedNgramClassifier(
+            distributions.shape[1], **(student_kwargs or {})
+        ).fit(corpus, distributions)
+        return cls(classifier, student, **kwargs)
+
+    @property
+    def escalation_rate(self) -> float:
+        """
+        Fraction of scored items that were sent to the transformer.
+
+        """
+        if not self.stats["items"]:
+            return 0.0
+        return self.stats["escalated"] / self.stats["items"]
+
+    def score_array(
+        self, input_text: Union[str, List[str]], return_escalated: bool = False
+    ):
+        """
+        Classify texts with the cascade.
+
+        Args:
+            input_text (`str` or `List[str]`) - Input text for classification
+            return_escalated (bool) - also return which items reached the transformer
+
+        Returns:
+            distributions (np.ndarray) - (num_inputs, num_classes) float32, plus a
+                boolean `escalated` array if `return_escalated` is set
+
+        """
+        if isinstance(input_text, str):
+            input_text = [input_text]
+
+        distributions = self.student.predict_proba(input_text).astype(np.float32)
+        escalated = self._escalated(distributions)
+
+        escalated_idxs = np.flatnonzero(escalated)
+        if len(escalated_idxs):
+            distributions[escalated_idxs] = self.classifier.score_array(
+                [input_text[idx] for idx in escalated_idxs]
+            )
+
+        self.stats["items"] += len(input_text)
+        self.stats["escalated"] += len(escalated_idxs)
+
+        if return_escalated:
+            return distributions, escalated
+        return distributions
+
+    def score(self, input_text: Union[str, List[str]]) -> List[dict]:
+        """
+        Classify texts with the cascade, in the same format as `StyleIntensityClassifier.score`.
+
+        Returns:
+            classification (List[dict]) - dictionaries containing the label, score,
+                distribution between classes and whether the item was `escalated`
+
+        """
+        distributions, escalated = self.score_array(input_text, return_escalated=True)
+        id2label = self.classifier.pipeline.model.config.id2label
+        return [
+            {
+                "label": id2label[label_idx],
+                "score": round(score, 4),
+                "distribution": scores,
+                "escalated": item_escalated,
+            }
+            for label_idx, score, scores, item_escalated in zip(
+                distributions.argmax(axis=-1).tolist(),
+                distributions.max(axis=-1).tolist(),
+                distributions.tolist(),
+                escalated.tolist(),
+            )
+        ]
+
+    def evaluate(self, input_text: List[str]) -> dict:
+        """
+        Compare the cascade against running the transformer on every text.
+
+        Args:
+            input_text (List[str]) - held-out text
+
+        Returns:
+            report (dict) - the `escalation_rate`, label `agreement` of the cascade and
+                of the cheap model alone (`student_agreement`) with the transformer,
+                and the `mean_abs_error` of the cascade's target class probability
+
+        """
+        # the cascade's output is the transformer's wherever it escalates, so derive it
+        # from the full pass instead of running the transformer again (or updating `stats`)
+        full = self.classifier.score_array(input_text)
+        student = self.student.predict_proba(input_text).astype(np.float32)
+        escalated = self._escalated(student)
+        distributions = np.where(escalated[:, None], full, student)
+
+        full_labels = full.argmax(axis=-1)
+        return {
+            "items": len(input_text),
+            "escalation_rate": float(escalated.mean()) if len(input_text) else 0.0,
+            "agreement": float((distributions.argmax(axis=-1) == full_labels).mean()),
+            "student_agreement": float((student.argmax(axis=-1) == full_labels).mean()),
+            "mean_abs_error": float(
+                np.abs(
+                    distributions[:, self.target_class_idx]
+                    - full[:, self.target_class_idx]
+                ).mean()
+            ),
+        }
+
+    def _escalated(self, distributions: np.ndarray) -> np.ndarray:
+        # items whose cheap target class probability falls within the uncertainty band
+        target_proba = distributions[:, self.target_class_idx]
+        return (target_proba >= self.lower) & (target_proba <= self.upper)
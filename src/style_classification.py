@@ -38,13 +38,15 @@
 #
 # ###########################################################################
 
-from typing import List, Union
+from typing import List, Tuple, Union
 
 import torch
 import numpy as np
-from pyemd import emd
 from transformers import pipeline
 
+from src.batching import TokenBudgetBatcher
+from src.emd import UNIFORM, direction_corrected_emd, sti_fraction
+
 
 class StyleIntensityClassifier:
     """
@@ -62,12 +64,27 @@ class StyleIntensityClassifier:
 
     Attributes:
         model_identifier (str)
+        batch_size (int) - Upper limit on number of inputs classified in a single batch
+        max_tokens_per_batch (int) - Upper limit on padded input tokens in a single batch
+        ground_distance (`str` or `np.ndarray`) - ground distance between style classes
+            for EMD: "uniform" (the default, distance 1 between any two classes),
+            "ordinal" (distance |i - j| for ordered classes) or an explicit matrix
 
     """
 
-    def __init__(self, model_identifier: str):
+    def __init__(
+        self,
+        model_identifier: str,
+        batch_size: int = 32,
+        max_tokens_per_batch: int = None,
+        ground_distance: Union[str, np.ndarray] = UNIFORM,
+    ):
         self.model_identifier = model_identifier
+        self.ground_distance = ground_distance
         self.device = torch.cuda.current_device() if torch.cuda.is_available() else -1
+        self.batcher = TokenBudgetBatcher(
+            max_tokens_per_batch=max_tokens_per_batch, batch_size=batch_size
+        )
         self._build_pipeline()
 
     def _build_pipeline(self):
@@ -83,6 +100,9 @@ class StyleIntensityClassifier:
         """
         Classify a given input text using the model initialized by the class.
 
+        Inputs are classified in length-bucketed batches (see `TokenBudgetBatcher`)
+        and returned in their original order. This is a per-item view of `score_array`.
+
         Args:
             input_text (`str` or `List[str]`) - Input text for classification
 
@@ -90,24 +110,122 @@ class StyleIntensityClassifier:
             classification (dict) - a dictionary containing the label, score, and
                 distribution between classes
 
+        """
+        distributions = self.score_array(input_text)
+        id2label = self.pipeline.model.config.id2label
+        return [
+            {
+                "label": id2label[label_idx],
+                "score": round(score, 4),
+                "distribution": scores,
+            }
+            for label_idx, score, scores in zip(
+                distributions.argmax(axis=-1).tolist(),
+                distributions.max(axis=-1).tolist(),
+                distributions.tolist(),
+            )
+        ]
+
+    def score_array(
+        self, input_text: Union[str, List[str]], input_ids: List[List[int]] = None
+    ) -> np.ndarray:
+        """
+        Classify a given input text and return the class distributions as one array.
+
+        Texts are tokenized once, padded per length-bucketed batch and run through the
+        model directly under `torch.inference_mode`. The logits of each batch are
+        normalized in place (softmax, or sigmoid for single-label and multi-label
+        models, as in the `text-classification` pipeline) and written straight into the
+        output array, without building per-item Python objects.
+
+        Args:
+            input_text (`str` or `List[str]`) - Input text for classification
+            input_ids (List[List[int]]) - Optional token ids of `input_text` from an
+                identical tokenizer (with truncation), to skip tokenizing again
+
+        Returns:
+            distributions (np.ndarray) - contiguous float32 array of shape
+                (num_inputs, num_classes), in the original input order
+
         """
         if isinstance(input_text, str):
-            tmp = list()
-            tmp.append(input_text)
-            input_text = tmp
+            input_text = [input_text]
 
-        result = self.pipeline(input_text)
-        distributions = np.array(
-            [[label["score"] for label in item] for item in result]
+        model = self.pipeline.model
+        tokenizer = self.pipeline.tokenizer
+        distributions = np.empty(
+            (len(input_text), model.config.num_labels), dtype=np.float32
         )
-        return [
+        if not input_text:
+            return distributions
+
+        if input_ids is None:
+            input_ids = tokenizer(input_text, truncation=True)["input_ids"]
+
+        @torch.inference_mode()
+        def classify_batch(idxs: List[int]) -> List[int]:
+            encoded_input = tokenizer.pad(
+                {"input_ids": [input_ids[idx] for idx in idxs]}, return_tensors="pt"
+            )
+            logits = model(
+                **{k: v.to(self.pipeline.device) for k, v in encoded_input.items()}
+            ).logits
+            distributions[idxs] = self._normalize_logits(logits.float().cpu().numpy())
+            return idxs
+
+        self.batcher.run(
+            list(range(len(input_text))),
+            [len(ids) for ids in input_ids],
+            classify_batch,
+        )
+        return distributions
+
+    def score_table(self, input_text: Union[str, List[str]]):
+        """
+        Classify a given input text and return the results as an Arrow table.
+
+        Requires `pyarrow` (installed alongside streamlit).
+
+        Args:
+            input_text (`str` or `List[str]`) - Input text for classification
+
+        Returns:
+            classification (pyarrow.Table) - columns `label` (string), `score` (float32)
+                and `distribution` (fixed-size list of float32), one row per input
+
+        """
+        import pyarrow as pa
+
+        distributions = self.score_array(input_text)
+        id2label = self.pipeline.model.config.id2label
+        labels = np.array([id2label[idx] for idx in range(len(id2label))], dtype=object)
+
+        return pa.table(
             {
-                "label": self.pipeline.model.config.id2label[scores.argmax()],
-                "score": round(scores.max(), 4),
-                "distribution": scores.tolist(),
+                "label": pa.array(labels[distributions.argmax(axis=-1)], pa.string()),
+                "score": pa.array(distributions.max(axis=-1)),
+                "distribution": pa.FixedSizeListArray.from_arrays(
+                    pa.array(distributions.reshape(-1)), distributions.shape[1]
+                ),
             }
-            for scores in distributions
-        ]
+        )
+
+    def _normalize_logits(self, logits: np.ndarray) -> np.ndarray:
+        # same choice of function as the text-classification pipeline, applied in place
+        config = self.pipeline.model.config
+        if (
+            config.problem_type == "multi_label_classification"
+            or config.num_labels == 1
+        ):
+            np.negative(logits, out=logits)
+            np.exp(logits, out=logits)
+            logits += 1
+            return np.reciprocal(logits, out=logits)
+
+        logits -= logits.max(axis=-1, keepdims=True)
+        np.exp(logits, out=logits)
+        logits /= logits.sum(axis=-1, keepdims=True)
+        return logits
 
     def calculate_transfer_intensity(
         self, input_text: List[str], output_text: List[str], target_class_idx: int = 1
@@ -128,18 +246,15 @@ class StyleIntensityClassifier:
 
         """
 
-        if len(input_text) != len(output_text):
-            raise ValueError(
-                "input_text and output_text must be of same length with corresponding items"
-            )
-
-        input_dist = [item["distribution"] for item in self.score(input_text)]
-        output_dist = [item["distribution"] for item in self.score(output_text)]
+        input_scores, output_scores = self._score_pairs(input_text, output_text)
+        if not input_scores:
+            return []
+        input_dist = [item["distribution"] for item in input_scores]
+        output_dist = [item["distribution"] for item in output_scores]
 
-        return [
-            self.calculate_emd(input_dist[i], output_dist[i], target_class_idx)
-            for i in range(len(input_dist))
-        ]
+        return direction_corrected_emd(
+            input_dist, output_dist, target_class_idx, self.ground_distance
+        ).tolist()
 
     def calculate_transfer_intensity_fraction(
         self, input_text: List[str], output_text: List[str], target_class_idx: int = 1
@@ -161,23 +276,93 @@ class StyleIntensityClassifier:
 
         """
 
+        input_scores, output_scores = self._score_pairs(input_text, output_text)
+        if not input_scores:
+            return []
+        input_dist = [item["distribution"] for item in input_scores]
+        output_dist = [item["distribution"] for item in output_scores]
+
+        return sti_fraction(
+            input_dist,
+            output_dist,
+            ideal_dist=[0.0, 1.0],
+            target_class_idx=target_class_idx,
+            ground_distance=self.ground_distance,
+        ).tolist()
+
+    def evaluate(
+        self, input_text: List[str], output_text: List[str], target_class_idx: int = 1
+    ) -> List[dict]:
+        """
+        Calculate STI, STI fraction and style classifications for pairs of texts at once.
+
+        Inputs and outputs are deduplicated and classified in a single batched pass,
+        so each distinct string is classified exactly once no matter how many metrics
+        are reported.
+
+        Args:
+            input_text (list) - list of input texts with indicies corresponding
+                to counterpart in output_text
+            ouptput_text (list) - list of output texts with indicies corresponding
+                to counterpart in input_text
+            target_class_idx (int) - index of the target style class used for directional
+                score correction
+
+        Returns:
+            evaluation (List[dict]) - for each pair, a dictionary containing the `sti`,
+                `sti_fraction`, predicted `input_label` and `output_label`, and the
+                `input_distribution` and `output_distribution` between classes
+
+        """
+        input_scores, output_scores = self._score_pairs(input_text, output_text)
+        if not input_scores:
+            return []
+        input_dist = [item["distribution"] for item in input_scores]
+        output_dist = [item["distribution"] for item in output_scores]
+
+        sti = direction_corrected_emd(
+            input_dist, output_dist, target_class_idx, self.ground_distance
+        )
+        sti_fractions = sti_fraction(
+            input_dist,
+            output_dist,
+            ideal_dist=[0.0, 1.0],
+            target_class_idx=target_class_idx,
+            ground_distance=self.ground_distance,
+        )
+
+        return [
+            {
+                "sti": pair_sti,
+                "sti_fraction": pair_sti_fraction,
+                "input_label": input_item["label"],
+                "output_label": output_item["label"],
+                "input_distribution": input_item["distribution"],
+                "output_distribution": output_item["distribution"],
+            }
+            for pair_sti, pair_sti_fraction, input_item, output_item in zip(
+                sti.tolist(), sti_fractions.tolist(), input_scores, output_scores
+            )
+        ]
+
+    def _score_pairs(
+        self, input_text: List[str], output_text: List[str]
+    ) -> Tuple[List[dict], List[dict]]:
+        # classify every distinct input and output string once
         if len(input_text) != len(output_text):
             raise ValueError(
                 "input_text and output_text must be of same length with corresponding items"
             )
 
-        input_dist = [item["distribution"] for item in self.score(input_text)]
-        output_dist = [item["distribution"] for item in self.score(output_text)]
+        unique_text = list(dict.fromkeys(list(input_text) + list(output_text)))
+        if not unique_text:
+            return [], []
+        scores = dict(zip(unique_text, self.score(unique_text)))
 
-        return [
-            self.calculate_sti_fraction(
-                input_dist[i],
-                output_dist[i],
-                ideal_dist=[0.0, 1.0],
-                target_class_idx=target_class_idx,
-            )
-            for i in range(len(input_dist))
-        ]
+        return (
+            [scores[text] for text in input_text],
+            [scores[text] for text in output_text],
+        )
 
     def calculate_sti_fraction(
         self, input_dist, output_dist, ideal_dist=[0.0, 1.0], target_class_idx=1
@@ -203,19 +388,25 @@ class StyleIntensityClassifier:
             sti_fraction (float)
         """
 
-        sti = self.calculate_emd(input_dist, output_dist, target_class_idx)
+        sti = self.calculate_emd(
+            input_dist, output_dist, target_class_idx, self.ground_distance
+        )
 
         if sti > 0:
-            potential = self.calculate_emd(input_dist, ideal_dist, target_class_idx)
+            potential = self.calculate_emd(
+                input_dist, ideal_dist, target_class_idx, self.ground_distance
+            )
         else:
             potential = self.calculate_emd(
-                input_dist, ideal_dist[::-1], target_class_idx
+                input_dist, ideal_dist[::-1], target_class_idx, self.ground_distance
             )
 
         return sti / potential
 
     @staticmethod
-    def calculate_emd(input_dist, output_dist, target_class_idx):
+    def calculate_emd(
+        input_dist, output_dist, target_class_idx, ground_distance=UNIFORM
+    ):
         """
         Calculate the direction-corrected Earth Mover's Distance (aka Wasserstein distance)
         between two distributions of equal length. Here we penalize the EMD score if
@@ -228,18 +419,15 @@ class StyleIntensityClassifier:
                 from the input text to style transfer model
             output_dist (list) - probabilities assigned to the style classes
                 from the outut text of the style transfer model
+            ground_distance (`str` or `np.ndarray`) - see `src.emd.batched_emd`
 
         Returns:
             emd (float) - Earth Movers Distance between the two distributions
 
         """
 
-        N = len(input_dist)
-        distance_matrix = np.ones((N, N))
-        dist = emd(np.array(input_dist), np.array(output_dist), distance_matrix)
-
-        transfer_direction_correction = (
-            1 if output_dist[target_class_idx] >= input_dist[target_class_idx] else -1
+        return float(
+            direction_corrected_emd(
+                [input_dist], [output_dist], target_class_idx, ground_distance
+            )[0]
         )
-
-        return round(dist * transfer_direction_correction, 4)
@@ -0,0 +1,250 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import json
+import hashlib
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import torch
+import numpy as np
+
+from src.attribution import TokenAttribution
+
+
+class StyleLexicon:
+    """
+    Per-token style weights aggregated offline from word attributions over a corpus.
+
+    The style tokens of an attribute (e.g. "strikingly", "prominent" for subjective text)
+    are largely stable across sentences, so their average share of a sentence's total
+    absolute attribution can stand in for running the classifier and an attribution
+    method at request time (see `LexiconAttribution`).
+
+    Attributes:
+        weights (Dict[str, float]) - average attribution share of each token
+        counts (Dict[str, int]) - number of occurrences each weight was averaged over
+        model_identifier (str) - classifier the attributions were computed with
+        class_index (int) - output index the attributions were computed for
+
+    """
+
+    def __init__(
+        self,
+        weights: Dict[str, float],
+        counts: Dict[str, int] = None,
+        model_identifier: str = None,
+        class_index: int = 0,
+    ):
+        self.weights = dict(weights)
+        self.counts = dict(counts or {})
+        self.model_identifier = model_identifier
+        self.class_index = class_index
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    @classmethod
+    def from_attributions(
+        cls,
+        attributions: List[List[Tuple[str, float]]],
+        min_count: int = 2,
+        max_size: int = None,
+        **kwargs,
+    ) -> "StyleLexicon":
+        """
+        Aggregate word attributions into a lexicon.
+
+        Each token's weight is the mean, over its occurrences, of its share of the total
+        absolute attribution in the sentence it occurs in.
+
+        Args:
+            attributions (List[List[Tuple[str, float]]]) - (token, score) pairs per text,
+                e.g. from `TokenAttribution.attribute`
+            min_count (int) - tokens seen fewer times are left out
+            max_size (int) - Optional upper limit on number of tokens kept, by weight
+            **kwargs - `model_identifier` and `class_index` to record in the lexicon
+
+        Returns:
+            StyleLexicon
+
+        """
+        totals, counts = defaultdict(float), defaultdict(int)
+        for item in attributions:
+            scores = np.abs([score for _, score in item])
+            if not scores.sum() > 0:
+                continue
+            for (token, _), share in zip(item, scores / scores.sum()):
+                totals[token] += share
+                counts[token] += 1
+
+        weights = {
+            token: totals[token] / count
+            for token, count in counts.items()
+            if count >= min_count and totals[token] > 0
+        }
+        if max_size is not None:
+            weights = dict(
+                sorted(weights.items(), key=lambda item: item[1], reverse=True)[
+                    :max_size
+                ]
+            )
+
+        return cls(
+            weights={
+                token: round(float(weight), 6) for token, weight in weights.items()
+            },
+            counts={token: counts[token] for token in weights},
+            **kwargs,
+        )
+
+    def token_weights(self, tokens: List[str]) -> np.ndarray:
+        """
+        Look up the weight of each token, zero for tokens not in the lexicon.
+
+        """
+        return np.array([self.weights.get(token, 0.0) for token in tokens])
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Short hash of the lexicon contents.
+
+        """
+        payload = json.dumps(self.to_dict(), sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def to_dict(self) -> dict:
+        return {
+            "weights": self.weights,
+            "counts": self.counts,
+            "model_identifier": self.model_identifier,
+            "class_index": self.class_index,
+        }
+
+    def save(self, path: str):
+        """
+        Write the lexicon to a JSON file, e.g. one file per style attribute.
+
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str) -> "StyleLexicon":
+        """
+        Read a lexicon written by `save`.
+
+        """
+        with open(path) as f:
+            return cls(**json.load(f))
+
+
+class LexiconAttribution(TokenAttribution):
+    """
+    Model-free word attributions that score each token by its `StyleLexicon` weight.
+
+    Only tokenization and a dictionary lookup run at request time. Scores are always
+    non-negative and `class_index` is ignored in favor of the lexicon's own.
+
+    Attributes:
+        lexicon (StyleLexicon)
+        tokenizer (PreTrainedTokenizer) - tokenizer of the classifier the lexicon was built with
+
+    """
+
+    def __init__(self, lexicon: StyleLexicon, tokenizer):
+        super().__init__(model=None, tokenizer=tokenizer)
+        self.lexicon = lexicon
+
+    def _attribute(self, input_ids, baseline_ids, class_index):
+        scores = []
+        for ids, baseline in zip(input_ids, baseline_ids):
+            tokens = [
+                token.replace("Ġ", "")
+                for token in self.tokenizer.convert_ids_to_tokens(ids)
+            ]
+            is_special = np.array(ids) == np.array(baseline)
+            weights = np.where(is_special, 0.0, self.lexicon.token_weights(tokens))
+            scores.append(torch.from_numpy(weights))
+        return scores
+
+
+def masking_agreement(
+    attributions: List[List[Tuple[str, float]]],
+    reference: List[List[Tuple[str, float]]],
+    threshold: float = 0.3,
+) -> dict:
+    """
+    Compare the style tokens selected from two sets of attributions for the same texts.
+
+    Args:
+        attributions (List[List[Tuple[str, float]]]) - e.g. from `LexiconAttribution`
+        reference (List[List[Tuple[str, float]]]) - e.g. from integrated gradients
+        threshold (float) - percentage of style attribution as cutoff for selection
+
+    Returns:
+        agreement (dict) - share of texts with an identical selection (`exact`) and the
+            `precision`, `recall` and `f1` of the selected tokens against the reference
+
+    """
+    # imported here, since content_preservation builds lexicon attributions itself
+    from src.content_preservation import ContentPreservationScorer
+
+    def select(items):
+        lengths = [len(item) for item in items]
+        scores = np.zeros((len(items), max(lengths, default=0)))
+        for row, item in zip(scores, items):
+            row[: len(item)] = [score for _, score in item]
+        return ContentPreservationScorer.select_style_token_mask(
+            scores, lengths, threshold
+        )
+
+    selected, expected = select(attributions), select(reference)
+    true_positives = (selected & expected).sum()
+    precision = true_positives / max(selected.sum(), 1)
+    recall = true_positives / max(expected.sum(), 1)
+
+    return {
+        "exact": float((selected == expected).all(axis=1).mean()),
+        "precision": float(precision),
+        "recall": float(recall),
+        "f1": float(2 * precision * recall / max(precision + recall, 1e-12)),
+    }
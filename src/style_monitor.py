@@ -0,0 +1,170 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from src.generation_cache import GenerationCache
+from src.segmentation import split_sentences
+
+
+class DocumentStyleMonitor:
+    """
+    Sentence-level style detection for a document that changes while the user types.
+
+    Each update splits the document into sentences and looks up every sentence's
+    fingerprint (a hash of its normalized text) in an index of previously computed
+    style distributions. Only sentences missing from the index are classified, in a
+    single batched call, so re-scoring after a keystroke costs one sentence rather
+    than the whole document. The index is an LRU bounded by `max_size`, so it also
+    covers undo and sentences that move around.
+
+    Attributes:
+        classifier (StyleIntensityClassifier) - anything with a `score_array` method
+            and the classifier's `id2label`
+        max_size (int) - Upper limit on number of sentence distributions kept
+        stats (dict) - running counts of `updates`, `sentences` seen and sentences
+            actually `scored`
+
+    """
+
+    def __init__(self, classifier, max_size: int = 10000):
+        if max_size < 1:
+            raise ValueError("max_size must be a positive integer")
+
+        self.classifier = classifier
+        self.max_size = max_size
+        self.stats = {"updates": 0, "sentences": 0, "scored": 0}
+
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+
+    @staticmethod
+    def fingerprint(text: str) -> str:
+        """
+        Hash of the normalized sentence text (see `GenerationCache.normalize_text`).
+
+        """
+        normalized = GenerationCache.normalize_text(text)
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    def update(self, document: str) -> dict:
+        """
+        Classify the current revision of a document sentence by sentence.
+
+        Args:
+            document (str) - full text of the current revision
+
+        Returns:
+            output (dict) - a dictionary containing per-sentence `sentences` entries
+                with the `text`, character offsets (`start`, `end`), `label`, `score`,
+                `distribution` and whether it was `rescored`; the document-level
+                `distribution` (the sentence distributions averaged with weights
+                proportional to sentence length) and its `label`; the number of
+                sentences `scored` in this update and the `elapsed` seconds
+
+        """
+        start_time = time.perf_counter()
+
+        spans = split_sentences(document)
+        keys = [self.fingerprint(span.text) for span in spans]
+
+        with self._lock:
+            missing = {}
+            for span, key in zip(spans, keys):
+                if key in self._index:
+                    self._index.move_to_end(key)
+                elif key not in missing:
+                    missing[key] = span.text
+
+            scored = {}
+            if missing:
+                scored = dict(
+                    zip(
+                        missing.keys(),
+                        self.classifier.score_array(list(missing.values())),
+                    )
+                )
+            distributions = np.array(
+                [scored[key] if key in scored else self._index[key] for key in keys],
+                dtype=np.float32,
+            )
+
+            self._index.update(scored)
+            while len(self._index) > self.max_size:
+                self._index.popitem(last=False)
+
+            self.stats["updates"] += 1
+            self.stats["sentences"] += len(spans)
+            self.stats["scored"] += len(missing)
+
+        id2label = self.classifier.pipeline.model.config.id2label
+        sentences = [
+            {
+                "text": span.text,
+                "start": span.start,
+                "end": span.end,
+                "label": id2label[int(distribution.argmax())],
+                "score": round(float(distribution.max()), 4),
+                "distribution": distribution.tolist(),
+                "rescored": key in missing,
+            }
+            for span, key, distribution in zip(spans, keys, distributions)
+        ]
+
+        document_distribution = None
+        document_label = None
+        if spans:
+            weights = np.array([len(span.text) for span in spans], dtype=np.float32)
+            document_distribution = (weights @ distributions) / weights.sum()
+            document_label = id2label[int(document_distribution.argmax())]
+            document_distribution = document_distribution.tolist()
+
+        return {
+            "sentences": sentences,
+            "distribution": document_distribution,
+            "label": document_label,
+            "scored": len(missing),
+            "elapsed": time.perf_counter() - start_time,
+        }
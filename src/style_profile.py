@@ -0,0 +1,155 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Union
+
+import torch
+import pandas as pd
+
+
+class StyleProfiler:
+    """
+    Utility for profiling text against several style attributes at once.
+
+    Every classifier scores the same texts on its own worker thread, so the latency
+    of a profile approaches that of the slowest model rather than the sum of all of
+    them. The available intra-op (PyTorch) threads are split evenly between the
+    workers so that concurrent models do not oversubscribe the CPU. The PyTorch
+    thread count is process-wide, so it is set once when the profiler is created and
+    also applies to any other model running in the same process. Classifiers whose
+    tokenizers are identical share a single tokenization pass.
+
+    Attributes:
+        classifiers (Dict[str, StyleIntensityClassifier]) - classifier per style attribute
+        num_threads (int) - intra-op threads given to each worker (set process-wide)
+        last_elapsed (dict) - seconds spent by each attribute in the latest `profile`
+
+    """
+
+    def __init__(self, classifiers: Dict[str, object], num_threads: int = None):
+        if not classifiers:
+            raise ValueError("at least one classifier is required")
+
+        self.classifiers = dict(classifiers)
+        self.num_threads = num_threads or max(
+            torch.get_num_threads() // len(self.classifiers), 1
+        )
+        self.last_elapsed = {}
+        torch.set_num_threads(self.num_threads)
+
+        # attributes grouped by identical tokenizers
+        self._tokenizer_groups = {}
+        for attribute, classifier in self.classifiers.items():
+            key = self._tokenizer_fingerprint(classifier.pipeline.tokenizer)
+            self._tokenizer_groups.setdefault(key, []).append(attribute)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.classifiers), thread_name_prefix="style-profile"
+        )
+
+    def profile(self, input_text: Union[str, List[str]]) -> pd.DataFrame:
+        """
+        Classify texts against every style attribute.
+
+        Args:
+            input_text (`str` or `List[str]`) - Input text to profile
+
+        Returns:
+            profile (pd.DataFrame) - one row per input with the `text` and, for every
+                attribute, its predicted `<attribute>_label`, `<attribute>_score` and the
+                probability of each class as `<attribute>_<class label>`
+
+        """
+        if isinstance(input_text, str):
+            input_text = [input_text]
+
+        input_ids = {}
+        for attributes in self._tokenizer_groups.values():
+            tokenizer = self.classifiers[attributes[0]].pipeline.tokenizer
+            group_ids = tokenizer(input_text, truncation=True)["input_ids"]
+            input_ids.update((attribute, group_ids) for attribute in attributes)
+
+        futures = {
+            attribute: self._executor.submit(
+                self._score, classifier, input_text, input_ids[attribute]
+            )
+            for attribute, classifier in self.classifiers.items()
+        }
+
+        columns = {"text": input_text}
+        for attribute, future in futures.items():
+            distributions, elapsed = future.result()
+            self.last_elapsed[attribute] = elapsed
+
+            id2label = self.classifiers[attribute].pipeline.model.config.id2label
+            columns[f"{attribute}_label"] = [
+                id2label[idx] for idx in distributions.argmax(axis=-1).tolist()
+            ]
+            columns[f"{attribute}_score"] = distributions.max(axis=-1)
+            for idx in range(distributions.shape[1]):
+                columns[f"{attribute}_{id2label[idx]}"] = distributions[:, idx]
+
+        return pd.DataFrame(columns)
+
+    def close(self):
+        """
+        Shut down the worker threads.
+
+        """
+        self._executor.shutdown(wait=True)
+
+    def _score(self, classifier, input_text: List[str], input_ids: List[List[int]]):
+        start_time = time.perf_counter()
+        distributions = classifier.score_array(input_text, input_ids=input_ids)
+        return distributions, time.perf_counter() - start_time
+
+    @staticmethod
+    def _tokenizer_fingerprint(tokenizer) -> str:
+        # fast tokenizers serialize their full configuration (vocab, normalizer, ...)
+        backend = getattr(tokenizer, "backend_tokenizer", None)
+        if backend is not None:
+            payload = backend.to_str()
+        else:
+            payload = f"{type(tokenizer).__name__}:{tokenizer.name_or_path}"
+        payload += f":{tokenizer.model_max_length}"
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
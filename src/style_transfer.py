@@ -38,10 +38,29 @@
 #
 # ###########################################################################
 
-from typing import List, Union
+import copy
+import time
+import queue
+import threading
+from typing import Iterator, List, Tuple, Union
 
 import torch
-from transformers import pipeline
+import pandas as pd
+from transformers import pipeline, LogitsProcessorList, StoppingCriteriaList
+from transformers.modeling_outputs import BaseModelOutput
+
+from src.batching import TokenBudgetBatcher
+from src.decoding import (
+    CommittedPrefixStreamer,
+    DeadlineLogitsProcessor,
+    PromptLookupDecoder,
+    LengthPolicy,
+    PerItemLengthLogitsProcessor,
+    SpanEditDecoder,
+)
+from src.generation_cache import GenerationCache
+from src.segmentation import split_sentences, replace_spans
+from src.shortlist import ShortlistDecoder, VocabularyShortlist
 
 
 class StyleTransfer:
@@ -51,6 +70,21 @@ class StyleTransfer:
     Attributes:
         model_identifier (str) - Path to the model that will be used by the pipeline to make predictions
         max_gen_length (int) - Upper limit on number of tokens the model can generate as output
+        batch_size (int) - Upper limit on number of inputs generated for in a single batch
+        max_tokens_per_batch (int) - Upper limit on padded input tokens in a single batch
+        cache (GenerationCache) - Optional cache of generated outputs shared across calls
+            (and across instances using the same cache)
+        prompt_lookup_decoding (bool) - Speculatively copy continuations from the input and
+            verify them in a single decoder pass (see `PromptLookupDecoder`). Only applies
+            to greedy decoding (`num_beams=1`); beam search uses the regular pipeline.
+        num_speculative_tokens (int) - Upper limit on tokens proposed per decoder pass
+        length_policy (LengthPolicy) - Optional per-item limits on generated tokens derived
+            from each input's token count, bounded above by `max_gen_length`
+        vocabulary_shortlist (VocabularyShortlist) - Optional shortlist of output tokens
+            to project onto during greedy decoding (see `ShortlistDecoder`). Only applies
+            to greedy decoding (`num_beams=1`) without prompt lookup decoding.
+        shortlist_min_confidence (float) - shortlist probability of the top token below
+            which a step falls back to the full vocabulary
 
     """
 
@@ -60,14 +94,44 @@ class StyleTransfer:
         max_gen_length: int = 200,
         num_beams=4,
         temperature=1,
+        batch_size: int = 32,
+        max_tokens_per_batch: int = None,
+        cache: GenerationCache = None,
+        prompt_lookup_decoding: bool = False,
+        num_speculative_tokens: int = 10,
+        length_policy: LengthPolicy = None,
+        vocabulary_shortlist: VocabularyShortlist = None,
+        shortlist_min_confidence: float = 0.9,
     ):
         self.model_identifier = model_identifier
         self.max_gen_length = max_gen_length
         self.num_beams = num_beams
         self.temperature = temperature
+        self.cache = cache
+        self.length_policy = length_policy
         self.device = torch.cuda.current_device() if torch.cuda.is_available() else -1
+        self.batcher = TokenBudgetBatcher(
+            max_tokens_per_batch=max_tokens_per_batch, batch_size=batch_size
+        )
         self._build_pipeline()
 
+        self.prompt_lookup_decoder = None
+        if prompt_lookup_decoding:
+            self.prompt_lookup_decoder = PromptLookupDecoder(
+                self.pipeline.model,
+                max_length=self.max_gen_length,
+                num_speculative_tokens=num_speculative_tokens,
+            )
+
+        self.shortlist_decoder = None
+        if vocabulary_shortlist is not None:
+            self.shortlist_decoder = ShortlistDecoder(
+                self.pipeline.model,
+                vocabulary_shortlist,
+                max_length=self.max_gen_length,
+                min_confidence=shortlist_min_confidence,
+            )
+
     def _build_pipeline(self):
 
         self.pipeline = pipeline(
@@ -79,16 +143,798 @@ class StyleTransfer:
             temperature=self.temperature,
         )
 
-    def transfer(self, input_text: Union[str, List[str]]) -> List[str]:
+    def transfer(
+        self,
+        input_text: Union[str, List[str]],
+        max_time: Union[float, List[float]] = None,
+        return_details: bool = False,
+        return_scores: bool = False,
+    ) -> Union[List[str], List[dict]]:
         """
         Transfer the style attribute on a given piece of text using the
         initialized `model_identifier`.
 
+        Inputs are generated for in length-bucketed batches (see `TokenBudgetBatcher`)
+        and returned in their original order. If a `cache` is set, previously generated
+        outputs are reused and only cache misses are sent to the model.
+
+        With `max_time`, each input gets a time budget measured from the start of the
+        call. Once an input's budget is spent its decoding is stopped and the best
+        hypothesis available at that point (finished or partial) is returned and flagged
+        as `truncated`; other inputs in the same batch continue. Truncated outputs are
+        not cached.
+
+        With `return_scores`, the log-probabilities that decoding computed anyway are
+        kept as a fluency signal at no extra cost: beam search's length-normalized
+        `sequence_score` (the mean token log-probability for greedy decoding) and the
+        log-probability of every generated token. Scored outputs always come from
+        `generate()` and bypass the cache.
+
         Args:
             input_text (`str` or `List[str]`) - Input text for style transfer
+            max_time (`float` or `List[float]`) - Optional time budget in seconds, either
+                for every input or per input (None entries have no budget)
+            return_details (bool) - Return a dictionary per input instead of the text
+            return_scores (bool) - Also return log-probabilities (implies `return_details`)
+
+        Returns:
+            generated_text (`List[str]`) - The generated text outputs, or if
+                `return_details` is set, dictionaries containing the `generated_text`,
+                whether it was `truncated` by the time budget, and the `elapsed` seconds
+                from the start of the call until the input's output was complete, plus
+                the `sequence_score` and per-token `token_logprobs` with `return_scores`
+
+        """
+        if isinstance(input_text, str):
+            input_text = [input_text]
+
+        keys = None
+        if self.cache is not None:
+            generation_config = self.generation_config
+            keys = [
+                self.cache.make_key(self.model_identifier, text, generation_config)
+                for text in input_text
+            ]
+
+        if max_time is None and not return_details and not return_scores:
+            if keys is None:
+                return self._generated_text(self._transfer_uncached(input_text))
+            return self.cache.get_or_compute(
+                keys,
+                lambda idxs: self._generated_text(
+                    self._transfer_uncached([input_text[idx] for idx in idxs])
+                ),
+            )
+
+        start_time = time.monotonic()
+        if not isinstance(max_time, (list, tuple)):
+            max_time = [max_time] * len(input_text)
+        deadlines = [None if t is None else start_time + t for t in max_time]
+
+        if return_scores:
+            keys = None
+
+        details = [None] * len(input_text)
+        if keys is not None:
+            for idx, key in enumerate(keys):
+                found, generated_text = self.cache.get(key)
+                if found:
+                    details[idx] = {
+                        "generated_text": generated_text,
+                        "truncated": False,
+                        "elapsed": time.monotonic() - start_time,
+                    }
+
+        missing = [idx for idx, detail in enumerate(details) if detail is None]
+        if missing:
+            results = self._transfer_uncached(
+                [input_text[idx] for idx in missing],
+                deadlines=[deadlines[idx] for idx in missing],
+                start_time=start_time,
+                return_scores=return_scores,
+            )
+            for idx, result in zip(missing, results):
+                details[idx] = result
+            if keys is not None:
+                self.cache.set_many(
+                    [
+                        (keys[idx], result["generated_text"])
+                        for idx, result in zip(missing, results)
+                        if not result["truncated"]
+                    ]
+                )
+
+        if return_details or return_scores:
+            return details
+        return self._generated_text(details)
+
+    def transfer_stream(self, input_text: str) -> Iterator[str]:
+        """
+        Transfer the style attribute on a single piece of text, yielding partial output
+        as soon as it is committed.
+
+        Generation runs in a background thread with the same parameters (including the
+        `length_policy` and `vocabulary_shortlist`) as `transfer`.
+        With greedy decoding every new token is committed immediately; with beam search
+        a token is committed once all live beams agree on it (see `CommittedPrefixStreamer`).
+        The last item yielded is always the complete output, identical to what
+        `transfer` returns. Beam search may still prefer a hypothesis that finished
+        earlier, so only that last item is guaranteed to extend the previous ones.
+
+        Args:
+            input_text (str) - Input text for style transfer
+
+        Yields:
+            generated_text (str) - The committed output so far
+
+        """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(
+                self.model_identifier, input_text, self.generation_config
+            )
+            found, generated_text = self.cache.get(cache_key)
+            if found:
+                yield generated_text
+                return
+
+        text_queue = queue.Queue()
+        streamer = CommittedPrefixStreamer(self.pipeline.tokenizer, text_queue)
+        result = {}
+
+        def generate():
+            try:
+                encoded_input = self._encode([input_text])
+                min_new_tokens, max_new_tokens = self._length_limits(encoded_input)
+
+                generate_kwargs = self._generate_kwargs()
+                logits_processor = LogitsProcessorList()
+                if self.length_policy is not None:
+                    generate_kwargs["max_length"] = max_new_tokens[0] + 1
+                    logits_processor.append(
+                        PerItemLengthLogitsProcessor(
+                            min_new_tokens,
+                            max_new_tokens,
+                            eos_token_id=self.pipeline.model.config.eos_token_id,
+                            num_beams=self.num_beams,
+                        )
+                    )
+
+                if self._uses_shortlist_decoding:
+                    output_ids = self.shortlist_decoder.generate(
+                        **encoded_input,
+                        max_length=generate_kwargs["max_length"],
+                        logits_processor=logits_processor,
+                        stopping_criteria=StoppingCriteriaList([streamer]),
+                    )
+                else:
+                    output_ids = self.pipeline.model.generate(
+                        **encoded_input,
+                        **generate_kwargs,
+                        logits_processor=logits_processor,
+                        stopping_criteria=StoppingCriteriaList([streamer]),
+                    )
+                self._output_lengths(output_ids, max_new_tokens)
+                result["generated_text"] = self._decode(output_ids)[0]
+            except BaseException as e:
+                result["error"] = e
+            finally:
+                text_queue.put(None)
+
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+
+        partial_text = None
+        for partial_text in iter(text_queue.get, None):
+            yield partial_text
+        thread.join()
+
+        if "error" in result:
+            raise result["error"]
+
+        if cache_key is not None:
+            self.cache.set(cache_key, result["generated_text"])
+        if result["generated_text"] != partial_text:
+            yield result["generated_text"]
+
+    def transfer_sweep(
+        self, input_text: Union[str, List[str]], configs: List[dict]
+    ) -> pd.DataFrame:
+        """
+        Transfer the style attribute on a given piece of text under many generation configs.
+
+        The encoder is run once per batch of inputs and its outputs are reused for every
+        config, so sweeping decoding parameters only pays for the decoder. Each config is a
+        dict that may set `max_gen_length`, `num_beams` and `temperature` (defaulting to
+        the instance values) plus any other keyword argument accepted by `generate()`.
+        The cache, length policy and prompt lookup decoding are not applied here.
+
+        Args:
+            input_text (`str` or `List[str]`) - Input text for style transfer
+            configs (List[dict]) - generation configs to decode under
+
+        Returns:
+            results (pd.DataFrame) - one row per (config, input) pair with the config index
+                and effective values, the input index and text, the `generated_text`, and the
+                `encoder_elapsed` and `decoder_elapsed` seconds attributed to that item
+
+        """
+        if isinstance(input_text, str):
+            input_text = [input_text]
+
+        configs = [dict(config) for config in configs]
+        sweep_results = self.batcher.run(
+            list(range(len(input_text))),
+            self._token_lengths(input_text),
+            lambda idxs: self._sweep_batch([input_text[i] for i in idxs], configs),
+        )
+
+        records = []
+        for config_idx, config in enumerate(configs):
+            config = {**self.generation_config, **config}
+            config.pop("length_policy", None)
+            for input_idx, item_results in enumerate(sweep_results):
+                records.append(
+                    {
+                        "config_idx": config_idx,
+                        **config,
+                        "input_idx": input_idx,
+                        "input_text": input_text[input_idx],
+                        **item_results[config_idx],
+                    }
+                )
+
+        return pd.DataFrame.from_records(records)
+
+    def transfer_minimal_edit(
+        self,
+        input_text: Union[str, List[str]],
+        style_spans: List[List[Tuple[int, int]]],
+    ) -> List[dict]:
+        """
+        Transfer the style attribute by regenerating only the style-carrying spans of the text.
+
+        Tokens overlapping a span are regenerated and all other tokens are copied
+        verbatim (see `SpanEditDecoder`), so the decoding cost scales with the number of
+        edits rather than the length of the text. Spans typically come from the style
+        classifier's token attributions via `ContentPreservationScorer.find_style_spans`.
+        Edits are decoded greedily regardless of `num_beams`.
+
+        Args:
+            input_text (`str` or `List[str]`) - Input text for style transfer
+            style_spans (List[List[Tuple[int, int]]]) - for each input, (start, end)
+                character offsets of the spans to regenerate
+
+        Returns:
+            outputs (List[dict]) - for each input, a dictionary containing the
+                `generated_text`, the number of tokens actually decoded
+                (`num_generated_tokens`), copied (`num_copied_tokens`), the number of
+                `decoder_passes` and the `elapsed` seconds
+
+        """
+        if isinstance(input_text, str):
+            input_text = [input_text]
+        if len(style_spans) != len(input_text):
+            raise ValueError("style_spans must have one entry per input")
+
+        decoder = SpanEditDecoder(self.pipeline.model, max_length=self.max_gen_length)
+
+        outputs = []
+        for text, spans in zip(input_text, style_spans):
+            start_time = time.perf_counter()
+            encoded_input = self.pipeline.tokenizer(
+                text, return_offsets_mapping=True, return_tensors="pt"
+            )
+            edit_mask = [
+                end > start
+                and any(
+                    start < span_end and end > span_start
+                    for span_start, span_end in spans
+                )
+                for start, end in encoded_input["offset_mapping"][0].tolist()
+            ]
+
+            output_ids, stats = decoder.generate(
+                encoded_input["input_ids"].to(self.pipeline.device), edit_mask
+            )
+            outputs.append(
+                {
+                    "generated_text": self._decode(output_ids)[0],
+                    "num_generated_tokens": stats["generated"],
+                    "num_copied_tokens": stats["copied"],
+                    "decoder_passes": stats["decoder_passes"],
+                    "elapsed": time.perf_counter() - start_time,
+                }
+            )
+
+        return outputs
+
+    def generate_candidates(
+        self, input_text: Union[str, List[str]], k: int = 4
+    ) -> List[List[dict]]:
+        """
+        Generate the top-k beam search candidates for each piece of text.
+
+        Beam search is run with `max(num_beams, k)` beams and returns the k best
+        finished hypotheses along with their length-normalized log-probability
+        (`sequence_score`), which beam search computes anyway.
+
+        Args:
+            input_text (`str` or `List[str]`) - Input text for style transfer
+            k (int) - number of candidates per input
+
+        Returns:
+            candidates (List[List[dict]]) - for each input, k dictionaries containing the
+                `generated_text` and `sequence_score`, best first
+
+        """
+        if isinstance(input_text, str):
+            input_text = [input_text]
+
+        return self.batcher.run(
+            input_text,
+            self._token_lengths(input_text),
+            lambda batch: self._generate_candidates_batch(batch, k),
+        )
+
+    def score_pairs(
+        self, source_text: List[str], candidate_text: List[str]
+    ) -> List[dict]:
+        """
+        Score how likely the model is to produce each candidate for its source text.
+
+        All pairs are scored with a single teacher-forced forward pass per batch, so
+        outputs from other systems (or edited by hand) can be compared on the same
+        scale as `transfer(..., return_scores=True)`. Scores are the model's raw
+        log-probabilities, without the decoding-time logits processors.
+
+        Args:
+            source_text (List[str]) - Input text for style transfer
+            candidate_text (List[str]) - Output text to score, one per input
 
         Returns:
-            generated_text (`List[str]`) - The generated text outputs
+            scores (List[dict]) - for each pair, a dictionary containing the mean token
+                log-probability as `sequence_score` and the per-token `token_logprobs`
+
+        """
+        if len(source_text) != len(candidate_text):
+            raise ValueError(
+                "source_text and candidate_text must be of same length with corresponding items"
+            )
+
+        lengths = [
+            source_length + candidate_length
+            for source_length, candidate_length in zip(
+                self._token_lengths(source_text), self._token_lengths(candidate_text)
+            )
+        ]
+        return self.batcher.run(
+            list(zip(source_text, candidate_text)), lengths, self._score_pairs_batch
+        )
+
+    def with_generation_config(
+        self, max_gen_length: int = None, num_beams: int = None, temperature=None
+    ) -> "StyleTransfer":
+        """
+        Return a copy of this instance with different generation parameters.
 
+        The copy shares the underlying pipeline, model, batcher and cache, so switching
+        parameters (e.g. from the app sliders) does not reload or rebuild anything.
+
+        """
+        other = copy.copy(self)
+        if max_gen_length is not None:
+            other.max_gen_length = max_gen_length
+        if num_beams is not None:
+            other.num_beams = num_beams
+        if temperature is not None:
+            other.temperature = temperature
+
+        if self.prompt_lookup_decoder is not None:
+            other.prompt_lookup_decoder = copy.copy(self.prompt_lookup_decoder)
+            other.prompt_lookup_decoder.max_length = other.max_gen_length
+        if self.shortlist_decoder is not None:
+            other.shortlist_decoder = copy.copy(self.shortlist_decoder)
+            other.shortlist_decoder.max_length = other.max_gen_length
+
+        return other
+
+    @property
+    def prompt_lookup_stats(self) -> dict:
         """
-        return [item["generated_text"] for item in self.pipeline(input_text)]
+        Running counts from prompt lookup decoding along with the token `acceptance_rate`.
+
+        """
+        if self.prompt_lookup_decoder is None:
+            return {}
+        return {
+            **self.prompt_lookup_decoder.stats,
+            "acceptance_rate": self.prompt_lookup_decoder.acceptance_rate,
+        }
+
+    @property
+    def shortlist_stats(self) -> dict:
+        """
+        Running counts from shortlist decoding along with the `fallback_rate`.
+
+        """
+        if self.shortlist_decoder is None:
+            return {}
+        return {
+            **self.shortlist_decoder.stats,
+            "fallback_rate": self.shortlist_decoder.fallback_rate,
+        }
+
+    @property
+    def generation_config(self) -> dict:
+        """
+        Generation parameters that determine the model output for a given input.
+
+        """
+        generation_config = {
+            "max_gen_length": self.max_gen_length,
+            "num_beams": self.num_beams,
+            "temperature": self.temperature,
+        }
+        if self.length_policy is not None:
+            generation_config["length_policy"] = [
+                self.length_policy.max_ratio,
+                self.length_policy.max_slack,
+                self.length_policy.min_ratio,
+                self.length_policy.min_slack,
+            ]
+        if self._uses_shortlist_decoding:
+            generation_config["vocabulary_shortlist"] = [
+                self.shortlist_decoder.shortlist.fingerprint,
+                self.shortlist_decoder.min_confidence,
+            ]
+        return generation_config
+
+    @property
+    def _uses_prompt_lookup_decoding(self) -> bool:
+        return self.prompt_lookup_decoder is not None and self.num_beams == 1
+
+    @property
+    def _uses_shortlist_decoding(self) -> bool:
+        return (
+            self.shortlist_decoder is not None
+            and self.num_beams == 1
+            and not self._uses_prompt_lookup_decoding
+        )
+
+    def transfer_document(self, document: str) -> dict:
+        """
+        Transfer the style attribute on a long, multi-sentence document.
+
+        Rather than generating for the whole document at once (which is truncated by
+        `max_gen_length` and scales quadratically in attention cost), the document is
+        split into sentences, all sentences are transferred together in length-bucketed
+        batches, and the outputs are spliced back into the original document so that
+        whitespace and paragraph breaks are preserved.
+
+        Args:
+            document (str) - Input text for style transfer
+
+        Returns:
+            output (dict) - a dictionary containing the restyled document as
+                `generated_text`, the total `elapsed` seconds, and per-sentence
+                `sentences` entries with the source `text`, its `generated_text`,
+                character offsets (`start`, `end`) and `elapsed` seconds (the
+                sentence's share of the time spent generating its batch, 0 for
+                sentences served from the `cache`)
+
+        """
+        start_time = time.perf_counter()
+
+        spans = split_sentences(document)
+        # hard-wrapped line breaks are plain whitespace to the model
+        sentence_text = [GenerationCache.normalize_text(span.text) for span in spans]
+        sentence_elapsed = [0.0] * len(spans)
+
+        def transfer_missing(idxs: List[int]) -> List[str]:
+            # each bucket is generated for directly, without going through the cache
+            # and batcher again
+            missing_text = [sentence_text[idx] for idx in idxs]
+            results = self.batcher.run(
+                missing_text,
+                self._token_lengths(missing_text),
+                self._timed_transfer_batch,
+            )
+            for idx, (_, elapsed) in zip(idxs, results):
+                sentence_elapsed[idx] = elapsed
+            return [generated for generated, _ in results]
+
+        if not spans:
+            generated_text = []
+        elif self.cache is None:
+            generated_text = transfer_missing(list(range(len(spans))))
+        else:
+            generation_config = self.generation_config
+            generated_text = self.cache.get_or_compute(
+                [
+                    self.cache.make_key(self.model_identifier, text, generation_config)
+                    for text in sentence_text
+                ],
+                transfer_missing,
+            )
+
+        return {
+            "generated_text": replace_spans(document, spans, generated_text),
+            "sentences": [
+                {
+                    "text": span.text,
+                    "generated_text": generated,
+                    "start": span.start,
+                    "end": span.end,
+                    "elapsed": elapsed,
+                }
+                for span, generated, elapsed in zip(
+                    spans, generated_text, sentence_elapsed
+                )
+            ],
+            "elapsed": time.perf_counter() - start_time,
+        }
+
+    def _timed_transfer_batch(self, input_text: List[str]) -> List[tuple]:
+        start_time = time.perf_counter()
+        results = self._transfer_batch(
+            [(text, None) for text in input_text], time.monotonic()
+        )
+        elapsed = (time.perf_counter() - start_time) / len(input_text)
+        return [(result["generated_text"], elapsed) for result in results]
+
+    def _transfer_uncached(
+        self,
+        input_text: List[str],
+        deadlines: List[float] = None,
+        start_time: float = None,
+        return_scores: bool = False,
+    ) -> List[dict]:
+        if deadlines is None:
+            deadlines = [None] * len(input_text)
+        if start_time is None:
+            start_time = time.monotonic()
+
+        return self.batcher.run(
+            list(zip(input_text, deadlines)),
+            self._token_lengths(input_text),
+            lambda items: self._transfer_batch(items, start_time, return_scores),
+        )
+
+    @staticmethod
+    def _generated_text(results: List[dict]) -> List[str]:
+        return [result["generated_text"] for result in results]
+
+    def _generate_kwargs(self, **config) -> dict:
+        generate_kwargs = {
+            "max_length": config.pop("max_gen_length", self.max_gen_length),
+            "num_beams": config.pop("num_beams", self.num_beams),
+            "temperature": config.pop("temperature", self.temperature),
+        }
+        generate_kwargs.update(config)
+        return generate_kwargs
+
+    def _generate_candidates_batch(
+        self, input_text: List[str], k: int
+    ) -> List[List[dict]]:
+        outputs = self.pipeline.model.generate(
+            **self._encode(input_text),
+            **self._generate_kwargs(num_beams=max(self.num_beams, k)),
+            num_return_sequences=k,
+            output_scores=True,
+            return_dict_in_generate=True,
+        )
+
+        generated_text = self._decode(outputs.sequences)
+        sequence_scores = (
+            outputs.sequences_scores.tolist()
+            if getattr(outputs, "sequences_scores", None) is not None
+            else [None] * len(generated_text)
+        )
+        candidates = [
+            {"generated_text": generated, "sequence_score": score}
+            for generated, score in zip(generated_text, sequence_scores)
+        ]
+        return [candidates[i * k : (i + 1) * k] for i in range(len(input_text))]
+
+    @torch.no_grad()
+    def _sweep_batch(self, input_text: List[str], configs: List[dict]) -> List[list]:
+        start_time = time.perf_counter()
+        encoded_input = self._encode(input_text)
+        encoder_outputs = self.pipeline.model.get_encoder()(**encoded_input)
+        encoder_elapsed = (time.perf_counter() - start_time) / len(input_text)
+
+        item_results = [[] for _ in input_text]
+        for config in configs:
+            start_time = time.perf_counter()
+            # generate() expands encoder outputs for beam search in place, so pass a fresh wrapper
+            output_ids = self.pipeline.model.generate(
+                **encoded_input,
+                encoder_outputs=BaseModelOutput(
+                    last_hidden_state=encoder_outputs.last_hidden_state
+                ),
+                **self._generate_kwargs(**config),
+            )
+            decoder_elapsed = (time.perf_counter() - start_time) / len(input_text)
+
+            for results, generated in zip(item_results, self._decode(output_ids)):
+                results.append(
+                    {
+                        "generated_text": generated,
+                        "encoder_elapsed": encoder_elapsed,
+                        "decoder_elapsed": decoder_elapsed,
+                    }
+                )
+
+        return item_results
+
+    @torch.no_grad()
+    def _score_pairs_batch(self, pairs: List[tuple]) -> List[dict]:
+        model = self.pipeline.model
+        encoded_input = self._encode([source for source, _ in pairs])
+        encoded_labels = self._encode([candidate for _, candidate in pairs])
+        labels = encoded_labels["input_ids"]
+
+        logits = model(
+            **encoded_input,
+            decoder_input_ids=model.prepare_decoder_input_ids_from_labels(
+                labels=labels
+            ),
+        ).logits
+        logprobs = logits.log_softmax(dim=-1)
+        token_logprobs = logprobs.gather(-1, labels[..., None]).squeeze(-1)
+
+        scores = []
+        for item_logprobs, mask in zip(
+            token_logprobs, encoded_labels["attention_mask"]
+        ):
+            item_logprobs = item_logprobs[mask.bool()].tolist()
+            scores.append(
+                {
+                    "sequence_score": sum(item_logprobs) / len(item_logprobs),
+                    "token_logprobs": item_logprobs,
+                }
+            )
+        return scores
+
+    def _encode(self, input_text: List[str]) -> dict:
+        encoded_input = self.pipeline.tokenizer(
+            input_text, padding=True, return_tensors="pt"
+        )
+        return {k: v.to(self.pipeline.device) for k, v in encoded_input.items()}
+
+    def _decode(self, output_ids: torch.Tensor) -> List[str]:
+        return self.pipeline.tokenizer.batch_decode(
+            output_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )
+
+    def _token_lengths(self, input_text: List[str]) -> List[int]:
+        return [len(ids) for ids in self.pipeline.tokenizer(input_text)["input_ids"]]
+
+    def _length_limits(self, encoded_input: dict) -> tuple:
+        # per-item (min_new_tokens, max_new_tokens), or (None, None) without a length policy
+        if self.length_policy is None:
+            return None, None
+        input_lengths = encoded_input["attention_mask"].sum(dim=1).tolist()
+        return (
+            self.length_policy.min_new_tokens(input_lengths),
+            self.length_policy.max_new_tokens(input_lengths, self.max_gen_length - 1),
+        )
+
+    def _output_lengths(self, output_ids, max_new_tokens: List[int]) -> List[int]:
+        # output lengths include the decoder start token
+        pad_token_id = self.pipeline.model.config.pad_token_id
+        output_lengths = [int((ids != pad_token_id).sum()) for ids in output_ids]
+        if self.length_policy is not None:
+            self.length_policy.record(
+                [length - 1 for length in output_lengths], max_new_tokens
+            )
+        return output_lengths
+
+    def _transfer_batch(
+        self, items: List[tuple], start_time: float, return_scores: bool = False
+    ) -> List[dict]:
+        input_text = [text for text, _ in items]
+        deadlines = [deadline for _, deadline in items]
+        eos_token_id = self.pipeline.model.config.eos_token_id
+
+        encoded_input = self._encode(input_text)
+        min_new_tokens, max_new_tokens = self._length_limits(encoded_input)
+
+        if self._uses_prompt_lookup_decoding and not return_scores:
+            # (deadline processor, item index within it) for each input
+            item_deadlines = [
+                (DeadlineLogitsProcessor([deadline], eos_token_id), 0)
+                for deadline in deadlines
+            ]
+            output_ids = [
+                self.prompt_lookup_decoder.generate(
+                    **self._encode([text]),
+                    max_length=max_new_tokens[i] + 1 if max_new_tokens else None,
+                    min_length=min_new_tokens[i] if min_new_tokens else 0,
+                    logits_processor=LogitsProcessorList([item_deadlines[i][0]]),
+                )[0]
+                for i, text in enumerate(input_text)
+            ]
+        else:
+            deadline_processor = DeadlineLogitsProcessor(
+                deadlines, eos_token_id, num_beams=self.num_beams
+            )
+            item_deadlines = [(deadline_processor, i) for i in range(len(items))]
+            logits_processor = LogitsProcessorList([deadline_processor])
+
+            generate_kwargs = self._generate_kwargs()
+            if self.length_policy is not None:
+                generate_kwargs["max_length"] = max(max_new_tokens) + 1
+                logits_processor.append(
+                    PerItemLengthLogitsProcessor(
+                        min_new_tokens,
+                        max_new_tokens,
+                        eos_token_id=eos_token_id,
+                        num_beams=self.num_beams,
+                    )
+                )
+
+            if self._uses_shortlist_decoding and not return_scores:
+                output_ids = self.shortlist_decoder.generate(
+                    **encoded_input,
+                    max_length=generate_kwargs["max_length"],
+                    logits_processor=logits_processor,
+                )
+            elif return_scores:
+                outputs = self.pipeline.model.generate(
+                    **encoded_input,
+                    **generate_kwargs,
+                    logits_processor=logits_processor,
+                    output_scores=True,
+                    return_dict_in_generate=True,
+                )
+                output_ids = outputs.sequences
+                token_logprobs = self._token_logprobs(outputs)
+                sequence_scores = getattr(outputs, "sequences_scores", None)
+            else:
+                output_ids = self.pipeline.model.generate(
+                    **encoded_input,
+                    **generate_kwargs,
+                    logits_processor=logits_processor,
+                )
+            output_ids = list(output_ids)
+
+        output_lengths = self._output_lengths(output_ids, max_new_tokens)
+
+        results = []
+        now = time.monotonic()
+        for i, (generated_text, length, (processor, idx)) in enumerate(
+            zip(self._decode(output_ids), output_lengths, item_deadlines)
+        ):
+            finished_at = processor.finished_at(length)
+            result = {
+                "generated_text": generated_text,
+                "truncated": processor.is_truncated(idx, length),
+                "elapsed": (finished_at or now) - start_time,
+            }
+            if return_scores:
+                result["token_logprobs"] = token_logprobs[i, : length - 1].tolist()
+                result["sequence_score"] = (
+                    float(sequence_scores[i])
+                    if sequence_scores is not None
+                    else sum(result["token_logprobs"]) / max(length - 1, 1)
+                )
+            results.append(result)
+        return results
+
+    def _token_logprobs(self, outputs) -> torch.Tensor:
+        # log-probability of each generated token (after the decoder start token)
+        model = self.pipeline.model
+        beam_indices = getattr(outputs, "beam_indices", None)
+        if beam_indices is None:
+            # greedy search keeps the processed logits of every step
+            logprobs = torch.stack(outputs.scores, dim=1).log_softmax(dim=-1)
+            return logprobs.gather(-1, outputs.sequences[:, 1:, None]).squeeze(-1)
+        if hasattr(model, "compute_transition_scores"):
+            return model.compute_transition_scores(
+                outputs.sequences, outputs.scores, beam_indices
+            )
+        return model.compute_transition_beam_scores(
+            outputs.sequences, outputs.scores, beam_indices
+        )
@@ -0,0 +1,163 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+from typing import List, Union
+
+from src.emd import sti_fraction
+from src.style_transfer import StyleTransfer
+from src.style_classification import StyleIntensityClassifier
+from src.content_preservation import ContentPreservationScorer
+
+
+class StyleSuggester:
+    """
+    Utility for suggesting restyled text by generating several candidates per input
+    and reranking them with the evaluation metrics.
+
+    For a batch of inputs, the top-k beam search candidates are generated, then every
+    source and candidate is classified in a single batched classifier pass (for Style
+    Transfer Intensity) and embedded in a single batched SentenceBERT pass (for
+    Content Preservation Score). Identical strings, including each source, are scored
+    only once. Candidates are ranked by `sti_weight * STI + cps_weight * CPS`, with
+    the beam `sequence_score` as a tie breaker.
+
+    Attributes:
+        style_transfer (StyleTransfer)
+        style_classifier (StyleIntensityClassifier)
+        content_scorer (ContentPreservationScorer)
+        sti_weight (float) - weight of the STI fraction in the ranking score
+        cps_weight (float) - weight of the unmasked CPS in the ranking score
+        target_class_idx (int) - index of the target style class
+
+    """
+
+    def __init__(
+        self,
+        style_transfer: StyleTransfer,
+        style_classifier: StyleIntensityClassifier,
+        content_scorer: ContentPreservationScorer,
+        sti_weight: float = 0.5,
+        cps_weight: float = 0.5,
+        target_class_idx: int = 1,
+    ):
+        self.style_transfer = style_transfer
+        self.style_classifier = style_classifier
+        self.content_scorer = content_scorer
+        self.sti_weight = sti_weight
+        self.cps_weight = cps_weight
+        self.target_class_idx = target_class_idx
+
+    def suggest(
+        self, input_text: Union[str, List[str]], k: int = 4
+    ) -> List[List[dict]]:
+        """
+        Generate k candidates for each input and rank them by style strength and content preservation.
+
+        Args:
+            input_text (`str` or `List[str]`) - Input text for style transfer
+            k (int) - number of candidates per input
+
+        Returns:
+            suggestions (List[List[dict]]) - for each input, k dictionaries containing the
+                `generated_text`, beam `sequence_score`, `sti` (STI fraction), `cps`
+                and combined `score`, best first
+
+        """
+        if isinstance(input_text, str):
+            input_text = [input_text]
+
+        candidates = self.style_transfer.generate_candidates(input_text, k=k)
+
+        # score every distinct string once
+        unique_text = list(
+            dict.fromkeys(
+                input_text + [c["generated_text"] for item in candidates for c in item]
+            )
+        )
+        text_idx = {text: i for i, text in enumerate(unique_text)}
+        distributions = self.style_classifier.score_array(unique_text)
+        embeddings = self.content_scorer.compute_sentence_embeddings(unique_text)
+
+        # STI fraction and CPS of every (source, candidate) pair in one call each
+        source_idxs = [
+            text_idx[source]
+            for source, item_candidates in zip(input_text, candidates)
+            for _ in item_candidates
+        ]
+        candidate_idxs = [
+            text_idx[c["generated_text"]] for item in candidates for c in item
+        ]
+        sti = sti_fraction(
+            distributions[source_idxs],
+            distributions[candidate_idxs],
+            ideal_dist=[0.0, 1.0],
+            target_class_idx=self.target_class_idx,
+            ground_distance=self.style_classifier.ground_distance,
+        ).tolist()
+        cps = self.content_scorer.cosine_similarity(
+            embeddings[source_idxs], embeddings[candidate_idxs]
+        )
+
+        suggestions = []
+        offset = 0
+        for item_candidates in candidates:
+            ranked = []
+            for candidate, candidate_sti, candidate_cps in zip(
+                item_candidates,
+                sti[offset : offset + len(item_candidates)],
+                cps[offset : offset + len(item_candidates)],
+            ):
+                ranked.append(
+                    {
+                        **candidate,
+                        "sti": candidate_sti,
+                        "cps": candidate_cps,
+                        "score": self.sti_weight * candidate_sti
+                        + self.cps_weight * candidate_cps,
+                    }
+                )
+            offset += len(item_candidates)
+
+            ranked.sort(
+                key=lambda c: (c["score"], c["sequence_score"] or 0.0), reverse=True
+            )
+            suggestions.append(ranked)
+
+        return suggestions
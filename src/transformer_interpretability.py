@@ -39,6 +39,7 @@
 # ###########################################################################
 
 import torch
+from captum.attr import visualization as viz
 from transformers_interpret import SequenceClassificationExplainer
 from transformers import (
     AutoTokenizer,
@@ -46,6 +47,7 @@ from transformers import (
 )
 
 from apps.visualization_utils import visualize_text
+from src.attribution import TokenAttribution, make_attribution_method
 
 
 class CustomSequenceClassificationExplainer(SequenceClassificationExplainer):
@@ -103,18 +105,30 @@ class InterpretTransformer:
 
     This class utilizes the [Transformers Interpret](https://github.com/cdpierse/transformers-interpret)
     libary to calculate word attributions using a techinique called Integrated Gradients.
+    Cheaper approximate methods from `src.attribution` can be selected instead.
 
     Attributes:
         cls_model_identifier (str)
+        attribution_method (str) - default word attribution method, one of
+            `src.attribution.ATTRIBUTION_METHODS`
+        ig_steps (int) - number of interpolation steps for "integrated_gradients"
 
     """
 
-    def __init__(self, cls_model_identifier: str):
+    def __init__(
+        self,
+        cls_model_identifier: str,
+        attribution_method: str = "integrated_gradients",
+        ig_steps: int = 50,
+    ):
 
         self.cls_model_identifier = cls_model_identifier
+        self.attribution_method = attribution_method
+        self.ig_steps = ig_steps
         self.device = (
             torch.cuda.current_device() if torch.cuda.is_available() else "cpu"
         )
+        self._attribution_methods = {}
 
         self._initialize_hf_artifacts()
 
@@ -138,14 +152,69 @@ class InterpretTransformer:
             self.cls_model, self.cls_tokenizer
         )
 
-    def visualize_feature_attribution_scores(self, text: str, class_index: int = 0):
+    def visualize_feature_attribution_scores(
+        self, text: str, class_index: int = 0, attribution_method: str = None
+    ):
         """
-        Calculates and visualizes feature attributions using integrated gradients.
+        Calculates and visualizes feature attributions (integrated gradients by default).
 
         Args:
             text (str) - text to get attributions for
             class_index (int) - Optional output index to provide attributions for
+            attribution_method (str) - Optional word attribution method overriding
+                `self.attribution_method` for this call
 
         """
-        self.explainer(text, index=class_index)
-        return self.explainer.visualize()
+        attribution_method = attribution_method or self.attribution_method
+        if attribution_method == "integrated_gradients":
+            self.explainer(text, index=class_index, n_steps=self.ig_steps)
+            return self.explainer.visualize()
+
+        attributions = self.get_attribution_method(attribution_method).attribute(
+            [text], class_index=class_index
+        )[0]
+        return visualize_text([self._make_visualization_record(attributions, text)])
+
+    def get_attribution_method(self, attribution_method: str) -> TokenAttribution:
+        """
+        Return the (cached) word attribution method with the given name.
+
+        """
+        if attribution_method not in self._attribution_methods:
+            self._attribution_methods[attribution_method] = make_attribution_method(
+                attribution_method,
+                self.cls_model,
+                self.cls_tokenizer,
+                ig_steps=self.ig_steps,
+            )
+        return self._attribution_methods[attribution_method]
+
+    def _make_visualization_record(
+        self, attributions: list, text: str
+    ) -> viz.VisualizationDataRecord:
+        # the same fields `CustomSequenceClassificationExplainer.visualize` renders
+        tokens = [token for token, _ in attributions]
+        scores = torch.tensor([score for _, score in attributions])
+
+        inputs = self.cls_tokenizer(
+            self.explainer._clean_text(text), truncation=True, return_tensors="pt"
+        ).to(self.cls_model.device)
+        with torch.no_grad():
+            logits = self.cls_model(**inputs)[0][0]
+        if len(logits) == 1:
+            pred_prob = float(torch.sigmoid(logits)[0])
+            predicted_index = round(pred_prob)
+        else:
+            probs = torch.softmax(logits, dim=-1)
+            pred_prob, predicted_index = float(probs.max()), int(probs.argmax())
+
+        return viz.VisualizationDataRecord(
+            scores,
+            pred_prob,
+            self.explainer.id2label.get(predicted_index, str(predicted_index)),
+            None,
+            None,
+            scores.sum(),
+            tokens,
+            None,
+        )
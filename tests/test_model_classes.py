@@ -39,12 +39,18 @@
 # ###########################################################################
 
 import pytest
+import numpy as np
 import transformers
 
 from src.style_transfer import StyleTransfer
+from src.decoding import LengthPolicy
+from src.generation_cache import GenerationCache
+from src.shortlist import VocabularyShortlist
 from src.style_classification import StyleIntensityClassifier
+from src.attribution import ATTRIBUTION_METHODS
 from src.content_preservation import ContentPreservationScorer
 from src.transformer_interpretability import InterpretTransformer
+from src.suggestion import StyleSuggester
 
 
 @pytest.fixture
@@ -153,6 +159,58 @@ def test_StyleIntensityClassifier_calculate_transfer_intensity_fraction(
     ]
 
 
+def test_StyleIntensityClassifier_empty_input(subjectivity_styleintensityclassifier):
+    classifier = subjectivity_styleintensityclassifier
+
+    assert classifier.calculate_transfer_intensity([], []) == []
+    assert classifier.calculate_transfer_intensity_fraction([], []) == []
+    assert classifier.evaluate([], []) == []
+
+
+def test_StyleIntensityClassifier_evaluate(
+    subjectivity_styleintensityclassifier, subjectivity_example_data
+):
+    evaluation = subjectivity_styleintensityclassifier.evaluate(
+        input_text=subjectivity_example_data["examples"],
+        output_text=subjectivity_example_data["ground_truth"],
+    )
+
+    assert [item["sti_fraction"] for item in evaluation] == [
+        0.9891820847234861,
+        0.9808499743983614,
+        0.8070009460737938,
+        0.9913705583756346,
+        0.9611679711017459,
+    ]
+    assert [
+        item["sti"] for item in evaluation
+    ] == subjectivity_styleintensityclassifier.calculate_transfer_intensity(
+        input_text=subjectivity_example_data["examples"],
+        output_text=subjectivity_example_data["ground_truth"],
+    )
+    labels = set(
+        subjectivity_styleintensityclassifier.pipeline.model.config.id2label.values()
+    )
+    assert all(
+        {item["input_label"], item["output_label"]} <= labels for item in evaluation
+    )
+
+
+def test_StyleIntensityClassifier_score_array(
+    subjectivity_styleintensityclassifier, subjectivity_example_data
+):
+    examples = subjectivity_example_data["examples"]
+
+    distributions = subjectivity_styleintensityclassifier.score_array(examples)
+    pipeline_output = subjectivity_styleintensityclassifier.pipeline(examples)
+
+    assert distributions.shape == (len(examples), 2)
+    assert distributions.flags["C_CONTIGUOUS"]
+    assert distributions.tolist() == [
+        [label["score"] for label in item] for item in pipeline_output
+    ]
+
+
 def test_ContentPreservationScorer_calculate_content_preservation_score(
     subjectivity_contentpreservationscorer, subjectivity_example_data
 ):
@@ -162,3 +220,300 @@ def test_ContentPreservationScorer_calculate_content_preservation_score(
         mask_type="none",
     )
     assert cps == [0.9369, 0.9856, 0.7328, 0.9718, 0.9709]
+
+
+def test_ContentPreservationScorer_one_to_many_and_pairwise(
+    subjectivity_contentpreservationscorer, subjectivity_example_data
+):
+    cps = subjectivity_contentpreservationscorer
+    examples = subjectivity_example_data["examples"]
+    ground_truth = subjectivity_example_data["ground_truth"]
+
+    one_to_many = cps.calculate_one_to_many_content_preservation_score(
+        examples[0], ground_truth, mask_type="none"
+    )
+    assert one_to_many.tolist() == pytest.approx(
+        cps.calculate_content_preservation_score(
+            [examples[0]] * len(ground_truth), ground_truth, mask_type="none"
+        ),
+        abs=1e-4,
+    )
+
+    scores = cps.calculate_pairwise_content_preservation_scores(
+        examples, ground_truth, mask_type="none"
+    )
+    assert scores.shape == (len(examples), len(ground_truth))
+    assert scores[0].tolist() == pytest.approx(one_to_many.tolist(), abs=1e-6)
+
+    indices, top_scores = cps.calculate_pairwise_content_preservation_scores(
+        examples, ground_truth, mask_type="none", top_k=2, block_size=2
+    )
+    assert indices.tolist() == np.argsort(-scores, axis=1)[:, :2].tolist()
+    assert top_scores.tolist() == pytest.approx(
+        np.take_along_axis(scores, indices, axis=1).tolist()
+    )
+
+
+def test_ContentPreservationScorer_batched_attributions(
+    subjectivity_contentpreservationscorer, subjectivity_example_data
+):
+    from transformers_interpret import SequenceClassificationExplainer
+
+    cps = subjectivity_contentpreservationscorer
+    examples = subjectivity_example_data["examples"]
+    explainer = SequenceClassificationExplainer(cps.cls_model, cps.cls_tokenizer)
+
+    batched = cps.calculate_feature_attribution_scores(examples)
+    for text, attributions in zip(examples, batched):
+        expected = explainer(text, index=0)
+        assert [token for token, _ in attributions] == [token for token, _ in expected]
+        assert [score for _, score in attributions] == pytest.approx(
+            [score for _, score in expected], abs=1e-5
+        )
+
+    assert cps.mask_style_tokens(examples) == [
+        cps.mask_style_tokens(text) for text in examples
+    ]
+
+
+def test_ContentPreservationScorer_attribution_methods(
+    subjectivity_contentpreservationscorer, subjectivity_example_data
+):
+    cps = subjectivity_contentpreservationscorer
+    examples = subjectivity_example_data["examples"]
+    reference = cps.calculate_feature_attribution_scores(examples)
+
+    for method in ATTRIBUTION_METHODS:
+        attributions = cps.calculate_feature_attribution_scores(
+            examples, attribution_method=method
+        )
+        for item, reference_item in zip(attributions, reference):
+            scores = np.array([score for _, score in item])
+            assert [token for token, _ in item] == [
+                token for token, _ in reference_item
+            ]
+            assert scores[0] == scores[-1] == 0.0
+            assert np.linalg.norm(scores) == pytest.approx(1.0)
+
+        masked = cps.mask_style_tokens(examples, attribution_method=method)
+        assert all("[PAD]" in text for text in masked)
+
+
+def test_StyleTransfer_transfer_document(
+    subjectivity_styletransfer, subjectivity_example_data
+):
+    examples = subjectivity_example_data["examples"]
+    ground_truth = subjectivity_example_data["ground_truth"]
+    document = f"{examples[2]}  {examples[3]}\n\n{examples[4]}"
+
+    output = subjectivity_styletransfer.transfer_document(document)
+
+    assert (
+        output["generated_text"]
+        == f"{ground_truth[2]}  {ground_truth[3]}\n\n{ground_truth[4]}"
+    )
+    assert [item["text"] for item in output["sentences"]] == examples[2:]
+
+
+def test_StyleTransfer_transfer_stream(
+    subjectivity_styletransfer, subjectivity_example_data
+):
+    partial_outputs = list(
+        subjectivity_styletransfer.transfer_stream(
+            subjectivity_example_data["examples"][3]
+        )
+    )
+
+    assert partial_outputs[-1] == subjectivity_example_data["ground_truth"][3]
+    assert len(partial_outputs) > 1
+
+
+def test_StyleTransfer_prompt_lookup_decoding(subjectivity_example_data):
+    MODEL_PATH = "cffl/bart-base-styletransfer-subjective-to-neutral"
+    greedy = StyleTransfer(model_identifier=MODEL_PATH, num_beams=1)
+    speculative = StyleTransfer(
+        model_identifier=MODEL_PATH, num_beams=1, prompt_lookup_decoding=True
+    )
+
+    assert greedy.transfer(
+        subjectivity_example_data["examples"]
+    ) == speculative.transfer(subjectivity_example_data["examples"])
+    assert speculative.prompt_lookup_stats["acceptance_rate"] > 0.5
+
+
+def test_StyleTransfer_length_policy(subjectivity_example_data):
+    MODEL_PATH = "cffl/bart-base-styletransfer-subjective-to-neutral"
+    length_policy = LengthPolicy(max_ratio=1.2, max_slack=5)
+    style_transfer = StyleTransfer(
+        model_identifier=MODEL_PATH, length_policy=length_policy
+    )
+
+    assert subjectivity_example_data["ground_truth"] == style_transfer.transfer(
+        subjectivity_example_data["examples"]
+    )
+    assert length_policy.stats == {"items": 5, "cap_hits": 0}
+
+
+def test_StyleTransfer_transfer_stream_length_policy(subjectivity_example_data):
+    MODEL_PATH = "cffl/bart-base-styletransfer-subjective-to-neutral"
+    length_policy = LengthPolicy(max_ratio=0.3, max_slack=0)
+    style_transfer = StyleTransfer(
+        model_identifier=MODEL_PATH,
+        length_policy=length_policy,
+        cache=GenerationCache(),
+    )
+    example = subjectivity_example_data["examples"][2]
+
+    partial_outputs = list(style_transfer.transfer_stream(example))
+    style_transfer.cache.clear()
+
+    assert partial_outputs[-1] == style_transfer.transfer([example])[0]
+    assert length_policy.stats == {"items": 2, "cap_hits": 2}
+
+
+def test_StyleTransfer_transfer_max_time(
+    subjectivity_styletransfer, subjectivity_example_data
+):
+    examples = subjectivity_example_data["examples"]
+
+    details = subjectivity_styletransfer.transfer(
+        examples, max_time=[None, 0.0, None, 0.0, None], return_details=True
+    )
+
+    assert [item["truncated"] for item in details] == [
+        False,
+        True,
+        False,
+        True,
+        False,
+    ]
+    assert [details[i]["generated_text"] for i in (0, 2, 4)] == [
+        subjectivity_example_data["ground_truth"][i] for i in (0, 2, 4)
+    ]
+    assert all(item["elapsed"] >= 0 for item in details)
+
+
+def test_StyleTransfer_vocabulary_shortlist(subjectivity_example_data):
+    MODEL_PATH = "cffl/bart-base-styletransfer-subjective-to-neutral"
+    greedy = StyleTransfer(model_identifier=MODEL_PATH, num_beams=1)
+    shortlist = VocabularyShortlist.from_tokenizer(
+        greedy.pipeline.tokenizer, frequent_tokens=["the", "a", "is", ","]
+    )
+    exact = StyleTransfer(
+        model_identifier=MODEL_PATH,
+        num_beams=1,
+        vocabulary_shortlist=shortlist,
+        shortlist_min_confidence=1.0,
+    )
+
+    assert greedy.transfer(subjectivity_example_data["examples"]) == exact.transfer(
+        subjectivity_example_data["examples"]
+    )
+    assert exact.shortlist_stats["fallback_rate"] == 1.0
+
+
+def test_StyleTransfer_transfer_stream_vocabulary_shortlist(subjectivity_example_data):
+    MODEL_PATH = "cffl/bart-base-styletransfer-subjective-to-neutral"
+    greedy = StyleTransfer(model_identifier=MODEL_PATH, num_beams=1)
+    shortlist = VocabularyShortlist.from_tokenizer(
+        greedy.pipeline.tokenizer, frequent_tokens=["the", "a", "is", ","]
+    )
+    style_transfer = StyleTransfer(
+        model_identifier=MODEL_PATH,
+        num_beams=1,
+        vocabulary_shortlist=shortlist,
+        shortlist_min_confidence=0.0,
+    )
+    example = subjectivity_example_data["examples"][2]
+
+    partial_outputs = list(style_transfer.transfer_stream(example))
+
+    assert partial_outputs[-1] == style_transfer.transfer([example])[0]
+    assert style_transfer.shortlist_stats["batches"] == 2
+
+
+def test_StyleTransfer_transfer_minimal_edit(
+    subjectivity_styletransfer,
+    subjectivity_contentpreservationscorer,
+    subjectivity_example_data,
+):
+    text = subjectivity_example_data["examples"][3]
+    style_spans = subjectivity_contentpreservationscorer.find_style_spans(text)
+
+    assert style_spans
+    assert all(0 <= start < end <= len(text) for start, end in style_spans)
+
+    unchanged, edited = subjectivity_styletransfer.transfer_minimal_edit(
+        [text, text], [[], style_spans]
+    )
+
+    assert unchanged["generated_text"] == text
+    assert unchanged["num_generated_tokens"] == 0
+    assert edited["generated_text"].endswith(text[style_spans[-1][1] :])
+    assert edited["num_generated_tokens"] < edited["num_copied_tokens"]
+
+
+def test_StyleTransfer_return_scores_and_score_pairs(
+    subjectivity_styletransfer, subjectivity_example_data
+):
+    examples = subjectivity_example_data["examples"]
+    ground_truth = subjectivity_example_data["ground_truth"]
+
+    details = subjectivity_styletransfer.transfer(examples, return_scores=True)
+
+    assert [item["generated_text"] for item in details] == ground_truth
+    assert all(item["sequence_score"] < 0 for item in details)
+    assert all(len(item["token_logprobs"]) > 0 for item in details)
+
+    matched = subjectivity_styletransfer.score_pairs(examples, ground_truth)
+    mismatched = subjectivity_styletransfer.score_pairs(examples, ground_truth[::-1])
+
+    # reversing pairs every candidate except the middle one with another source
+    assert all(
+        matched[i]["sequence_score"] > mismatched[i]["sequence_score"]
+        for i in (0, 1, 3, 4)
+    )
+
+
+def test_StyleTransfer_transfer_sweep(
+    subjectivity_styletransfer, subjectivity_example_data
+):
+    configs = [{"num_beams": 4}, {"num_beams": 1, "max_gen_length": 100}]
+
+    results = subjectivity_styletransfer.transfer_sweep(
+        subjectivity_example_data["examples"], configs
+    )
+
+    assert len(results) == len(configs) * len(subjectivity_example_data["examples"])
+    assert (
+        results[results["config_idx"] == 0]["generated_text"].tolist()
+        == subjectivity_example_data["ground_truth"]
+    )
+    assert (
+        results[results["config_idx"] == 1]["generated_text"].tolist()
+        == subjectivity_styletransfer.with_generation_config(
+            num_beams=1, max_gen_length=100
+        ).transfer(subjectivity_example_data["examples"])
+    )
+
+
+def test_StyleSuggester_suggest(
+    subjectivity_styletransfer,
+    subjectivity_styleintensityclassifier,
+    subjectivity_contentpreservationscorer,
+    subjectivity_example_data,
+):
+    suggester = StyleSuggester(
+        style_transfer=subjectivity_styletransfer,
+        style_classifier=subjectivity_styleintensityclassifier,
+        content_scorer=subjectivity_contentpreservationscorer,
+    )
+
+    suggestions = suggester.suggest(subjectivity_example_data["examples"], k=3)
+
+    assert len(suggestions) == len(subjectivity_example_data["examples"])
+    for ranked in suggestions:
+        assert len(ranked) == 3
+        assert [c["score"] for c in ranked] == sorted(
+            [c["score"] for c in ranked], reverse=True
+        )
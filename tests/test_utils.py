@@ -0,0 +1,589 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2022
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+import time
+import sqlite3
+import threading
+from types import SimpleNamespace
+
+import pytest
+import numpy as np
+import torch
+from pyemd import emd
+
+from src.attribution import TokenAttribution
+from src.batching import TokenBudgetBatcher
+from src.content_preservation import ContentPreservationScorer
+from src.embedding_store import EmbeddingStore
+from src.emd import batched_emd, direction_corrected_emd, sti_fraction
+from src.generation_cache import GenerationCache
+from src.incremental import IncrementalTransferSession
+from src.segmentation import MAX_WORD_LOOKBACK, split_sentences, replace_spans
+from src.style_cascade import HashedNgramClassifier, StyleCascade
+from src.style_lexicon import LexiconAttribution, StyleLexicon, masking_agreement
+from src.style_monitor import DocumentStyleMonitor
+from src.style_profile import StyleProfiler
+from src.shortlist import VocabularyShortlist
+
+
+# test TokenBudgetBatcher
+def test_TokenBudgetBatcher_make_batches():
+    batcher = TokenBudgetBatcher(max_tokens_per_batch=20, batch_size=3)
+    lengths = [4, 250, 5, 3, 6, 4]
+
+    batches = batcher.make_batches(lengths)
+
+    assert sorted(idx for batch in batches for idx in batch) == list(range(6))
+    assert [1] in batches
+    for batch in batches:
+        assert len(batch) <= 3
+        if len(batch) > 1:
+            assert len(batch) * max(lengths[idx] for idx in batch) <= 20
+
+
+def test_TokenBudgetBatcher_run_preserves_order():
+    batcher = TokenBudgetBatcher(batch_size=2)
+    items = ["ccc", "a", "bbbb", "dd"]
+
+    results = batcher.run(
+        items, [len(item) for item in items], lambda batch: [i.upper() for i in batch]
+    )
+
+    assert results == ["CCC", "A", "BBBB", "DD"]
+
+
+def test_TokenBudgetBatcher_run_splits_on_memory_error():
+    batcher = TokenBudgetBatcher(batch_size=4)
+    calls = []
+
+    def batch_fn(batch):
+        calls.append(len(batch))
+        if len(batch) > 1:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return batch
+
+    assert batcher.run([1, 2, 3, 4], [1, 1, 1, 1], batch_fn) == [1, 2, 3, 4]
+    assert calls[0] == 4
+
+    def failing_batch_fn(batch):
+        raise RuntimeError("some other error")
+
+    with pytest.raises(RuntimeError, match="some other error"):
+        batcher.run([1, 2], [1, 1], failing_batch_fn)
+
+
+# test sentence segmentation
+def test_split_sentences_and_replace_spans():
+    document = "the band plays pop.  dr. kosugi is great!\n\nanother saloon came from james y. young."
+
+    spans = split_sentences(document)
+
+    assert [span.text for span in spans] == [
+        "the band plays pop.",
+        "dr. kosugi is great!",
+        "another saloon came from james y. young.",
+    ]
+    assert all(document[span.start : span.end] == span.text for span in spans)
+    assert replace_spans(document, spans, ["a.", "b!", "c."]) == "a.  b!\n\nc."
+
+    # single line breaks in hard-wrapped text do not end a sentence
+    wrapped = "the band plays\npop music.\nit is\ngreat!\n\nanother\nparagraph"
+    assert [span.text for span in split_sentences(wrapped)] == [
+        "the band plays\npop music.",
+        "it is\ngreat!",
+        "another\nparagraph",
+    ]
+
+    # only a bounded window before each period is inspected
+    long_word = "x" * (MAX_WORD_LOOKBACK + 8)
+    assert [span.text for span in split_sentences(f"{long_word}. dr. no. a.")] == [
+        f"{long_word}.",
+        "dr. no. a.",
+    ]
+
+
+# test GenerationCache
+def test_GenerationCache_get_or_compute():
+    cache = GenerationCache(max_size=2)
+    config = {"num_beams": 4}
+    keys = [
+        cache.make_key("model", text, config)
+        for text in ["a  sentence", "a sentence", "another"]
+    ]
+    computed = []
+
+    def compute_fn(idxs):
+        computed.append(idxs)
+        return [f"out-{idx}" for idx in idxs]
+
+    assert cache.get_or_compute(keys, compute_fn) == ["out-0", "out-0", "out-2"]
+    assert cache.get_or_compute(keys[1:], compute_fn) == ["out-0", "out-2"]
+    assert computed == [[0, 2]]
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 2
+    assert keys[0] != cache.make_key("model", "a sentence", {"num_beams": 8})
+
+
+def test_GenerationCache_ttl_and_disk(tmp_path):
+    path = str(tmp_path / "generations.sqlite")
+    key = GenerationCache.make_key("model", "text", {})
+
+    GenerationCache(path=path).get_or_compute([key], lambda idxs: ["stored"])
+
+    assert GenerationCache(path=path).get_or_compute([key], lambda idxs: ["new"]) == [
+        "stored"
+    ]
+    assert GenerationCache(path=path, ttl=-1).get_or_compute(
+        [key], lambda idxs: ["new"]
+    ) == ["new"]
+
+
+def test_GenerationCache_disk_evicts_least_recently_accessed(tmp_path):
+    path = str(tmp_path / "generations.sqlite")
+    keys = [GenerationCache.make_key("model", text, {}) for text in "abcd"]
+
+    cache = GenerationCache(max_size=2, path=path)
+    cache.set(keys[0], "a")
+    cache.set(keys[1], "b")
+    cache.get(keys[0])
+    cache.set(keys[2], "c")
+
+    reader = GenerationCache(path=path)
+    assert [reader.get(key)[0] for key in keys[:3]] == [True, False, True]
+
+    # a batch of misses is written in one go and pruned to max_size once
+    values = cache.get_or_compute(keys, lambda idxs: [str(idx) for idx in idxs])
+    assert values == ["a", "1", "c", "3"]
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT COUNT(*) FROM generations").fetchone() == (2,)
+
+    # expired rows are deleted on the next write, not just skipped on read
+    with sqlite3.connect(path) as db:
+        db.execute("UPDATE generations SET created = created - 100")
+    GenerationCache(ttl=50, path=path).set(keys[3], "d")
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT value FROM generations").fetchall() == [('"d"',)]
+
+
+def test_GenerationCache_coalesces_in_flight_requests():
+    cache = GenerationCache()
+    key = cache.make_key("model", "text", {})
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_compute_fn(idxs):
+        calls.append(idxs)
+        started.set()
+        release.wait(5)
+        return ["out"]
+
+    results = []
+    first = threading.Thread(
+        target=lambda: results.append(cache.get_or_compute([key], slow_compute_fn))
+    )
+    first.start()
+    started.wait(5)
+    second = threading.Thread(
+        target=lambda: results.append(cache.get_or_compute([key], slow_compute_fn))
+    )
+    second.start()
+    while cache.stats["coalesced"] == 0:
+        time.sleep(0.01)
+    release.set()
+    first.join()
+    second.join()
+
+    assert results == [["out"], ["out"]]
+    assert len(calls) == 1
+
+
+def test_VocabularyShortlist_token_ids_and_save(tmp_path):
+    shortlist = VocabularyShortlist(
+        frequent_token_ids=[5, 3], lexicon={10: [11, 12]}, special_token_ids=[0, 2]
+    )
+
+    assert shortlist.token_ids([10, 7]) == [0, 2, 3, 5, 7, 10, 11, 12]
+    assert shortlist.token_ids([]) == [0, 2, 3, 5]
+
+    path = str(tmp_path / "shortlist.json")
+    shortlist.save(path)
+    loaded = VocabularyShortlist.load(path)
+    assert loaded.token_ids([10]) == shortlist.token_ids([10])
+    assert loaded.fingerprint == shortlist.fingerprint
+
+
+class UppercaseTransfer:
+    model_identifier = "uppercase"
+    generation_config = {}
+
+    def __init__(self):
+        self.calls = []
+
+    def transfer(self, input_text):
+        self.calls.append(list(input_text))
+        return [text.upper() for text in input_text]
+
+
+def test_IncrementalTransferSession_only_transfers_edited_sentences():
+    style_transfer = UppercaseTransfer()
+    session = IncrementalTransferSession(style_transfer)
+
+    first = session.update("One fish. Two fish.\n\nRed fish.")
+    assert first["generated_text"] == "ONE FISH. TWO FISH.\n\nRED FISH."
+    assert first["transferred"] == 3
+
+    second = session.update("One fish. Two  fish.\n\nBlue fish. Red fish.")
+    assert second["generated_text"] == "ONE FISH. TWO FISH.\n\nBLUE FISH. RED FISH."
+    assert style_transfer.calls[-1] == ["Blue fish."]
+    assert [item["reused"] for item in second["sentences"]] == [
+        True,
+        True,
+        False,
+        True,
+    ]
+    assert session.stats == {"revisions": 2, "sentences": 7, "transferred": 4}
+
+    session.reset()
+    assert session.update("One fish.")["transferred"] == 1
+
+
+def test_batched_emd_matches_pyemd():
+    rng = np.random.default_rng(0)
+    input_dists = rng.dirichlet(np.ones(4), size=50)
+    output_dists = rng.dirichlet(np.ones(4), size=50)
+    ordinal = np.abs(np.subtract.outer(np.arange(4), np.arange(4))).astype(float)
+    arbitrary = ordinal**2
+
+    for name, matrix in [
+        ("uniform", np.ones((4, 4))),
+        ("ordinal", ordinal),
+        (arbitrary, arbitrary),
+    ]:
+        expected = [emd(p, q, matrix) for p, q in zip(input_dists, output_dists)]
+        assert np.allclose(batched_emd(input_dists, output_dists, name), expected)
+
+
+def test_sti_fraction_direction_correction():
+    input_dists = [[0.8, 0.2], [0.3, 0.7], [0.5, 0.5]]
+    output_dists = [[0.1, 0.9], [0.6, 0.4], [0.5, 0.5]]
+
+    assert direction_corrected_emd(input_dists, output_dists).tolist() == [
+        0.7,
+        -0.3,
+        0.0,
+    ]
+    assert np.allclose(
+        sti_fraction(input_dists, output_dists)[:2], [0.7 / 0.8, -0.3 / -0.7]
+    )
+
+
+def test_sti_empty_input():
+    assert direction_corrected_emd([], []).shape == (0,)
+    assert sti_fraction([], []).shape == (0,)
+    assert direction_corrected_emd(np.empty((0, 2)), np.empty((0, 2))).shape == (0,)
+
+
+class KeywordClassifier:
+    """Stand-in for StyleIntensityClassifier that flags a few subjective words."""
+
+    keywords = {"amazing", "stunning", "terrible", "awful"}
+    pipeline = SimpleNamespace(
+        model=SimpleNamespace(
+            config=SimpleNamespace(id2label={0: "neutral", 1: "subjective"})
+        )
+    )
+
+    def __init__(self):
+        self.num_scored = 0
+
+    def score_array(self, input_text):
+        self.num_scored += len(input_text)
+        words = [set(text.replace(".", " ").split()) for text in input_text]
+        return np.array(
+            [[0.05, 0.95] if self.keywords & w else [0.97, 0.03] for w in words],
+            dtype=np.float32,
+        )
+
+
+def test_StyleCascade_distill_and_escalate(tmp_path):
+    rng = np.random.default_rng(0)
+    filler = "the a of and in to is was for on with as by at from".split()
+    corpus = []
+    for _ in range(1000):
+        words = list(rng.choice(filler, 8))
+        if rng.random() < 0.5:
+            words.insert(3, rng.choice(sorted(KeywordClassifier.keywords)))
+        corpus.append(" ".join(words))
+
+    teacher = KeywordClassifier()
+    cascade = StyleCascade.distill(
+        teacher, corpus[:800], student_kwargs={"num_features": 2**14}
+    )
+    teacher.num_scored = 0
+
+    report = cascade.evaluate(corpus[800:])
+    assert report["agreement"] >= report["student_agreement"] >= 0.95
+    assert report["escalation_rate"] < 0.5
+    # evaluate runs the full model once per item and leaves the running stats alone
+    assert teacher.num_scored == 200
+    assert cascade.stats["items"] == 0
+
+    cascade.score_array(corpus[800:])
+    assert report["escalation_rate"] == cascade.stats["escalated"] / 200
+
+    path = str(tmp_path / "student.npz")
+    cascade.student.save(path)
+    assert np.allclose(
+        HashedNgramClassifier.load(path).predict_proba(corpus[:5]),
+        cascade.student.predict_proba(corpus[:5]),
+    )
+
+
+def test_DocumentStyleMonitor_only_scores_new_sentences():
+    classifier = KeywordClassifier()
+    monitor = DocumentStyleMonitor(classifier)
+
+    first = monitor.update("The view is amazing. The road is long.")
+    assert [item["label"] for item in first["sentences"]] == ["subjective", "neutral"]
+    assert first["scored"] == 2
+
+    second = monitor.update("The view is amazing. The road is long. It rains")
+    assert second["scored"] == 1
+    assert classifier.num_scored == 3
+    assert [item["rescored"] for item in second["sentences"]] == [False, False, True]
+    assert second["label"] == "neutral"
+    assert np.isclose(sum(second["distribution"]), 1.0)
+
+    assert monitor.update("")["distribution"] is None
+
+
+class WhitespaceTokenizer:
+    """Stand-in for a slow tokenizer that counts how often it is called."""
+
+    name_or_path = "whitespace"
+    model_max_length = 512
+
+    def __init__(self):
+        self.num_calls = 0
+
+    def __call__(self, input_text, truncation=False):
+        self.num_calls += 1
+        return {"input_ids": [[len(w) for w in text.split()] for text in input_text]}
+
+
+def test_StyleProfiler_shares_tokenization():
+    tokenizer = WhitespaceTokenizer()
+    seen_ids = []
+
+    class TokenizedKeywordClassifier(KeywordClassifier):
+        pipeline = SimpleNamespace(
+            model=KeywordClassifier.pipeline.model, tokenizer=tokenizer
+        )
+
+        def score_array(self, input_text, input_ids=None):
+            seen_ids.append(input_ids)
+            return super().score_array(input_text)
+
+    profiler = StyleProfiler(
+        {"tone": TokenizedKeywordClassifier(), "mood": TokenizedKeywordClassifier()},
+        num_threads=1,
+    )
+    profile = profiler.profile(["what a stunning view.", "the bus was late."])
+    profiler.close()
+
+    assert tokenizer.num_calls == 1
+    assert seen_ids[0] == seen_ids[1] == [[4, 1, 8, 5], [3, 3, 3, 5]]
+    assert profile["tone_label"].tolist() == ["subjective", "neutral"]
+    assert profile["mood_subjective"].tolist() == pytest.approx([0.95, 0.03])
+    assert set(profiler.last_elapsed) == {"tone", "mood"}
+
+
+def test_select_style_token_mask_matches_dataframe_selection():
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(2, 40, size=64)
+    scores = np.full((len(lengths), lengths.max()), np.nan)
+    for row, length in zip(scores, lengths):
+        row[:length] = rng.normal(size=length) * rng.random(size=length) ** 3
+        row[0] = row[length - 1] = 0.0  # special tokens carry no attribution
+
+    for threshold in [0.05, 0.3, 0.9]:
+        mask = ContentPreservationScorer.select_style_token_mask(
+            scores, lengths, threshold
+        )
+        for row, length, row_mask in zip(scores, lengths, mask):
+            attributions_df = (
+                ContentPreservationScorer.format_feature_attribution_scores(
+                    [("token", score) for score in row[:length]]
+                )
+            )
+            expected = ContentPreservationScorer.select_style_token_idxs(
+                attributions_df, threshold
+            )
+            assert np.flatnonzero(row_mask).tolist() == sorted(expected)
+
+
+def test_EmbeddingStore_shared_lookup_and_eviction(tmp_path):
+    writer = EmbeddingStore(str(tmp_path), dim=3, max_size=8)
+    writer.put(["hello  world", "foo"], np.eye(2, 3), "sbert")
+
+    # a second instance (e.g. another worker process) sees the committed vectors
+    reader = EmbeddingStore(str(tmp_path), dim=3, max_size=8)
+    vectors, found = reader.get(["hello world", "bar", "foo"], "sbert")
+    assert found.tolist() == [True, False, True]
+    assert vectors.tolist() == [[1, 0, 0], [0, 1, 0]]
+    assert not reader.get(["foo"], "other-model")[1].any()
+
+    texts = [f"sentence {i}" for i in range(10)]
+    writer.put(texts, np.arange(30).reshape(10, 3), "sbert")
+    assert writer.stats["compactions"] == 1
+    assert len(reader) <= 8
+
+    vectors, found = reader.get(texts, "sbert")
+    assert found[-1] and vectors[-1].tolist() == [27, 28, 29]
+    # contiguous hits are read-only views into the memory map, others are copied
+    assert not vectors.flags.writeable
+    assert reader.get(texts[::-1], "sbert")[0].flags.writeable
+    assert not reader.get(["hello world"], "sbert")[1].any()
+
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path), dim=4)
+
+
+def test_EmbeddingStore_reader_follows_concurrent_compactions(tmp_path, monkeypatch):
+    writer = EmbeddingStore(str(tmp_path), dim=2, max_size=2)
+    reader = EmbeddingStore(str(tmp_path), dim=2, max_size=2)
+    stale_paths = reader._generation_paths()
+
+    writer.put(["a", "b"], np.zeros((2, 2)), "sbert")
+    writer.put(["c"], np.ones((1, 2)), "sbert")
+    assert writer.stats["compactions"] == 1
+
+    # the reader lists the generation a second compaction just unlinked
+    listings = iter([stale_paths])
+    monkeypatch.setattr(
+        reader,
+        "_generation_paths",
+        lambda: next(listings, None) or EmbeddingStore._generation_paths(writer),
+    )
+    vectors, found = reader.get(["c"], "sbert")
+    assert found.all() and vectors.tolist() == [[1, 1]]
+
+
+class WordTokenizer:
+    """Stand-in for a tokenizer with one token per word between [CLS] and [SEP]."""
+
+    pad_token_id = 0
+
+    def __init__(self):
+        self.vocab = ["[PAD]", "[CLS]", "[SEP]"]
+
+    def encode(self, text, truncation=False):
+        for word in text.split():
+            if word not in self.vocab:
+                self.vocab.append(word)
+        return [1] + [self.vocab.index(word) for word in text.split()] + [2]
+
+    def convert_ids_to_tokens(self, ids):
+        return [self.vocab[i] for i in ids]
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 2
+
+
+class ConstantAttribution(TokenAttribution):
+    """Stand-in attribution method that gives every token the same score."""
+
+    def __init__(self, value):
+        super().__init__(model=None, tokenizer=WordTokenizer())
+        self.value = value
+
+    def _attribute(self, input_ids, baseline_ids, class_index):
+        return [torch.full((len(ids),), self.value) for ids in input_ids]
+
+
+def test_TokenAttribution_normalizes_zero_scores():
+    (zeros,) = ConstantAttribution(0.0).attribute(["nothing to see"])
+    (ones,) = ConstantAttribution(1.0).attribute(["nothing to see"])
+
+    assert [score for _, score in zeros] == [0.0] * 5
+    assert np.allclose([score for _, score in ones], 1 / np.sqrt(5))
+
+
+def test_StyleLexicon_build_and_lookup(tmp_path):
+    attributions = [
+        [("[CLS]", 0.0), ("a", 0.1), ("stunning", 0.9), ("view", -0.2), ("[SEP]", 0.0)],
+        [("[CLS]", 0.0), ("stunning", -0.8), ("work", 0.4), ("[SEP]", 0.0)],
+        [("[CLS]", 0.0), ("a", 0.3), ("view", 0.1), ("[SEP]", 0.0)],
+    ]
+    lexicon = StyleLexicon.from_attributions(
+        attributions, min_count=2, model_identifier="bert"
+    )
+    assert set(lexicon.weights) == {"a", "stunning", "view"}
+    assert lexicon.weights["stunning"] > lexicon.weights["a"]
+
+    lexicon.save(str(tmp_path / "lexicon.json"))
+    loaded = StyleLexicon.load(str(tmp_path / "lexicon.json"))
+    assert loaded.fingerprint == lexicon.fingerprint
+
+    lexicon_attribution = LexiconAttribution(loaded, WordTokenizer())
+    assert lexicon_attribution.model is None
+    assert lexicon_attribution.batcher is not None
+    lexicon_attributions = lexicon_attribution.attribute(
+        ["what a stunning view", "plain work"]
+    )
+    tokens, scores = zip(*lexicon_attributions[0])
+    assert tokens == ("[CLS]", "what", "a", "stunning", "view", "[SEP]")
+    assert scores[0] == scores[1] == scores[-1] == 0.0
+    assert max(scores) == scores[3]
+    # a sentence without lexicon tokens is attributed nothing, not nan
+    assert [score for _, score in lexicon_attributions[1]] == [0.0] * 4
+
+    reference = [
+        [
+            ("[CLS]", 0.0),
+            ("what", 0.05),
+            ("a", 0.1),
+            ("stunning", 0.9),
+            ("view", -0.2),
+            ("[SEP]", 0.0),
+        ]
+    ]
+    agreement = masking_agreement(lexicon_attributions[:1], reference)
+    assert agreement["exact"] == 1.0 and agreement["f1"] == 1.0